@@ -8,11 +8,14 @@ import json
 from sqlalchemy import func
 import torch
 import torch.nn as nn
-from torchvision import transforms
-from PIL import Image
 import io
 import base64
 from cnn_model import CNN
+# Apply the tuned thread settings (farmercrophealthbackend/autotune.py) before the model is loaded
+from inference_profile import apply_profile
+apply_profile()
+from model_registry import check_reload_path, get_registry
+from preprocessing import preprocess_image
 
 # Add the current directory to Python path for imports
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -43,34 +46,18 @@ data_path = os.path.join(backend_dir, 'TG_AP_CropData.csv')
 # Load the data once on startup
 trends_analyzer = CropTrends(data_path)
 
-# Load the PyTorch model and classes once on startup
-model = None
-class_names = None
+# The PyTorch model and classes are owned by the shared model registry
+crop_health_model_path = os.environ.get('CROP_HEALTH_MODEL_PATH', os.path.join(backend_dir, 'plantvillage_deepcnn_fullmodel.pt'))
+# Quantized execution: 'off', 'dynamic' or 'static' (see farmercrophealthbackend/quantization.py)
+crop_health_quantization = os.environ.get('CROP_HEALTH_QUANTIZATION', 'off')
+# Execution backend: 'torch' or 'onnx' (see farmercrophealthbackend/onnx_backend.py)
+crop_health_backend = os.environ.get('CROP_HEALTH_BACKEND', 'torch')
+crop_health_registry = get_registry(crop_health_model_path, os.path.join(backend_dir, 'classes.json'),
+                                    quantization=crop_health_quantization, backend=crop_health_backend)
 
 def load_crop_health_model():
-    """Load the PyTorch model and class names for crop health prediction"""
-    global model, class_names
-    try:
-        # Load class names
-        backend_dir = os.path.dirname(os.path.abspath(__file__))
-        classes_path = os.path.join(backend_dir, 'classes.json')
-        model_path = os.path.join(backend_dir, 'plantvillage_deepcnn_fullmodel.pt')
-
-        with open(classes_path, 'r') as f:
-            class_names = json.load(f)
-        
-        # Load the model
-        model_instance = torch.load(model_path, map_location=torch.device('cpu'))
-        model_instance.eval()
-        model = model_instance
-        
-        print("✅ Crop health model loaded successfully")
-        print(f"📊 Number of classes: {len(class_names)}")
-        
-    except Exception as e:
-        print(f"❌ Error loading crop health model: {str(e)}")
-        model = None
-        class_names = None
+    """Start loading and warming up the crop health model without blocking startup"""
+    crop_health_registry.start_background_load()
 
 # Load the model on startup
 load_crop_health_model()
@@ -364,6 +351,7 @@ def predict_crop_health():
     """
     try:
         # Check if model is loaded
+        model, class_names = crop_health_registry.get()
         if model is None or class_names is None:
             return jsonify({
                 'error': 'Crop health model not loaded. Please try again later.'
@@ -393,26 +381,8 @@ def predict_crop_health():
 
         # Read and preprocess the image
         try:
-            # Open image using PIL
-            image = Image.open(image_file.stream)
-            
-            # Convert to RGB if necessary
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            # Define the same transforms used during training
-            transform = transforms.Compose([
-                transforms.Resize((224, 224)),  # Resize to model input size
-                transforms.ToTensor(),          # Convert to tensor
-                transforms.Normalize(           # Normalize with ImageNet stats
-                    mean=[0.485, 0.456, 0.406],
-                    std=[0.229, 0.224, 0.225]
-                )
-            ])
-            
-            # Apply transforms
-            image_tensor = transform(image)
-            image_tensor = image_tensor.unsqueeze(0)  # Add batch dimension
+            # Decode, resize and normalize with the pipeline shared with farmercrophealthbackend
+            image_tensor = preprocess_image(image_file.stream)
             
         except Exception as e:
             return jsonify({
@@ -460,6 +430,26 @@ def predict_crop_health():
             'error': f'Unexpected error: {str(e)}'
         }), 500
 
+# Crop Health Model Readiness and Reload Routes
+@app.route('/api/crop_health/ready', methods=['GET'])
+def crop_health_ready():
+    """Readiness probe: 200 once the model is loaded and warmed up, 503 before that"""
+    readiness = crop_health_registry.readiness()
+    return jsonify(readiness), (200 if readiness['ready'] else 503)
+
+@app.route('/api/crop_health/reload', methods=['POST'])
+def crop_health_reload():
+    """Swap in a new weights file without a restart. Optional JSON body: {"model_path": "..."}, inside MODEL_RELOAD_DIR"""
+    data = request.get_json(silent=True) or {}
+    model_path = data.get('model_path')
+    if model_path:
+        try:
+            model_path = check_reload_path(model_path, crop_health_registry.model_path)
+        except ValueError as e:
+            return jsonify({'reloaded': False, 'error': str(e)}), 400
+    result = crop_health_registry.reload(model_path)
+    return jsonify(result), (200 if result['reloaded'] else 500)
+
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 5001))
     app.run(host='0.0.0.0', port=port, debug=True)
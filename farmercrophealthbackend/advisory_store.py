@@ -0,0 +1,191 @@
+# advisory_store.py
+"""
+Versioned store of precomputed agent advisories.
+
+The class space is closed (classes.json), so most of what the agents say
+depends only on the class and, for a few sections, on the location and
+language. precompute_advisories.py runs those prompts offline for every class
+x location x language and writes them here as one version. The orchestrators
+read the active version first and call the LLM only on a miss. The active
+version is the newest complete one, or ADVISORY_STORE_VERSION if that is set.
+
+Entries are keyed by (class_name, section, location, language). An empty
+location or language means the section does not depend on it. The active
+version is held in memory and re-read when a newer version completes, so a
+lookup is a dict access.
+"""
+
+import copy
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+# --- Configuration ---
+ADVISORY_STORE_DB = os.getenv("ADVISORY_STORE_DB")  # sqlite file; unset disables the store
+ADVISORY_STORE_VERSION = os.getenv("ADVISORY_STORE_VERSION")  # Pin a version instead of the newest complete one
+ADVISORY_STORE_POLL_SECONDS = float(os.getenv("ADVISORY_STORE_POLL_SECONDS", "60"))
+ADVISORY_DEFAULT_LANGUAGE = os.getenv("ADVISORY_DEFAULT_LANGUAGE", "en")
+
+
+def normalize_location(location: Optional[str]) -> str:
+    return " ".join((location or "").split()).casefold()
+
+
+def normalize_language(language: Optional[str]) -> str:
+    """Primary subtag of an Accept-Language value: "en-US,en;q=0.9" -> "en"."""
+    return (language or "").split(",")[0].split(";")[0].split("-")[0].strip().lower()
+
+
+class AdvisoryStore:
+    def __init__(self, db_path: str, version: Optional[str] = ADVISORY_STORE_VERSION,
+                 poll_seconds: float = ADVISORY_STORE_POLL_SECONDS):
+        self.db_path = db_path
+        self.pinned_version = version
+        self.poll_seconds = poll_seconds
+        self.lock = threading.Lock()
+        self._version = None
+        self._entries: Dict[Tuple[str, str, str, str], Any] = {}
+        self._checked_at = 0.0
+        self._counters = {"hits": 0, "misses": 0, "reloads": 0}
+        self._init_database()
+
+    def _init_database(self):
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS advisory_versions (
+                    version TEXT PRIMARY KEY,
+                    created_at REAL NOT NULL,
+                    completed_at REAL,
+                    entries INTEGER DEFAULT 0,
+                    failures INTEGER DEFAULT 0,
+                    metadata TEXT
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS advisories (
+                    version TEXT NOT NULL,
+                    class_name TEXT NOT NULL,
+                    section TEXT NOT NULL,
+                    location TEXT NOT NULL,
+                    language TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    PRIMARY KEY (version, class_name, section, location, language)
+                )
+            """)
+
+    # --- Writing (precompute_advisories.py) ---
+    def begin_version(self, metadata: Dict[str, Any]) -> str:
+        version = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S%fZ")
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("INSERT INTO advisory_versions (version, created_at, metadata) VALUES (?, ?, ?)",
+                         (version, time.time(), json.dumps(metadata)))
+        return version
+
+    def put(self, version: str, class_name: str, section: str, payload: Any, location: str = "",
+            language: str = ""):
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO advisories (version, class_name, section, location, language, payload)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (version, class_name, section, normalize_location(location), normalize_language(language),
+                  json.dumps(payload)))
+
+    def complete_version(self, version: str, entries: int, failures: int):
+        """Mark a version complete; from the next poll on it is served."""
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("UPDATE advisory_versions SET completed_at = ?, entries = ?, failures = ? WHERE version = ?",
+                         (time.time(), entries, failures, version))
+        self._checked_at = 0.0
+
+    def prune(self, keep: int) -> int:
+        """Delete all but the newest `keep` complete versions (and any pinned one); returns the number deleted."""
+        with sqlite3.connect(self.db_path) as conn:
+            rows = conn.execute("""
+                SELECT version FROM advisory_versions WHERE completed_at IS NOT NULL ORDER BY completed_at DESC
+            """).fetchall()
+            stale = [v for (v,) in rows[keep:] if v != self.pinned_version]
+            for version in stale:
+                conn.execute("DELETE FROM advisories WHERE version = ?", (version,))
+                conn.execute("DELETE FROM advisory_versions WHERE version = ?", (version,))
+        return len(stale)
+
+    # --- Reading (orchestrators) ---
+    def active_version(self) -> Optional[str]:
+        with sqlite3.connect(self.db_path) as conn:
+            if self.pinned_version:
+                row = conn.execute("SELECT version FROM advisory_versions WHERE version = ?",
+                                   (self.pinned_version,)).fetchone()
+            else:
+                row = conn.execute("""
+                    SELECT version FROM advisory_versions WHERE completed_at IS NOT NULL
+                    ORDER BY completed_at DESC LIMIT 1
+                """).fetchone()
+        return row[0] if row else None
+
+    def _refresh(self):
+        """Load the active version into memory if it changed (checked at most every poll_seconds)."""
+        now = time.monotonic()
+        if now - self._checked_at < self.poll_seconds:
+            return
+        self._checked_at = now
+        version = self.active_version()
+        if version == self._version:
+            return
+        entries = {}
+        if version is not None:
+            with sqlite3.connect(self.db_path) as conn:
+                for class_name, section, location, language, payload in conn.execute("""
+                    SELECT class_name, section, location, language, payload FROM advisories WHERE version = ?
+                """, (version,)):
+                    entries[(class_name, section, location, language)] = json.loads(payload)
+        self._version, self._entries = version, entries
+        self._counters["reloads"] += 1
+        print(f"✅ Advisory store serving version {version} ({len(entries)} entries)")
+
+    def get(self, class_name: str, section: str, location: str = "", language: str = "") -> Optional[Any]:
+        """
+        The precomputed section for this class, or None. Tries the exact location
+        and language, then the default language, then the location-independent entry.
+        """
+        location, language = normalize_location(location), normalize_language(language)
+        with self.lock:
+            self._refresh()
+            for candidate in self._candidates(location, language):
+                payload = self._entries.get((class_name, section, *candidate))
+                if payload is not None:
+                    self._counters["hits"] += 1
+                    # Callers add per-request fields, so never hand out the stored object
+                    return copy.deepcopy(payload)
+            self._counters["misses"] += 1
+            return None
+
+    @staticmethod
+    def _candidates(location: str, language: str) -> Iterable[Tuple[str, str]]:
+        seen = []
+        for candidate in ((location, language), (location, ADVISORY_DEFAULT_LANGUAGE), ("", "")):
+            if candidate not in seen:
+                seen.append(candidate)
+        return seen
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {"version": self._version, "entries": len(self._entries), **self._counters}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> Optional[AdvisoryStore]:
+    """The process-wide store, or None when ADVISORY_STORE_DB is not set."""
+    global _store
+    if not ADVISORY_STORE_DB:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = AdvisoryStore(ADVISORY_STORE_DB)
+        return _store
@@ -2,6 +2,7 @@
 import sys
 import os
 import asyncio
+import atexit
 import datetime
 from flask import Flask, request, jsonify
 from flask_cors import CORS
@@ -14,16 +15,47 @@ load_dotenv()
 # Add the project root to the Python path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from inference import predict as model_predict
+from inference import predict_image, batching_stats, cache_stats, start_model_loading, model_readiness, reload_model, CLASSES_PATH
+from model_registry import load_class_names
+import embedding_store
+import prediction_cache
+from near_duplicates import near_duplicates
+from similar_cases import SIMILAR_CASES_K, get_service as similar_cases_service, similar_cases
 from agents.agentic_orchestrator import AgenticOrchestrator
+from agents import llm_client
 
 # --- Flask App Initialization ---
 app = Flask(__name__)
 CORS(app)
 
+# Load and warm up the model in the background; /model_ready reports when it is done
+start_model_loading()
+
 # Initialize agentic orchestrator
 agentic_orchestrator = AgenticOrchestrator()
 
+def explain_requested():
+    return request.form.get("explain") == "1"
+
+def annotate_response(response, prediction):
+    """
+    Attach the image_id, which lets /agentic_learn label this image's stored embedding,
+    the upload this one duplicates (if any) and the top-k similar past cases
+    (SIMILAR_CASES=1); k from the 'similar_k' form field.
+    With 'explain=1', also the Grad-CAM heatmap (null when the model cannot be explained).
+    """
+    request_info = response.setdefault("request_info", {})
+    if prediction.near_duplicate_of:
+        request_info["near_duplicate_of"] = prediction.near_duplicate_of
+    if explain_requested():
+        response["explanation"] = prediction.explanation
+    if not prediction.image_id:
+        return
+    request_info["image_id"] = prediction.image_id
+    cases = similar_cases(prediction.image_id, request.form.get("similar_k", SIMILAR_CASES_K, type=int))
+    if cases is not None:
+        response["similar_cases"] = cases
+
 # --- Agentic AI Endpoint ---
 @app.route('/agentic_predict', methods=['POST'])
 def agentic_predict():
@@ -39,9 +71,10 @@ def agentic_predict():
         return jsonify({'error': 'No file selected.'}), 400
 
     try:
-        class_name, confidence = model_predict(file)
-        if class_name is None:
+        prediction = predict_image(file, user_id=request.form.get("user_id"), explain=explain_requested())
+        if prediction is None:
             return jsonify({'error': 'Model prediction failed.'}), 500
+        class_name, confidence = prediction.class_name, prediction.confidence
     except Exception as e:
         return jsonify({'error': f'Model error: {e}'}), 500
 
@@ -52,9 +85,29 @@ def agentic_predict():
         "user_type": request.form.get("user_type", "farmer")
     }
 
+    # Re-uploads of the same photo can reuse the enriched response (opt-in, see prediction_cache.py)
+    cache_scope = {
+        "endpoint": "agentic_predict",
+        "language": user_info["language"],
+        "location": user_info["location"],
+        "user_type": user_info["user_type"]
+    }
+    cached_response = prediction_cache.get_response(prediction.image_key, cache_scope)
+    if cached_response is None and prediction.near_duplicate_of:
+        # A frame from a burst: reuse the response to the user's earlier, near-identical upload
+        cached_response = near_duplicates.response_for(request.form.get("user_id"), prediction.near_duplicate_of, cache_scope)
+    if cached_response is not None:
+        # A new session of this user's own, so /agentic_learn feedback never lands on the original session
+        agentic_orchestrator.replay_response(cached_response, class_name, confidence, user_info)
+        annotate_response(cached_response, prediction)
+        return jsonify(cached_response)
+
     try:
         # Use agentic coordination for enhanced response
         enriched_response = asyncio.run(agentic_orchestrator.coordinate_agentic_agents(class_name, confidence, user_info))
+        prediction_cache.put_response(prediction.image_key, cache_scope, enriched_response)
+        near_duplicates.remember_response(request.form.get("user_id"), prediction.upload_id, cache_scope, enriched_response)
+        annotate_response(enriched_response, prediction)
         return jsonify(enriched_response)
     except Exception as e:
         print(f"❌ Agentic coordination error: {e}")
@@ -83,6 +136,10 @@ def agentic_status():
                 "total_memories": len(agentic_orchestrator.coordination_history),
                 "memory_manager": "active"
             },
+            "inference": {
+                "batching": batching_stats(),
+                "cache": cache_stats()
+            },
             "tools": {
                 "weather_api": "simulated",
                 "soil_api": "simulated", 
@@ -106,19 +163,26 @@ def agentic_status():
 @app.route('/agentic_learn', methods=['POST'])
 def agentic_learn():
     """
-    Provide feedback to improve agentic learning
+    Provide feedback to improve agentic learning.
+    Optional "image_id" and "corrected_label" (a class name) label the image for head retraining.
     """
     try:
         data = request.get_json()
         feedback = data.get('feedback', {})
         session_id = data.get('session_id')
         user_rating = data.get('user_rating', 0)
+        image_id = data.get('image_id')
+        corrected_label = data.get('corrected_label')
+
+        if corrected_label is not None and corrected_label not in load_class_names(CLASSES_PATH):
+            return jsonify({'error': f"Unknown class '{corrected_label}'."}), 400
         
         # Store user feedback for learning
         if session_id and user_rating > 0:
             # Find the session in coordination history
             for session in agentic_orchestrator.coordination_history:
                 if session.get('final_response', {}).get('request_info', {}).get('session_id') == session_id:
+                    image_id = image_id or session['final_response']['request_info'].get('image_id')
                     # Update success scores based on user feedback
                     for agent_name, agent in agentic_orchestrator.agents.items():
                         if agent_name in session.get('results', {}):
@@ -139,11 +203,25 @@ def agentic_learn():
                             )
                             agentic_orchestrator.memory_manager.store_memory(memory)
                     break
+
+        # Corrected labels, and predictions confirmed with a high rating, feed head_retrain.py
+        label_stored = False
+        store = embedding_store.get_store()
+        if store is not None and image_id:
+            if corrected_label is not None:
+                store.add_label(image_id, corrected_label, rating=user_rating or None, source="corrected")
+                label_stored = True
+            elif user_rating >= 4:
+                predicted_class = store.predicted_class(image_id)
+                if predicted_class is not None:
+                    store.add_label(image_id, predicted_class, rating=user_rating, source="confirmed")
+                    label_stored = True
         
         return jsonify({
             "message": "Feedback received and stored for learning",
             "session_id": session_id,
-            "user_rating": user_rating
+            "user_rating": user_rating,
+            "label_stored": label_stored
         }), 200
     except Exception as e:
         return jsonify({'error': f'Learning update failed: {e}'}), 500
@@ -178,9 +256,48 @@ def agentic_performance():
     except Exception as e:
         return jsonify({'error': f'Performance check failed: {e}'}), 500
 
+# --- Inference Stats Endpoint ---
+@app.route('/inference_stats', methods=['GET'])
+def inference_stats():
+    """
+    Get micro-batching and prediction cache statistics for tuning
+    """
+    store = embedding_store.get_store()
+    similar = similar_cases_service()
+    return jsonify({"batching": batching_stats(), "cache": cache_stats(),
+                    "embeddings": store.stats() if store is not None else None,
+                    "similar_cases": similar.stats() if similar is not None else None,
+                    "llm_client": llm_client.client_manager.stats(),
+                    "llm_cache": llm_client.response_cache.stats(),
+                    "llm_single_flight": llm_client.single_flight.stats(),
+                    "llm_scheduler": llm_client.client_manager.scheduler.stats()}), 200
+
+# --- Model Readiness and Reload Endpoints ---
+@app.route('/model_ready', methods=['GET'])
+def model_ready():
+    """
+    Readiness probe: 200 once the model is loaded and warmed up, 503 before that.
+    """
+    readiness = model_readiness()
+    return jsonify(readiness), (200 if readiness["ready"] else 503)
+
+@app.route('/model_reload', methods=['POST'])
+def model_reload():
+    """
+    Swap in a new weights file without a restart. Optional JSON body: {"model_path": "..."},
+    relative to (and confined to) MODEL_RELOAD_DIR.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        result = reload_model(data.get("model_path"))
+    except ValueError as e:
+        return jsonify({"reloaded": False, "error": str(e)}), 400
+    return jsonify(result), (200 if result["reloaded"] else 500)
+
 # --- Cleanup on shutdown ---
-@app.teardown_appcontext
-def cleanup(error):
+# Runs once at process exit, not per request: the Gemini client is meant to outlive requests
+@atexit.register
+def cleanup():
     if agentic_orchestrator:
         try:
             asyncio.run(agentic_orchestrator.close())
@@ -195,6 +312,9 @@ if __name__ == '__main__':
     print("   - GET  /agentic_status - System status")
     print("   - POST /agentic_learn - Provide feedback for learning")
     print("   - GET  /agentic_performance - Performance metrics")
+    print("   - GET  /inference_stats - Micro-batching and cache statistics")
+    print("   - GET  /model_ready - Model readiness probe")
+    print("   - POST /model_reload - Hot-reload model weights")
     print("🔧 Original system still available at /predict")
     
     app.run(debug=True, port=5003) 
\ No newline at end of file
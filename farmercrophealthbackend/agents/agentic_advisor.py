@@ -136,7 +136,9 @@ class AgenticAdvisorAgent(AgenticBaseAgent):
 
         try:
             # Generate the final response using the LLM
-            final_response = await get_llm_response(prompt, "AgenticAdvisorAgent")
+            # The CNN confidence in the prompt does not change the plan, so cache on the inputs that do
+            final_response = await get_llm_response(prompt, "AgenticAdvisorAgent", cache_key={
+                "crop": crop, "disease": disease, "is_healthy": is_healthy, "location": user_location})
             
             # If LLM call fails, provide a fallback response
             if "error" in final_response:
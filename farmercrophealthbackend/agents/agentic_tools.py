@@ -1,12 +1,17 @@
 # agents/agentic_tools.py
 import aiohttp
 import asyncio
+import contextlib
+import contextvars
 import json
 import random
 from typing import Dict, Any, Optional, List
 from dataclasses import dataclass
 import os
 
+# HTTP session holder of the coordination call in progress (AgenticToolRegistry.session_scope)
+_session_scope: contextvars.ContextVar = contextvars.ContextVar("agentic_tools_session_scope", default=None)
+
 @dataclass
 class ToolResult:
     success: bool
@@ -18,14 +23,42 @@ class ToolResult:
 class AgenticToolRegistry:
     def __init__(self):
         self.session = None
+        self._session_loop = None
         self.weather_api_key = os.getenv("WEATHER_API_KEY", "demo_key")
         self.soil_api_key = os.getenv("SOIL_API_KEY", "demo_key")
         self.market_api_key = os.getenv("MARKET_API_KEY", "demo_key")
     
+    @contextlib.asynccontextmanager
+    async def session_scope(self):
+        """
+        One aiohttp session, created on first use, for everything awaited inside
+        (tasks created there included) and closed on exit. Each request runs its
+        own event loop, so a session kept on the registry would be abandoned,
+        unclosed, after every request.
+        """
+        if _session_scope.get() is not None:
+            yield # Nested scope: keep the outer session
+            return
+        scope = {"session": None}
+        token = _session_scope.set(scope)
+        try:
+            yield
+        finally:
+            _session_scope.reset(token)
+            if scope["session"] is not None:
+                await scope["session"].close()
+    
     async def _get_session(self):
-        """Get or create aiohttp session"""
-        if self.session is None:
+        """The enclosing session_scope's session; outside one (single-loop scripts), a shared one closed by close()"""
+        scope = _session_scope.get()
+        if scope is not None:
+            if scope["session"] is None:
+                scope["session"] = aiohttp.ClientSession()
+            return scope["session"]
+        loop = asyncio.get_running_loop()
+        if self.session is None or self.session.closed or self._session_loop is not loop:
             self.session = aiohttp.ClientSession()
+            self._session_loop = loop
         return self.session
     
     async def get_weather_data(self, location: str) -> ToolResult:
@@ -273,4 +306,5 @@ class AgenticToolRegistry:
     async def close(self):
         """Close the aiohttp session"""
         if self.session:
-            await self.session.close() 
\ No newline at end of file
+            await self.session.close()
+            self.session = None 
\ No newline at end of file
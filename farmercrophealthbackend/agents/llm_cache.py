@@ -0,0 +1,124 @@
+# agents/llm_cache.py
+"""
+Response cache for Gemini calls.
+
+There are only 38 classes, so the agents send nearly the same prompts for
+every upload of a disease. A response is cached under one of two keys:
+
+  * the agent name plus a fingerprint of the normalized prompt (whitespace
+    collapsed), the model and the generation config. This is the default and
+    is safe for any prompt.
+  * explicit semantic keys (agent, crop, disease, location, ...) passed by
+    callers whose prompts also contain per-request noise. An example is the
+    model's confidence, which does not change the advice. The keys must cover
+    every input that does change it.
+
+Entries live in an in-memory LRU with an optional sqlite tier (TieredCache).
+TTLs are per agent and set by fnmatch patterns; a TTL of 0 turns caching off
+for that agent. An expired entry is still served for LLM_CACHE_STALE_SECONDS
+while it is refreshed in the background.
+"""
+
+import copy
+import fnmatch
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from prediction_cache import TieredCache
+
+# --- Configuration ---
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "1") == "1"
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", str(24 * 3600)))  # Agents not matched below
+LLM_CACHE_STALE_SECONDS = float(os.getenv("LLM_CACHE_STALE_SECONDS", str(7 * 24 * 3600)))
+LLM_CACHE_DB = os.getenv("LLM_CACHE_DB")  # Optional on-disk sqlite tier
+# Per-agent TTLs, "pattern=seconds" separated by commas; the first matching pattern wins.
+# Planner, synthesizer and conflict prompts embed the whole request context, so they are not cached.
+DEFAULT_AGENT_TTLS = ("CommunityAgent=604800,SustainabilityAgent=604800,GreenAgent=604800,"
+                      "BenefitAgent=86400,AdvisorAgent=86400,AgenticAdvisorAgent=86400,"
+                      "*_planner=0,*_synthesizer=0,ConflictResolver=0")
+LLM_CACHE_AGENT_TTLS = os.getenv("LLM_CACHE_AGENT_TTLS", DEFAULT_AGENT_TTLS)
+
+
+def parse_agent_rules(spec: str) -> Tuple[Tuple[str, float], ...]:
+    """Parse "pattern=number,..." into (fnmatch pattern, number) rules, in order."""
+    rules = []
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        pattern, _, seconds = item.partition("=")
+        rules.append((pattern.strip(), float(seconds)))
+    return tuple(rules)
+
+
+def normalize_prompt(prompt: str) -> str:
+    return re.sub(r"\s+", " ", prompt).strip()
+
+
+class LLMResponseCache:
+    def __init__(self, enabled: bool = LLM_CACHE_ENABLED, max_entries: int = LLM_CACHE_MAX_ENTRIES,
+                 default_ttl: float = LLM_CACHE_TTL_SECONDS, stale_seconds: float = LLM_CACHE_STALE_SECONDS,
+                 db_path: Optional[str] = LLM_CACHE_DB, agent_ttls: str = LLM_CACHE_AGENT_TTLS,
+                 model_signature: str = ""):
+        self.enabled = enabled
+        self.default_ttl = default_ttl
+        self.agent_ttls = parse_agent_rules(agent_ttls)
+        self.model_signature = model_signature  # Model name and generation config; part of every key
+        self.cache = TieredCache("llm_response", max_entries=max_entries, ttl_seconds=default_ttl,
+                                 db_path=db_path, stale_seconds=stale_seconds)
+        self.lock = threading.Lock()
+        self._refreshing = set()
+        self._counters = {"uncached_calls": 0, "refreshes": 0}
+
+    def ttl_for(self, agent_name: str) -> float:
+        for pattern, seconds in self.agent_ttls:
+            if fnmatch.fnmatchcase(agent_name, pattern):
+                return seconds
+        return self.default_ttl
+
+    def key_for(self, prompt: str, agent_name: str, cache_key: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """Cache key for a call, or None when this agent's responses are not cached."""
+        if not self.enabled or self.ttl_for(agent_name) <= 0:
+            with self.lock:
+                self._counters["uncached_calls"] += 1
+            return None
+        return self.fingerprint(prompt, agent_name, cache_key)
+
+    def fingerprint(self, prompt: str, agent_name: str, cache_key: Optional[Dict[str, Any]] = None) -> str:
+        """Identity of a call: agent and normalized prompt (or semantic keys), model and generation config."""
+        if cache_key is not None:
+            material = "semantic|" + json.dumps(cache_key, sort_keys=True, default=str)
+        else:
+            material = "prompt|" + normalize_prompt(prompt)
+        digest = hashlib.sha256(f"{self.model_signature}|{material}".encode()).hexdigest()
+        return f"{agent_name}:{digest}"
+
+    def lookup(self, key: str) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """(response, fresh); callers may mutate the response, so it is a copy."""
+        value, fresh = self.cache.lookup(key)
+        return (copy.deepcopy(value) if value is not None else None), fresh
+
+    def put(self, key: str, agent_name: str, response: Dict[str, Any]):
+        # Errors are not cached, so the next request retries the provider
+        if "error" not in response:
+            self.cache.put(key, copy.deepcopy(response), ttl_seconds=self.ttl_for(agent_name))
+
+    def begin_refresh(self, key: str) -> bool:
+        """Claim the background refresh of a stale key; False if one is already running."""
+        with self.lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            self._counters["refreshes"] += 1
+            return True
+
+    def end_refresh(self, key: str):
+        with self.lock:
+            self._refreshing.discard(key)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            counters = dict(self._counters, refreshing=len(self._refreshing))
+        return {"enabled": self.enabled, **self.cache.stats(), **counters}
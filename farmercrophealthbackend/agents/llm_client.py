@@ -3,9 +3,17 @@
 import os
 import json
 import asyncio
+import copy
+import threading
+import time
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 from dotenv import load_dotenv
 
+from .llm_cache import LLMResponseCache
+from .llm_scheduler import (LLM_CALL_DEADLINE_SECONDS, LLM_MAX_ATTEMPTS, CircuitOpen, DeadlineExceeded, LLMScheduler,
+                            backoff_delay)
+
 # Load environment variables
 dotenv_path = os.path.join(os.path.dirname(__file__), '..', '.env')
 load_dotenv(dotenv_path=dotenv_path)
@@ -14,45 +22,267 @@ API_KEY = os.getenv("GEMINI_API_KEY")
 if not API_KEY:
     raise ValueError("GEMINI_API_KEY not found in environment variables.")
 
-# genai.configure(api_key=API_KEY)
+# --- Configuration ---
+GEMINI_MODEL_NAME = "gemini-1.5-flash"
+GENERATION_CONFIG = {
+    "temperature": 0.7,
+    "response_mime_type": "application/json",
+}
+# Provider errors worth retrying: quota (slow down), and overload, 5xx or transport trouble (count towards the breaker)
+RATE_LIMIT_ERRORS = (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)
+TRANSIENT_ERRORS = (google_exceptions.ServiceUnavailable, google_exceptions.InternalServerError,
+                    google_exceptions.DeadlineExceeded, ConnectionError, asyncio.TimeoutError)
 
-def get_async_client():
+
+class LLMClientManager:
     """
-    Creates and returns a new asynchronous Gemini client instance.
-    This ensures that each request gets a fresh client, avoiding event loop issues.
+    Process-wide Gemini client.
+
+    genai.configure() drops the SDK's cached transport, so configuring and
+    building a GenerativeModel on every call meant a new gRPC channel (and TLS
+    handshake) per call. Here the SDK is configured once and one model handle
+    lives on a dedicated event loop thread. The async transport is bound to the
+    loop that created it, and Flask requests each run their own asyncio.run()
+    loop, so every caller's coroutine is handed over to that one loop. The
+    scheduler (llm_scheduler.py) runs on the same loop and decides when each
+    call may start. shutdown() closes the transport and stops the loop; the
+    next call starts it again.
     """
-    genai.configure(api_key=API_KEY)
-    generation_config = {
-      "temperature": 0.7,
-      "response_mime_type": "application/json",
-    }
-    return genai.GenerativeModel(
-        model_name="gemini-1.5-flash",
-        generation_config=generation_config
-    )
 
-async def get_llm_response(prompt: str, agent_name: str) -> dict:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.scheduler = LLMScheduler()
+        self._configured = False
+        self._loop = None
+        self._thread = None
+        self._model = None
+        self._in_flight = 0
+        self._counters = {"calls": 0, "errors": 0, "clients_created": 0, "shutdowns": 0}
+
+    def _ensure_started(self):
+        with self.lock:
+            if self._loop is not None:
+                return self._loop
+            if not self._configured:
+                genai.configure(api_key=API_KEY)
+                self._configured = True
+            self._model = genai.GenerativeModel(model_name=GEMINI_MODEL_NAME, generation_config=GENERATION_CONFIG)
+            self._counters["clients_created"] += 1
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._loop.run_forever, name="gemini-client", daemon=True)
+            self._thread.start()
+            return self._loop
+
+    def model(self):
+        """The shared GenerativeModel handle (its async methods must run on the client loop)."""
+        self._ensure_started()
+        return self._model
+
+    async def generate(self, prompt: str):
+        """One generate_content call; must run on the client loop (admission is up to the caller)."""
+        self._counters["calls"] += 1
+        self._in_flight += 1
+        try:
+            return await self._model.generate_content_async(prompt)
+        except Exception:
+            self._counters["errors"] += 1
+            raise
+        finally:
+            self._in_flight -= 1
+
+    def submit(self, coroutine_factory):
+        """Schedule coroutine_factory() on the client loop and return a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coroutine_factory(), self._ensure_started())
+
+    async def generate_async(self, prompt: str):
+        """Await a generate_content call from any event loop, bypassing the scheduler."""
+        return await asyncio.wrap_future(self.submit(lambda: self.generate(prompt)))
+
+    def run(self, coroutine_factory, timeout: float = None):
+        """Run a coroutine on the client loop and block until it finishes (for callers without a loop)."""
+        return self.submit(coroutine_factory).result(timeout)
+
+    async def _close_transport(self):
+        client = getattr(self._model, "_async_client", None)
+        transport = getattr(client, "transport", None)
+        if transport is not None:
+            await transport.close()
+
+    def shutdown(self):
+        """Close the transport and stop the client loop; safe to call more than once."""
+        with self.lock:
+            loop, thread = self._loop, self._thread
+            if loop is None:
+                return
+            try:
+                asyncio.run_coroutine_threadsafe(self._close_transport(), loop).result(5)
+            except Exception as e:
+                print(f"⚠️ Could not close the Gemini transport cleanly: {e}")
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(5)
+            loop.close()
+            self._loop = self._thread = self._model = None
+            self.scheduler.reset()
+            self._counters["shutdowns"] += 1
+        print("✅ Gemini client shut down")
+
+    async def shutdown_async(self):
+        await asyncio.to_thread(self.shutdown)
+
+    def stats(self):
+        return {
+            "running": self._loop is not None,
+            "in_flight": self._in_flight,
+            **self._counters,
+        }
+
+
+class SingleFlight:
     """
-    Gets a structured JSON response from the Gemini model using a fresh,
-    on-demand async client.
+    Coalesces concurrent identical calls: the first caller for a key starts the
+    call on the client loop, and callers arriving while it is in flight await
+    the same future. Each caller gets its own copy of the result.
     """
-    model = get_async_client() # Get a fresh client for this request
 
-    for attempt in range(3):
+    def __init__(self):
+        # Reentrant: add_done_callback runs _forget at once if the call already finished
+        self.lock = threading.RLock()
+        self._in_flight = {}
+        self._counters = {"issued": 0, "coalesced": 0}
+
+    async def run(self, key: str, coroutine_factory):
+        with self.lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = client_manager.submit(coroutine_factory)
+                future.add_done_callback(lambda _: self._forget(key, future))
+            self._counters["issued" if leader else "coalesced"] += 1
+        # shield: a caller that gives up must not cancel the call for the others
+        result = await asyncio.shield(asyncio.wrap_future(future))
+        return copy.deepcopy(result)
+
+    def _forget(self, key: str, future):
+        with self.lock:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+
+    def stats(self):
+        with self.lock:
+            total = self._counters["issued"] + self._counters["coalesced"]
+            return {
+                **self._counters,
+                "in_flight": len(self._in_flight),
+                "coalesced_rate": self._counters["coalesced"] / total if total else 0,
+            }
+
+
+client_manager = LLMClientManager()
+single_flight = SingleFlight()
+response_cache = LLMResponseCache(model_signature=GEMINI_MODEL_NAME + json.dumps(GENERATION_CONFIG, sort_keys=True))
+
+
+def get_async_client():
+    """
+    Returns the shared Gemini model handle. Its async methods are bound to the
+    client manager's loop; call get_llm_response rather than awaiting it directly.
+    """
+    return client_manager.model()
+
+async def _call_llm(prompt: str, agent_name: str) -> dict:
+    """
+    Gets a structured JSON response from the Gemini model through the shared,
+    long-lived client. Runs on the client loop: every attempt is admitted by
+    the scheduler (rate, priority, concurrency), retried with jittered backoff
+    within LLM_CALL_DEADLINE_SECONDS, and refused outright while the circuit
+    breaker is open. Failures come back as {"error": ...} so agents use their
+    fallback responses.
+    """
+    scheduler = client_manager.scheduler
+    priority = scheduler.priority_for(agent_name)
+    deadline = time.monotonic() + LLM_CALL_DEADLINE_SECONDS
+    error = "Failed to get valid JSON from Gemini after multiple attempts."
+    for attempt in range(LLM_MAX_ATTEMPTS):
+        if attempt:
+            delay = backoff_delay(attempt - 1)
+            if time.monotonic() + delay >= deadline:
+                break
+            scheduler.on_retry()
+            await asyncio.sleep(delay)
         response = None
         try:
-            response = await model.generate_content_async(prompt)
-            return json.loads(response.text)
+            async with scheduler.admit(priority, deadline):
+                response = await asyncio.wait_for(client_manager.generate(prompt), deadline - time.monotonic())
+                result = json.loads(response.text)
+                scheduler.on_success()
+            return result
+        except CircuitOpen:
+            print(f"⚠️ ({agent_name}) Gemini circuit breaker is open; using the fallback response")
+            return {"error": "Gemini is temporarily unavailable (circuit breaker open)"}
+        except DeadlineExceeded:
+            print(f"⚠️ ({agent_name}) Gemini call waited past its deadline in the queue")
+            return {"error": "Gemini call deadline exceeded"}
         except json.JSONDecodeError:
             print(f"⚠️ ({agent_name}) Gemini response was not valid JSON. Retrying...")
-            await asyncio.sleep(1)
+        except RATE_LIMIT_ERRORS as e:
+            scheduler.on_rate_limited()
+            error = f"Failed to get response from Gemini: {e}"
+            print(f"⚠️ ({agent_name}) Gemini rate limit hit; slowing down to {scheduler.rate:.2f} calls/s")
+        except TRANSIENT_ERRORS as e:
+            scheduler.on_failure()
+            error = f"Failed to get response from Gemini: {e or 'timed out'}"
+            print(f"⚠️ ({agent_name}) Transient Gemini error: {e!r}. Retrying...")
         except Exception as e:
             if response and hasattr(response, 'prompt_feedback') and response.prompt_feedback.block_reason:
                 block_reason = response.prompt_feedback.block_reason.name
                 print(f"❌ ({agent_name}) Prompt blocked by Gemini. Reason: {block_reason}")
                 return {"error": f"Request blocked by safety filter: {block_reason}"}
-            
+
             print(f"❌ ({agent_name}) An error occurred while calling Gemini: {e}")
             return {"error": f"Failed to get response from Gemini: {e}"}
-            
-    return {"error": "Failed to get valid JSON from Gemini after multiple attempts."}
+
+    return {"error": error}
+
+async def _fetch(prompt: str, agent_name: str, cache_key: dict = None) -> dict:
+    """_call_llm, shared with any identical call already in flight."""
+    fingerprint = response_cache.fingerprint(prompt, agent_name, cache_key)
+    return await single_flight.run(fingerprint, lambda: _call_llm(prompt, agent_name))
+
+async def _refresh(key: str, prompt: str, agent_name: str, cache_key: dict = None):
+    try:
+        response_cache.put(key, agent_name, await _fetch(prompt, agent_name, cache_key))
+    finally:
+        response_cache.end_refresh(key)
+
+async def get_llm_response(prompt: str, agent_name: str, cache_key: dict = None) -> dict:
+    """
+    Gets a structured JSON response from Gemini, answered from the response
+    cache (llm_cache.py) when possible. `cache_key` replaces the prompt
+    fingerprint with explicit semantic keys, e.g. {"crop": ..., "disease": ...}.
+    A stale entry is returned at once and refreshed in the background. Misses
+    that are identical to a call already in flight wait for that call instead
+    of issuing their own (single flight).
+    """
+    key = response_cache.key_for(prompt, agent_name, cache_key)
+    if key is None:
+        return await _fetch(prompt, agent_name, cache_key)
+    cached, fresh = response_cache.lookup(key)
+    if cached is not None:
+        if not fresh and response_cache.begin_refresh(key):
+            # Scheduled on the client loop, so it outlives the caller's request loop
+            client_manager.submit(lambda: _refresh(key, prompt, agent_name, cache_key))
+        return cached
+    response = await _fetch(prompt, agent_name, cache_key)
+    response_cache.put(key, agent_name, response)
+    return response
+
+def get_llm_response_sync(prompt: str, agent_name: str, cache_key: dict = None) -> dict:
+    """
+    Blocking variant of get_llm_response for threads without an event loop
+    (the legacy agents call it through asyncio.to_thread).
+    """
+    return client_manager.run(lambda: get_llm_response(prompt, agent_name, cache_key))
+
+async def close():
+    """Shutdown hook: release the shared Gemini client (called by AgenticOrchestrator.close)."""
+    await client_manager.shutdown_async()
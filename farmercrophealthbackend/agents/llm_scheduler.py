@@ -0,0 +1,249 @@
+# agents/llm_scheduler.py
+"""
+Admission control for Gemini calls: rate limiting, priorities, retries with
+backoff, deadlines and a circuit breaker.
+
+All scheduling happens on the client loop (llm_client.LLMClientManager), so
+it is process-wide and needs no locks.
+
+  * Token bucket. Call starts are limited to `rate` per second, with bursts up
+    to `burst`. A provider rate-limit error halves the rate, down to
+    min_rate, and every success wins back a twentieth of max_rate (AIMD).
+  * Priorities. Waiting calls are admitted lowest class first (FIFO within a
+    class), so advisor calls go ahead of community calls under load. At most
+    max_concurrency calls are in flight.
+  * Deadlines. A call that is still queued when its deadline passes gives up
+    with DeadlineExceeded.
+  * Backoff. Retries sleep a "full jitter" exponential delay: uniform between
+    0 and min(cap, base * 2^attempt).
+  * Circuit breaker. After `failure_threshold` consecutive provider failures
+    the breaker opens and calls fail fast for reset_seconds. Then a single
+    probe call is let through; its outcome closes or re-opens the breaker.
+    A probe that ends without a verdict (deadline in the queue, cancellation,
+    a neutral error) hands the probe to the next call.
+
+Callers wrap each attempt in `async with scheduler.admit(priority, deadline)`.
+"""
+
+import asyncio
+import contextlib
+import fnmatch
+import heapq
+import itertools
+import os
+import random
+import time
+from typing import Any, Dict
+
+from .llm_cache import parse_agent_rules
+
+# --- Configuration ---
+LLM_RATE_PER_SECOND = float(os.getenv("LLM_RATE_PER_SECOND", "5"))
+LLM_MIN_RATE_PER_SECOND = float(os.getenv("LLM_MIN_RATE_PER_SECOND", "0.5"))
+LLM_BURST = float(os.getenv("LLM_BURST", "10"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))  # Gemini calls in flight per process
+LLM_CALL_DEADLINE_SECONDS = float(os.getenv("LLM_CALL_DEADLINE_SECONDS", "30"))  # Queueing plus all attempts
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "4"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "0.5"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "8"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+# Priority classes by agent name, "pattern=class"; lower goes first, unmatched agents get LLM_DEFAULT_PRIORITY
+DEFAULT_PRIORITIES = ("*Advisor*=0,agentic_advisor_*=0,ConflictResolver=1,*_planner=1,*_synthesizer=1,"
+                      "CommunityAgent=3,community_agent_*=3")
+LLM_PRIORITIES = os.getenv("LLM_PRIORITIES", DEFAULT_PRIORITIES)
+LLM_DEFAULT_PRIORITY = int(os.getenv("LLM_DEFAULT_PRIORITY", "2"))
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+def backoff_delay(attempt: int, base: float = LLM_BACKOFF_BASE_SECONDS, cap: float = LLM_BACKOFF_MAX_SECONDS) -> float:
+    """Full-jitter exponential backoff before retry number `attempt` (0-based)."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = LLM_BREAKER_FAILURES, reset_seconds: float = LLM_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._counters = {"opened": 0, "rejected": 0}
+
+    def allow(self) -> bool:
+        """Whether a call may go to the provider now; in half-open state only one probe at a time."""
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+            self.state = "half_open"
+        if self.state == "closed":
+            return True
+        if self.state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        self._counters["rejected"] += 1
+        return False
+
+    def record_success(self):
+        self.state, self.failures, self._probing = "closed", 0, False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self._counters["opened"] += 1
+            self.state, self.opened_at, self._probing = "open", time.monotonic(), False
+
+    def record_neutral(self):
+        """An attempt that says nothing about provider health (e.g. bad JSON) ends a probe without a verdict."""
+        self._probing = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {"state": self.state, "consecutive_failures": self.failures, **self._counters}
+
+
+class LLMScheduler:
+    def __init__(self, rate: float = LLM_RATE_PER_SECOND, burst: float = LLM_BURST,
+                 min_rate: float = LLM_MIN_RATE_PER_SECOND, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 priorities: str = LLM_PRIORITIES, default_priority: int = LLM_DEFAULT_PRIORITY):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.burst = max(burst, 1.0)
+        self.max_concurrency = max_concurrency
+        self.priorities = parse_agent_rules(priorities)
+        self.default_priority = default_priority
+        self.breaker = CircuitBreaker()
+        self._tokens = self.burst
+        self._refilled_at = time.monotonic()
+        self._queue = []
+        self._sequence = itertools.count()
+        self._active = 0
+        self._timer = None
+        self._counters = {"admitted": 0, "expired_in_queue": 0, "rate_limited": 0, "retries": 0,
+                          "failed_fast": 0}
+
+    def priority_for(self, agent_name: str) -> int:
+        for pattern, priority in self.priorities:
+            if fnmatch.fnmatchcase(agent_name, pattern):
+                return int(priority)
+        return self.default_priority
+
+    # --- Admission ---
+    @contextlib.asynccontextmanager
+    async def admit(self, priority: int, deadline: float):
+        """
+        Breaker check plus a slot for the body. Raises CircuitOpen or
+        DeadlineExceeded; the body records the outcome (on_success, on_failure).
+        """
+        probe = self.check_breaker()
+        try:
+            await self.acquire(priority, deadline)
+            try:
+                yield
+            finally:
+                self.release()
+        finally:
+            if probe:
+                # Without a verdict from the body the breaker would stay half-open forever
+                self.breaker.record_neutral()
+
+    async def acquire(self, priority: int, deadline: float):
+        """Wait for a slot and a token; deadline is a time.monotonic() value."""
+        loop = asyncio.get_running_loop()
+        ticket = loop.create_future()
+        heapq.heappush(self._queue, (priority, next(self._sequence), ticket))
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket), timeout=max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            self._abandon(ticket)
+            self._counters["expired_in_queue"] += 1
+            raise DeadlineExceeded("Gemini call deadline passed while queued")
+        except asyncio.CancelledError:
+            self._abandon(ticket)
+            raise
+
+    def _abandon(self, ticket):
+        if ticket.done() and not ticket.cancelled():
+            self.release() # Admitted just as the wait ended: hand the slot back
+        else:
+            ticket.cancel()
+
+    def reset(self):
+        """Forget queued calls and slots; called when the client loop they belong to is stopped."""
+        if self._timer is not None:
+            self._timer.cancel()
+        self._queue, self._active, self._timer = [], 0, None
+        self.breaker.record_neutral() # A probe may have been in flight on the stopped loop
+
+    def release(self):
+        self._active -= 1
+        self._dispatch()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._refill()
+        while self._queue and self._active < self.max_concurrency:
+            if self._queue[0][2].done(): # Gave up while queued
+                heapq.heappop(self._queue)
+                continue
+            if self._tokens < 1:
+                break
+            _, _, ticket = heapq.heappop(self._queue)
+            self._tokens -= 1
+            self._active += 1
+            self._counters["admitted"] += 1
+            ticket.set_result(None)
+        if self._queue and self._active < self.max_concurrency:
+            # Wake up when the next token is due
+            delay = (1 - self._tokens) / self.rate
+            self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    # --- Feedback ---
+    def on_success(self):
+        self.breaker.record_success()
+        self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+    def on_rate_limited(self):
+        self._counters["rate_limited"] += 1
+        self.rate = max(self.min_rate, self.rate / 2)
+
+    def on_failure(self):
+        self.breaker.record_failure()
+
+    def on_retry(self):
+        self._counters["retries"] += 1
+
+    def check_breaker(self) -> bool:
+        """Raises CircuitOpen, else returns whether this call is the half-open probe."""
+        if not self.breaker.allow():
+            self._counters["failed_fast"] += 1
+            raise CircuitOpen("Gemini circuit breaker is open")
+        return self.breaker.state == "half_open"
+
+    def stats(self) -> Dict[str, Any]:
+        queued = sum(1 for _, _, ticket in self._queue if not ticket.done())
+        return {
+            "rate_per_second": round(self.rate, 3),
+            "max_rate_per_second": self.max_rate,
+            "tokens": round(min(self.burst, self._tokens), 2),
+            "queued": queued,
+            "active": self._active,
+            "max_concurrency": self.max_concurrency,
+            "breaker": self.breaker.stats(),
+            **self._counters,
+        }
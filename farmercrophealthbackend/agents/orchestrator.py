@@ -2,8 +2,32 @@
 
 import asyncio
 import datetime
+from advisory_store import get_store as get_advisory_store
 from . import advisor_agent, benefit_agent, linker_agent, community_agent, green_agent, logger_agent, ndvi_agent
 
+def parse_class_name(class_name: str):
+    """Split a class name like 'Tomato___Early_blight' into a readable (crop, disease)."""
+    try:
+        crop, disease = class_name.split('___', 1)
+        disease = disease.replace('_', ' ') # Format for readability
+        crop = crop.replace('_', ' ')
+    except ValueError:
+        crop = "Unknown"
+        disease = class_name.replace('_', ' ')
+    return crop, disease
+
+def advisory_sections(crop: str, disease: str) -> dict:
+    """
+    The LLM-backed sections of the response, by name. They depend only on the crop and
+    disease, so precompute_advisories.py can fill them into the advisory store.
+    """
+    return {
+        "advisory": lambda: advisor_agent.get_treatment_plan(crop, disease),
+        "financial_benefits": lambda: benefit_agent.get_farmer_benefits(crop, disease),
+        "community_insights": lambda: community_agent.get_community_insights(crop, disease),
+        "sustainability_tips": lambda: green_agent.get_eco_friendly_tips(crop, disease),
+    }
+
 async def run_agents(class_name: str, confidence: str, user_info: dict) -> dict:
     """
     Orchestrates ASYNCHRONOUS calls to all agents to build a comprehensive, enriched JSON response.
@@ -17,31 +41,27 @@ async def run_agents(class_name: str, confidence: str, user_info: dict) -> dict:
         A dictionary containing the combined outputs from all agents.
     """
     # 1. Separate the crop and disease from the class_name
-    try:
-        crop, disease = class_name.split('___', 1)
-        disease = disease.replace('_', ' ') # Format for readability
-        crop = crop.replace('_', ' ')
-    except ValueError:
-        crop = "Unknown"
-        disease = class_name.replace('_', ' ')
+    crop, disease = parse_class_name(class_name)
 
-    # 2. Define all agent tasks to be run concurrently
+    # 2. Take precomputed sections from the advisory store and define agent tasks for the rest
     # The 'if not "healthy" in disease.lower()' ensures we only call AI for actual problems.
-    agent_tasks = []
+    store = get_advisory_store()
+    sections = {}
+    agent_tasks = {}
     if "healthy" not in disease.lower():
-        agent_tasks.extend([
-            advisor_agent.get_treatment_plan(crop, disease),
-            benefit_agent.get_farmer_benefits(crop, disease),
-            community_agent.get_community_insights(crop, disease),
-            green_agent.get_eco_friendly_tips(crop, disease),
-        ])
+        for section, compute in advisory_sections(crop, disease).items():
+            sections[section] = store.get(class_name, section) if store is not None else None
+            if sections[section] is None:
+                agent_tasks[section] = compute()
     
-    # 3. Run the tasks concurrently and gather the results
-    results = await asyncio.gather(*agent_tasks)
+    # 3. Run the remaining tasks concurrently and gather the results
+    results = await asyncio.gather(*agent_tasks.values())
+    sections.update(zip(agent_tasks, results))
     
-    # Unpack results if tasks were run, otherwise use default values
-    if agent_tasks:
-        treatment_plan, benefits, community_insights, eco_tips = results
+    # Unpack results if sections were requested, otherwise use default values
+    if sections:
+        treatment_plan, benefits, community_insights, eco_tips = (
+            sections[name] for name in ("advisory", "financial_benefits", "community_insights", "sustainability_tips"))
     else: # Default values for healthy plants
         treatment_plan = {"title": "Preventive Care", "steps": ["Your plant looks healthy. Keep up the good work!", "Continue regular monitoring."], "recommended_products": [], "disclaimer": ""}
         benefits = {"title": "No benefits needed", "schemes": []}
@@ -9,6 +9,7 @@ class SustainabilityAgent(AgenticBaseAgent):
     def __init__(self, memory_manager, tool_registry):
         super().__init__("sustainability_agent", memory_manager, tool_registry)
         self.add_goal("Promote sustainable farming practices", priority=8)
+        self.confidence = 0.8 # Reported with process_request answers
 
     async def process_request(self, context: Dict[str, Any]) -> Dict[str, Any]:
         """
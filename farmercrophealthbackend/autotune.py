@@ -0,0 +1,249 @@
+# autotune.py
+"""
+Autotuner for CPU inference settings.
+
+Sweeps torch intra-op threads, inference worker processes (worker_pool.py) and
+micro-batch sizes against the real `inference.predict` path. The load is
+synthetic leaf photos from concurrent client threads, the way Flask's threaded
+server calls it. Every configuration runs in a fresh interpreter, because
+these settings are read once at import time. The prediction cache is off so
+every request reaches the model.
+
+The winner is written into the deployment profile (inference_profile.py)
+under this host's core count. Servers load it at startup, so running the
+tuner once on each host size fills in one profile for the whole fleet.
+
+Selection: with --p99-ms, the highest throughput whose p99 meets the target;
+otherwise the lowest p99 among configurations within 10% of the best throughput.
+
+Usage:
+    python autotune.py --duration 10 --concurrency 8
+    python autotune.py --p99-ms 250 --batch-sizes 1 4 8 16
+"""
+
+import argparse
+import datetime
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from inference_profile import PROFILE_PATH, SETTINGS, host_cores, load_profile
+
+THROUGHPUT_TOLERANCE = 0.9
+
+
+# --- Synthetic Load ---
+def synthetic_leaf_images(count: int = 48, size=(1024, 768), seed: int = 0) -> List[bytes]:
+    """Distinct JPEG photos of a green leaf with brown lesions on a soil background."""
+    from PIL import Image, ImageDraw, ImageFilter
+
+    rng = random.Random(seed)
+    images = []
+    for _ in range(count):
+        width, height = size
+        image = Image.new("RGB", size, (rng.randint(90, 130), rng.randint(70, 100), rng.randint(40, 60)))
+        draw = ImageDraw.Draw(image)
+        cx, cy = width // 2 + rng.randint(-80, 80), height // 2 + rng.randint(-60, 60)
+        rx, ry = rng.randint(width // 4, width // 3), rng.randint(height // 5, height // 3)
+        draw.ellipse((cx - rx, cy - ry, cx + rx, cy + ry),
+                     fill=(rng.randint(40, 90), rng.randint(120, 190), rng.randint(30, 70)))
+        for _ in range(rng.randint(0, 25)):
+            x, y, r = cx + rng.randint(-rx // 2, rx // 2), cy + rng.randint(-ry // 2, ry // 2), rng.randint(4, 20)
+            draw.ellipse((x - r, y - r, x + r, y + r), fill=(rng.randint(100, 150), rng.randint(60, 90), 30))
+        image = Image.blend(image, Image.effect_noise(size, 30).convert("RGB"), 0.15).filter(ImageFilter.GaussianBlur(1))
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=90)
+        images.append(buffer.getvalue())
+    return images
+
+
+def _trial(duration: float, concurrency: int) -> Dict[str, Any]:
+    """Runs inside a fresh interpreter whose environment holds the configuration under test."""
+    import inference
+
+    images = synthetic_leaf_images()
+    model, _ = inference.load_model()
+    if model is None:
+        raise RuntimeError("Model failed to load.")
+    for data in images[:4]:
+        inference.predict(io.BytesIO(data))
+    inference.batcher.reset_stats()
+
+    latencies: List[float] = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(offset: int):
+        i = offset
+        local = []
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            inference.predict(io.BytesIO(images[i % len(images)]))
+            local.append((time.perf_counter() - started) * 1000.0)
+            i += concurrency
+        with lock:
+            latencies.extend(local)
+
+    started = time.perf_counter()
+    clients = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    def percentile(p):
+        return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 2)
+
+    stats = inference.batching_stats()
+    if inference.worker_pool is not None:
+        inference.worker_pool.shutdown()
+    return {
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "avg_batch_size": round(stats.get("avg_batch_size", 0), 2),
+    }
+
+
+# --- Sweep ---
+def candidate_configs(cores: int, batch_sizes: List[int], max_wait_ms: float,
+                      worker_counts: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+    """In-process configurations over torch thread counts, plus worker-pool splits of the cores."""
+    thread_counts = sorted({t for t in (1, 2, 4, 8, 16, 32, 64) if t < cores} | {cores})
+    worker_counts = worker_counts or [w for w in (2, 4, 8, 16) if w <= cores]
+    configs = []
+    for batch_size in batch_sizes:
+        for threads in thread_counts:
+            configs.append({"workers": 0, "torch_threads": threads, "interop_threads": 1,
+                            "max_batch_size": batch_size, "max_wait_ms": max_wait_ms})
+        for workers in worker_counts:
+            configs.append({"workers": workers, "worker_threads": max(1, cores // workers), "torch_threads": 1,
+                            "interop_threads": 1, "max_batch_size": batch_size, "max_wait_ms": max_wait_ms})
+    return configs
+
+
+def run_config(config: Dict[str, Any], model_path: str, duration: float, concurrency: int) -> Dict[str, Any]:
+    env = os.environ.copy()
+    for key, env_name in SETTINGS.items():
+        env.pop(env_name, None)
+        if key in config:
+            env[env_name] = str(config[key])
+    env.update({
+        "CROP_HEALTH_PROFILE": "",  # Measure the configuration itself, not a saved profile
+        "PREDICTION_CACHE_MODE": "off",
+        "CROP_HEALTH_MODEL_PATH": model_path,
+    })
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "_trial", "--duration", str(duration), "--concurrency", str(concurrency)],
+        env=env, cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True,
+        timeout=duration * 10 + 300)
+    if output.returncode != 0:
+        return {"error": (output.stderr.strip().splitlines() or ["trial failed"])[-1]}
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def select_best(trials: List[Dict[str, Any]], p99_ms: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    measured = [t for t in trials if "error" not in t["result"]]
+    if not measured:
+        return None
+    if p99_ms is not None:
+        feasible = [t for t in measured if t["result"]["p99_ms"] <= p99_ms]
+        if feasible:
+            return max(feasible, key=lambda t: t["result"]["throughput_rps"])
+        print(f"⚠️ No configuration meets p99 <= {p99_ms} ms; choosing the lowest p99.")
+        return min(measured, key=lambda t: t["result"]["p99_ms"])
+    best_throughput = max(t["result"]["throughput_rps"] for t in measured)
+    near_best = [t for t in measured if t["result"]["throughput_rps"] >= THROUGHPUT_TOLERANCE * best_throughput]
+    return min(near_best, key=lambda t: t["result"]["p99_ms"])
+
+
+def write_profile(path: str, cores: int, best: Dict[str, Any], concurrency: int):
+    """Store the winner under this host's core count, keeping entries tuned on other hosts."""
+    profile = load_profile(path)
+    profile.setdefault("hosts", {})[str(cores)] = {
+        **best["config"],
+        "measured": {**best["result"], "concurrency": concurrency},
+        "tuned_at": datetime.datetime.utcnow().isoformat(),
+    }
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(profile, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _random_weights(num_classes: int) -> str:
+    """Latency does not depend on the weights: tune with a random CNN when no checkpoint is present."""
+    import torch
+    from crop_cnn import CNN
+
+    path = os.path.join(tempfile.mkdtemp(prefix="autotune-"), "random_weights.pt")
+    torch.save(CNN(num_classes=num_classes).state_dict(), path)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tune torch threads, worker processes and micro-batching")
+    sub = parser.add_subparsers(dest="command")
+    trial = sub.add_parser("_trial")
+    trial.add_argument("--duration", type=float, required=True)
+    trial.add_argument("--concurrency", type=int, required=True)
+    parser.add_argument("--duration", type=float, default=8.0, help="Seconds of load per configuration")
+    parser.add_argument("--concurrency", type=int, default=host_cores(), help="Concurrent requests (Flask threads)")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--max-wait-ms", type=float, default=10.0)
+    parser.add_argument("--workers", type=int, nargs="+", help="Worker-process counts to try (default: 2, 4, ... <= cores)")
+    parser.add_argument("--p99-ms", type=float, help="Latency target for the selection")
+    parser.add_argument("--weights", help="Model weights (default: CROP_HEALTH_MODEL_PATH, or random weights if missing)")
+    parser.add_argument("--profile", default=PROFILE_PATH or os.path.join(os.path.dirname(os.path.abspath(__file__)), "inference_profile.json"))
+    parser.add_argument("--output", help="Write every trial to this JSON file")
+    args = parser.parse_args(argv)
+
+    if args.command == "_trial":
+        print(json.dumps(_trial(args.duration, args.concurrency)))
+        return 0
+
+    from model_registry import DEFAULT_CLASSES_PATH, DEFAULT_MODEL_PATH, load_class_names
+    model_path = args.weights or os.getenv("CROP_HEALTH_MODEL_PATH", DEFAULT_MODEL_PATH)
+    if not os.path.exists(model_path):
+        print(f"⚠️ '{model_path}' not found; tuning with random weights of the same architecture.")
+        model_path = _random_weights(len(load_class_names(DEFAULT_CLASSES_PATH)))
+
+    cores = host_cores()
+    configs = candidate_configs(cores, args.batch_sizes, args.max_wait_ms, args.workers)
+    print(f"⏱️ Tuning {len(configs)} configurations on {cores} cores, {args.duration:.0f}s each, "
+          f"{args.concurrency} concurrent requests...")
+    trials = []
+    for config in configs:
+        result = run_config(config, model_path, args.duration, args.concurrency)
+        trials.append({"config": config, "result": result})
+        if "error" in result:
+            print(f"❌ {config}: {result['error']}")
+        else:
+            print(f"📊 {config}: {result['throughput_rps']} req/s, p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms")
+
+    best = select_best(trials, args.p99_ms)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"host_cores": cores, "trials": trials, "best": best}, f, indent=2)
+    if best is None:
+        print("❌ Every configuration failed; profile not written.")
+        return 1
+    write_profile(args.profile, cores, best, args.concurrency)
+    print(f"✅ Best for {cores} cores: {best['config']} -> {best['result']}")
+    print(f"✅ Profile written to '{args.profile}'.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+# batching.py
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List
+
+# --- Configuration ---
+MAX_BATCH_SIZE = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", "16"))
+MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", "10"))
+
+
+class MicroBatcher:
+    """
+    Groups concurrent inference requests into a single batched call.
+
+    Callers submit one item at a time and block on a future. A background
+    worker collects items until either `max_batch_size` is reached or
+    `max_wait_ms` has elapsed since the first item of the batch arrived,
+    then calls `run_batch` once with the whole list. `run_batch` must return
+    one result per item, in the same order.
+    """
+
+    def __init__(self, run_batch: Callable[[List[Any]], List[Any]],
+                 max_batch_size: int = MAX_BATCH_SIZE, max_wait_ms: float = MAX_WAIT_MS,
+                 name: str = "micro-batcher"):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.name = name
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._stopped = False
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self._requests = 0
+        self._batches = 0
+        self._failed_batches = 0
+        self._max_queue_depth = 0
+        self._batch_size_histogram: Dict[int, int] = {}
+        self._total_wait_ms = 0.0
+        self._total_batch_ms = 0.0
+
+    # --- Public API ---
+    def submit(self, item: Any) -> Future:
+        """Queue an item for the next batch and return a future for its result."""
+        if self._stopped:
+            raise RuntimeError(f"{self.name} has been shut down.")
+        self._ensure_worker()
+        future: Future = Future()
+        self._queue.put((item, future, time.perf_counter()))
+        with self._lock:
+            self._requests += 1
+            self._max_queue_depth = max(self._max_queue_depth, self._queue.qsize())
+        return future
+
+    def run(self, item: Any, timeout: float = None) -> Any:
+        """Submit an item and block until its result is available."""
+        return self.submit(item).result(timeout=timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return queue-depth and batch-size statistics for tuning."""
+        with self._lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_ms,
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self._max_queue_depth,
+                "requests": self._requests,
+                "batches": self._batches,
+                "failed_batches": self._failed_batches,
+                "avg_batch_size": (self._requests_batched() / self._batches) if self._batches else 0,
+                "batch_size_histogram": dict(sorted(self._batch_size_histogram.items())),
+                "avg_queue_wait_ms": (self._total_wait_ms / self._requests_batched()) if self._batches else 0,
+                "avg_batch_latency_ms": (self._total_batch_ms / self._batches) if self._batches else 0,
+            }
+
+    def reset_stats(self):
+        """Clear the collected statistics."""
+        with self._lock:
+            self._reset_stats()
+
+    def shutdown(self, timeout: float = 1.0):
+        """Stop the background worker after it drains the current batch."""
+        self._stopped = True
+        if self._worker is not None:
+            self._queue.put(None)
+            self._worker.join(timeout=timeout)
+            self._worker = None
+
+    # --- Worker ---
+    def _requests_batched(self) -> int:
+        return sum(size * count for size, count in self._batch_size_histogram.items())
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._loop, name=self.name, daemon=True)
+                self._worker.start()
+
+    def _collect_batch(self) -> List[tuple]:
+        """Block for the first item, then gather more until the batch is full or the wait expires."""
+        first = self._queue.get()
+        if first is None:
+            return []
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                entry = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if entry is None:
+                self._stopped = True
+                break
+            batch.append(entry)
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect_batch()
+            if batch:
+                self._process(batch)
+            if self._stopped and self._queue.empty():
+                return
+
+    def _process(self, batch: List[tuple]):
+        items = [item for item, _, _ in batch]
+        started = time.perf_counter()
+        try:
+            results = self.run_batch(items)
+            if len(results) != len(items):
+                raise RuntimeError(f"run_batch returned {len(results)} results for {len(items)} items")
+        except Exception as e:
+            with self._lock:
+                self._failed_batches += 1
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        finished = time.perf_counter()
+        with self._lock:
+            self._batches += 1
+            self._batch_size_histogram[len(batch)] = self._batch_size_histogram.get(len(batch), 0) + 1
+            self._total_wait_ms += sum((started - queued_at) * 1000.0 for _, _, queued_at in batch)
+            self._total_batch_ms += (finished - started) * 1000.0
+
+        for (_, future, _), result in zip(batch, results):
+            future.set_result(result)
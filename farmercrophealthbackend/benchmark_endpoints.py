@@ -0,0 +1,399 @@
+# benchmark_endpoints.py
+"""
+Latency and throughput benchmark for the prediction endpoints.
+
+Runs the Flask apps in-process through their test clients:
+
+    /api/predict_crop_health   backend/app.py
+    /predict                   health.py
+    /agentic_predict           agentic_health.py
+
+The Gemini client is replaced by a stub that returns a canned JSON answer
+after --llm-latency-ms, so results measure this code and not the network.
+The prediction cache is off so every request reaches the model.
+
+Each endpoint is driven at several concurrency levels, with one test client
+per thread, and reports p50/p95/p99 latency and requests per second. The
+decode, preprocess, forward and serialization stages are also timed on
+their own. Results are written as JSON with the git commit, host and
+inference settings; --baseline compares a run against an earlier file and
+exits with status 1 when a metric regressed by more than --tolerance.
+
+Usage:
+    python benchmark_endpoints.py --concurrency 1 4 8 16 --requests 200
+    python benchmark_endpoints.py --baseline benchmark_results/20261017T120000.json
+"""
+
+import argparse
+import datetime
+import importlib.util
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(MODEL_DIR, "..", "backend")
+RESULTS_DIR = os.path.join(MODEL_DIR, "benchmark_results")
+
+ENDPOINTS = {
+    "/api/predict_crop_health": "image",
+    "/predict": "file",
+    "/agentic_predict": "file",
+}
+
+# Latency metrics regress upwards, throughput downwards
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms", "mean_ms")
+HIGHER_IS_BETTER = ("throughput_rps",)
+
+# Inference settings recorded with every run
+RECORDED_ENV = (
+    "CROP_HEALTH_MODEL_PATH", "CROP_HEALTH_QUANTIZATION", "CROP_HEALTH_BACKEND", "CROP_HEALTH_TORCH_THREADS",
+    "CROP_HEALTH_INTEROP_THREADS", "CROP_HEALTH_CASCADE", "INFERENCE_WORKERS", "INFERENCE_WORKER_THREADS",
+    "INFERENCE_MAX_BATCH_SIZE", "INFERENCE_MAX_WAIT_MS", "PREDICTION_CACHE_MODE",
+)
+
+STUB_RESPONSE = {
+    "title": "Benchmark stub",
+    "summary": "Canned response from the benchmark LLM stub.",
+    "steps": ["Remove affected leaves.", "Monitor the field weekly."],
+    "recommended_products": [],
+    "schemes": [],
+    "insights": [],
+    "tips": [],
+    "actions": [],
+    "disclaimer": "",
+}
+
+
+# --- Stubbed LLM ---
+def install_llm_stub(latency_ms: float = 0.0):
+    """Replace the Gemini calls in agents.llm_client before any agent module binds them."""
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark-stub")
+    from agents import llm_client
+
+    # Same signatures as the real functions, so agents passing cache_key do not fall into their error paths
+    async def get_llm_response(prompt: str, agent_name: str, cache_key: dict = None) -> dict:
+        if latency_ms > 0:
+            import asyncio
+            await asyncio.sleep(latency_ms / 1000.0)
+        return json.loads(json.dumps(STUB_RESPONSE))
+
+    def get_llm_response_sync(prompt: str, agent_name: str, cache_key: dict = None) -> dict:
+        if latency_ms > 0:
+            time.sleep(latency_ms / 1000.0)
+        return json.loads(json.dumps(STUB_RESPONSE))
+
+    llm_client.get_llm_response = get_llm_response
+    llm_client.get_llm_response_sync = get_llm_response_sync
+    # Agent modules imported earlier hold their own reference to the real function
+    for name, module in list(sys.modules.items()):
+        if name.startswith("agents.") and module is not llm_client:
+            for attr, stub in (("get_llm_response", get_llm_response), ("get_llm_response_sync", get_llm_response_sync)):
+                if hasattr(module, attr):
+                    setattr(module, attr, stub)
+
+
+# --- App Loading ---
+def load_apps(endpoints: List[str]) -> Dict[str, Any]:
+    """endpoint -> Flask app, or the import error that kept the app from loading."""
+    apps: Dict[str, Any] = {}
+    if "/api/predict_crop_health" in endpoints:
+        try:
+            sys.path.insert(0, os.path.abspath(BACKEND_DIR))
+            spec = importlib.util.spec_from_file_location("backend_app", os.path.join(BACKEND_DIR, "app.py"))
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            apps["/api/predict_crop_health"] = module.app
+        except Exception as e:
+            apps["/api/predict_crop_health"] = e
+    if "/predict" in endpoints:
+        try:
+            import health
+            apps["/predict"] = health.app
+        except Exception as e:
+            apps["/predict"] = e
+    if "/agentic_predict" in endpoints:
+        try:
+            import agentic_health
+            apps["/agentic_predict"] = agentic_health.app
+        except Exception as e:
+            apps["/agentic_predict"] = e
+    return apps
+
+
+def _post_image(client, endpoint: str, data: bytes):
+    return client.post(endpoint, data={ENDPOINTS[endpoint]: (io.BytesIO(data), "leaf.jpg")},
+                       content_type="multipart/form-data")
+
+
+# --- Measurement ---
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    ordered = sorted(latencies)
+    if not ordered:
+        return {}
+    def percentile(p):
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 3)
+    return {
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "mean_ms": round(sum(ordered) / len(ordered), 3),
+    }
+
+
+def time_stage(fn: Callable[[int], Any], repeats: int) -> Dict[str, float]:
+    """Latency summary of `repeats` calls of fn(i)."""
+    latencies = []
+    for i in range(repeats):
+        started = time.perf_counter()
+        fn(i)
+        latencies.append((time.perf_counter() - started) * 1000.0)
+    return latency_summary(latencies)
+
+
+def stage_timings(images: List[bytes], responses: Dict[str, Any], apps: Dict[str, Any], repeats: int) -> Dict[str, Any]:
+    """Decode, preprocess and forward of the shared pipeline; serialization of each endpoint's response."""
+    import inference
+    from flask import jsonify
+    from preprocessing import preprocessor
+
+    decoded = [preprocessor.decode(io.BytesIO(data)) for data in images]
+    tensors = [preprocessor.normalize(image).unsqueeze(0) for image in decoded]
+    inference.classify_batch(tensors[:1])  # Warm-up
+
+    stages = {
+        "decode": time_stage(lambda i: preprocessor.decode(io.BytesIO(images[i % len(images)])), repeats),
+        "preprocess": time_stage(lambda i: preprocessor.normalize(decoded[i % len(decoded)]), repeats),
+        "forward": time_stage(lambda i: inference.classify_batch([tensors[i % len(tensors)]]), repeats),
+        "serialize": {},
+    }
+    for endpoint, body in responses.items():
+        with apps[endpoint].app_context():
+            stages["serialize"][endpoint] = {
+                **time_stage(lambda i: jsonify(body).get_data(), repeats),
+                "bytes": len(json.dumps(body)),
+            }
+    return stages
+
+
+def run_level(app, endpoint: str, images: List[bytes], concurrency: int, requests: int) -> Dict[str, Any]:
+    """Send `requests` uploads from `concurrency` threads, each with its own test client."""
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def client_thread():
+        client = app.test_client()
+        local, local_errors = [], {}
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            started = time.perf_counter()
+            response = _post_image(client, endpoint, images[i % len(images)])
+            local.append((time.perf_counter() - started) * 1000.0)
+            if response.status_code != 200:
+                local_errors[str(response.status_code)] = local_errors.get(str(response.status_code), 0) + 1
+        with lock:
+            latencies.extend(local)
+            for status, count in local_errors.items():
+                errors[status] = errors.get(status, 0) + count
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client_thread) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        **latency_summary(latencies),
+    }
+
+
+def warm_up(app, endpoint: str, images: List[bytes], count: int = 4) -> Optional[Any]:
+    """Load the model behind the endpoint and return one successful response body."""
+    client = app.test_client()
+    body = None
+    for data in images[:count]:
+        response = _post_image(client, endpoint, data)
+        if response.status_code != 200:
+            raise RuntimeError(f"warm-up returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        body = response.get_json()
+    return body
+
+
+# --- Run Metadata ---
+def git_commit() -> Optional[str]:
+    try:
+        output = subprocess.run(["git", "rev-parse", "HEAD"], cwd=MODEL_DIR, capture_output=True, text=True, timeout=10)
+        return output.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_metadata(args) -> Dict[str, Any]:
+    import torch
+    from inference_profile import applied_profile, host_cores
+
+    return {
+        "timestamp_utc": datetime.datetime.utcnow().isoformat(),
+        "git_commit": git_commit(),
+        "host_cores": host_cores(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "torch_threads": torch.get_num_threads(),
+        "profile": applied_profile(),
+        "env": {name: os.environ[name] for name in RECORDED_ENV if name in os.environ},
+        "config": {"concurrency": args.concurrency, "requests": args.requests, "images": args.images,
+                   "image_size": args.image_size, "stage_repeats": args.stage_repeats,
+                   "llm_latency_ms": args.llm_latency_ms},
+    }
+
+
+# --- Comparison ---
+def flatten_metrics(result: Dict[str, Any]) -> Dict[str, float]:
+    """'<endpoint> c<concurrency> <metric>' and 'stage <name> <metric>' -> value."""
+    metrics = {}
+    for endpoint, entry in result.get("endpoints", {}).items():
+        for level, stats in entry.get("levels", {}).items():
+            for metric in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+                if metric in stats:
+                    metrics[f"{endpoint} c{level} {metric}"] = stats[metric]
+    stages = result.get("stages", {})
+    for stage, stats in stages.items():
+        if stage == "serialize":
+            for endpoint, serialize_stats in stats.items():
+                for metric in LOWER_IS_BETTER:
+                    if metric in serialize_stats:
+                        metrics[f"stage serialize {endpoint} {metric}"] = serialize_stats[metric]
+            continue
+        for metric in LOWER_IS_BETTER:
+            if metric in stats:
+                metrics[f"stage {stage} {metric}"] = stats[metric]
+    return metrics
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], tolerance: float) -> List[Dict[str, Any]]:
+    """Metrics present in both runs, each marked as a regression when worse by more than `tolerance`."""
+    before, after = flatten_metrics(baseline), flatten_metrics(current)
+    rows = []
+    for key in sorted(before.keys() & after.keys()):
+        old, new = before[key], after[key]
+        change = (new - old) / old if old else 0.0
+        higher_is_better = key.endswith(HIGHER_IS_BETTER)
+        regressed = change < -tolerance if higher_is_better else change > tolerance
+        rows.append({"metric": key, "baseline": old, "current": new,
+                     "change": round(change, 4), "regression": regressed})
+    return rows
+
+
+def print_comparison(rows: List[Dict[str, Any]]):
+    for row in rows:
+        marker = "❌" if row["regression"] else "✅"
+        print(f"{marker} {row['metric']}: {row['baseline']} -> {row['current']} ({row['change'] * 100:+.1f}%)")
+
+
+# --- Entry Point ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Latency and throughput benchmark of the prediction endpoints")
+    parser.add_argument("--endpoints", nargs="+", choices=list(ENDPOINTS), default=list(ENDPOINTS))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint and concurrency level")
+    parser.add_argument("--images", type=int, default=32, help="Number of distinct synthetic photos")
+    parser.add_argument("--image-size", type=int, nargs=2, default=[1024, 768], metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--stage-repeats", type=int, default=50)
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="Simulated latency of each stubbed LLM call")
+    parser.add_argument("--weights", help="Model weights (default: CROP_HEALTH_MODEL_PATH, or random weights if missing)")
+    parser.add_argument("--output", help="Result file (default: benchmark_results/<timestamp>.json)")
+    parser.add_argument("--baseline", help="Earlier result file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Relative change counted as a regression")
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output or os.path.join(
+        RESULTS_DIR, datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S") + ".json"))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    # Configure before the inference modules read their settings
+    os.environ["PREDICTION_CACHE_MODE"] = "off"
+    os.environ.setdefault("DATABASE_URL", "sqlite://")
+    sys.path.insert(0, MODEL_DIR)
+    from autotune import _random_weights, synthetic_leaf_images
+    from model_registry import DEFAULT_CLASSES_PATH, DEFAULT_MODEL_PATH, load_class_names
+
+    model_path = args.weights or os.getenv("CROP_HEALTH_MODEL_PATH", DEFAULT_MODEL_PATH)
+    if not os.path.exists(model_path):
+        print(f"⚠️ '{model_path}' not found; benchmarking random weights of the same architecture.")
+        model_path = _random_weights(len(load_class_names(DEFAULT_CLASSES_PATH)))
+    os.environ["CROP_HEALTH_MODEL_PATH"] = os.path.abspath(model_path)
+
+    # The agentic memory database and other working files go to a scratch directory
+    os.chdir(tempfile.mkdtemp(prefix="benchmark-"))
+    install_llm_stub(args.llm_latency_ms)
+    apps = load_apps(args.endpoints)
+
+    images = synthetic_leaf_images(args.images, tuple(args.image_size))
+    result: Dict[str, Any] = {"metadata": run_metadata(args), "endpoints": {}}
+    responses = {}
+    for endpoint in args.endpoints:
+        app = apps[endpoint]
+        if isinstance(app, Exception):
+            print(f"⚠️ Skipping {endpoint}: app failed to import ({app})")
+            result["endpoints"][endpoint] = {"skipped": str(app)}
+            continue
+        try:
+            responses[endpoint] = warm_up(app, endpoint, images)
+        except RuntimeError as e:
+            print(f"⚠️ Skipping {endpoint}: {e}")
+            result["endpoints"][endpoint] = {"skipped": str(e)}
+            continue
+
+        levels = {}
+        for concurrency in args.concurrency:
+            levels[str(concurrency)] = stats = run_level(app, endpoint, images, concurrency, args.requests)
+            print(f"📊 {endpoint} x{concurrency}: {stats['throughput_rps']} req/s, p50 {stats['p50_ms']} ms, "
+                  f"p95 {stats['p95_ms']} ms, p99 {stats['p99_ms']} ms"
+                  + (f", errors {stats['errors']}" if stats["errors"] else ""))
+        result["endpoints"][endpoint] = {"levels": levels}
+
+    result["stages"] = stage_timings(images, responses, apps, args.stage_repeats)
+    for stage in ("decode", "preprocess", "forward"):
+        stats = result["stages"][stage]
+        print(f"⏱️ {stage}: p50 {stats['p50_ms']} ms, p95 {stats['p95_ms']} ms")
+    for endpoint, stats in result["stages"]["serialize"].items():
+        print(f"⏱️ serialize {endpoint}: p50 {stats['p50_ms']} ms ({stats['bytes']} bytes)")
+
+    exit_code = 0
+    if baseline is not None:
+        rows = compare(baseline, result, args.tolerance)
+        result["comparison"] = {"baseline": os.path.abspath(args.baseline), "tolerance": args.tolerance, "metrics": rows}
+        print_comparison(rows)
+        if any(row["regression"] for row in rows):
+            print(f"❌ Regressions beyond {args.tolerance * 100:.0f}% against '{args.baseline}'.")
+            exit_code = 1
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"✅ Results written to '{output}'.")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
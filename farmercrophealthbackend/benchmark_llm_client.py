@@ -0,0 +1,120 @@
+# benchmark_llm_client.py
+"""
+Micro-benchmark of the per-call overhead of the Gemini client.
+
+Compares the old pattern, genai.configure() plus a new GenerativeModel on
+every call, with the shared client in agents/llm_client.py. Each simulated
+request runs in its own asyncio.run() loop, as the Flask endpoints do, and
+makes --calls-per-request sequential calls, about what one /agentic_predict
+makes.
+
+By default generate_content_async is replaced by a stub. The stub still builds
+the SDK's async gRPC client the way the real method does, then answers after
+--latency-ms. So the measured difference is client setup, not the network.
+With --live the real API is called (GEMINI_API_KEY must be set) and the
+difference also includes the connection and TLS handshakes.
+
+Usage:
+    python benchmark_llm_client.py --requests 20 --calls-per-request 12
+    python benchmark_llm_client.py --live --requests 3 --calls-per-request 4
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+
+import google.generativeai as genai
+from google.generativeai import client as genai_client
+
+from agents import llm_client
+
+PROMPT = 'Reply with the JSON object {"ok": true}.'
+
+
+class StubResponse:
+    text = '{"ok": true}'
+
+
+def install_stub(latency_ms: float):
+    async def generate_content_async(self, contents, **kwargs):
+        if getattr(self, "_async_client", None) is None:
+            # What the SDK does on the first async call: build (or reuse) the gRPC client
+            self._async_client = genai_client.get_default_generative_async_client()
+        await asyncio.sleep(latency_ms / 1000)
+        return StubResponse()
+
+    genai.GenerativeModel.generate_content_async = generate_content_async
+
+
+# --- Client Patterns ---
+async def legacy_call(prompt: str):
+    """The previous get_async_client(): configure and build a model for every call."""
+    genai.configure(api_key=llm_client.API_KEY)
+    model = genai.GenerativeModel(model_name=llm_client.GEMINI_MODEL_NAME,
+                                  generation_config=llm_client.GENERATION_CONFIG)
+    return await model.generate_content_async(prompt)
+
+
+async def pooled_call(prompt: str):
+    return await llm_client.client_manager.generate_async(prompt)
+
+
+def run_requests(call, requests: int, calls_per_request: int):
+    """Per-call latencies in ms, one asyncio.run() loop per simulated request."""
+    latencies = []
+
+    async def one_request():
+        for _ in range(calls_per_request):
+            started = time.perf_counter()
+            await call(PROMPT)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    for _ in range(requests):
+        asyncio.run(one_request())
+    return latencies
+
+
+def summarize(latencies):
+    ordered = sorted(latencies)
+    return {
+        "mean_ms": statistics.fmean(ordered),
+        "p50_ms": ordered[len(ordered) // 2],
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-call overhead of the pooled Gemini client")
+    parser.add_argument("--requests", type=int, default=20, help="Simulated requests (event loops) per pattern")
+    parser.add_argument("--calls-per-request", type=int, default=12)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Stubbed model latency")
+    parser.add_argument("--live", action="store_true", help="Call the real Gemini API")
+    args = parser.parse_args(argv)
+
+    if not args.live:
+        install_stub(args.latency_ms)
+    print(f"📊 {'Live' if args.live else 'Stubbed'} Gemini calls: {args.requests} requests x "
+          f"{args.calls_per_request} calls per pattern")
+
+    # One warm-up request each, so imports and first-use costs are not measured
+    run_requests(legacy_call, 1, 1)
+    run_requests(pooled_call, 1, 1)
+
+    results = {}
+    for name, call in (("per-call client", legacy_call), ("pooled client", pooled_call)):
+        results[name] = summarize(run_requests(call, args.requests, args.calls_per_request))
+        stats = results[name]
+        print(f"⏱️ {name:16s} mean {stats['mean_ms']:8.3f} ms  p50 {stats['p50_ms']:8.3f} ms  "
+              f"p95 {stats['p95_ms']:8.3f} ms")
+
+    saved = results["per-call client"]["mean_ms"] - results["pooled client"]["mean_ms"]
+    print(f"✅ Saved {saved:.3f} ms per call ({saved * args.calls_per_request:.2f} ms per request)")
+    print(f"📊 Client stats: {llm_client.client_manager.stats()}")
+    llm_client.client_manager.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,182 @@
+# bulk_scoring.py
+"""
+Bulk scoring of field-survey uploads.
+
+Images arrive either as many multipart files or as one zip archive. They are
+decoded in a thread pool, scored by the CNN in fixed-size batches, and each
+result is yielded as soon as its batch finishes. At most a couple of batches
+of images are held in memory at any time, so archive size does not matter.
+"""
+
+import io
+import os
+import time
+import zipfile
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+import inference
+from image_folders import IMAGE_EXTENSIONS
+import prediction_cache
+from agents.orchestrator import parse_class_name
+from preprocessing import preprocessor
+
+# --- Configuration ---
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "32"))
+BULK_DECODE_WORKERS = int(os.getenv("BULK_DECODE_WORKERS", str(min(8, os.cpu_count() or 1))))
+BULK_MAX_IMAGES = int(os.getenv("BULK_MAX_IMAGES", "5000"))
+BULK_MAX_IMAGE_BYTES = int(os.getenv("BULK_MAX_IMAGE_BYTES", str(20 * 1024 * 1024)))
+
+
+# --- Upload Sources ---
+def _is_image_name(name: str) -> bool:
+    base = os.path.basename(name)
+    return not base.startswith(".") and os.path.splitext(base)[1].lower() in IMAGE_EXTENSIONS
+
+
+def iter_zip_images(archive_file) -> Iterator[Tuple[str, Callable[[], bytes]]]:
+    """Yield (name, reader) for every image in a zip archive without extracting it."""
+    archive = zipfile.ZipFile(archive_file)
+    for member in archive.infolist():
+        if member.is_dir() or not _is_image_name(member.filename):
+            continue
+        if member.file_size > BULK_MAX_IMAGE_BYTES:
+            yield member.filename, _raise(f"Image exceeds {BULK_MAX_IMAGE_BYTES} bytes uncompressed.")
+            continue
+        yield member.filename, (lambda m=member: archive.read(m))
+
+
+def iter_multipart_images(files) -> Iterator[Tuple[str, Callable[[], bytes]]]:
+    """Yield (name, reader) for uploaded files; zip archives among them are expanded."""
+    for file in files:
+        if file.filename.lower().endswith(".zip"):
+            yield from iter_zip_images(file.stream)
+        else:
+            yield file.filename, (lambda f=file: f.read(BULK_MAX_IMAGE_BYTES + 1))
+
+
+def _raise(message: str):
+    def reader():
+        raise ValueError(message)
+    return reader
+
+
+# --- Scoring ---
+def _prepare(reader: Callable[[], bytes]):
+    """Worker-pool task: read and decode one image into (cache key, cached result or input tensor)."""
+    data = reader()
+    if len(data) > BULK_MAX_IMAGE_BYTES:
+        raise ValueError(f"Image exceeds {BULK_MAX_IMAGE_BYTES} bytes.")
+    image = preprocessor.decode(io.BytesIO(data))
+    key = inference.image_cache_key(image)
+    cached = prediction_cache.get_prediction(key)
+    if cached is not None:
+        return key, cached, None
+    return key, None, preprocessor.normalize(image).unsqueeze(0)
+
+
+def _prediction_record(index: int, name: str, class_name: str, confidence: str, cached: bool) -> Dict[str, Any]:
+    crop, disease = parse_class_name(class_name)
+    return {
+        "type": "prediction",
+        "index": index,
+        "filename": name,
+        "class_name": class_name,
+        "crop": crop,
+        "disease": disease,
+        "confidence": confidence,
+        "is_healthy": "healthy" in class_name.lower(),
+        "cached": cached,
+    }
+
+
+def score_images(images: Iterator[Tuple[str, Callable[[], bytes]]], batch_size: int = BULK_BATCH_SIZE,
+                 workers: int = BULK_DECODE_WORKERS, enrich: Optional[Callable[[str, str], Dict[str, Any]]] = None,
+                 max_images: int = BULK_MAX_IMAGES) -> Iterator[Dict[str, Any]]:
+    """
+    Score images and yield one record per image as its batch completes, then a summary.
+
+    If `enrich` is given it is called with (class_name, confidence) once per
+    distinct predicted class and its result is yielded as an "enrichment"
+    record right after the first image of that class.
+    """
+    model, class_names = inference.load_model()
+    if model is None:
+        raise RuntimeError("Model is not loaded. Cannot perform prediction.")
+
+    started = time.perf_counter()
+    class_counts: Counter = Counter()
+    enriched = set()
+    errors = 0
+    scored = 0
+    # Two batches in flight: one being decoded while the previous one runs through the model
+    window = 2 * batch_size
+
+    def finish(batch):
+        nonlocal errors, scored
+        tensors = [result[2] for _, result in batch if result[0] == "tensor"]
+        outputs = iter(inference.predict_batch(tensors) if tensors else ())
+        for (index, name), result in batch:
+            if result[0] == "error":
+                errors += 1
+                yield {"type": "error", "index": index, "filename": name, "error": result[1]}
+                continue
+            if result[0] == "cached":
+                class_name, confidence = result[2]
+                cached = True
+            else:
+                class_name, confidence = next(outputs)
+                prediction_cache.put_prediction(result[1], class_name, confidence)
+                cached = False
+            scored += 1
+            class_counts[class_name] += 1
+            yield _prediction_record(index, name, class_name, confidence, cached)
+            if enrich is not None and class_name not in enriched:
+                enriched.add(class_name)
+                try:
+                    yield {"type": "enrichment", "class_name": class_name, "enrichment": enrich(class_name, confidence)}
+                except Exception as e:
+                    yield {"type": "enrichment", "class_name": class_name, "error": str(e)}
+
+    def collect(future):
+        try:
+            key, cached, tensor = future.result()
+        except Exception as e:
+            return ("error", str(e))
+        return ("cached", key, cached) if cached is not None else ("tensor", key, tensor)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bulk-decode") as pool:
+        in_flight: deque = deque()
+        batch = []
+        for index, (name, reader) in enumerate(images):
+            if index >= max_images:
+                yield {"type": "error", "index": index, "filename": name,
+                       "error": f"Upload limit of {max_images} images reached; remaining images skipped."}
+                errors += 1
+                break
+            in_flight.append(((index, name), pool.submit(_prepare, reader)))
+            # Keep uploads in order and decoding bounded: drain the oldest once the window is full
+            while len(in_flight) >= window:
+                entry, future = in_flight.popleft()
+                batch.append((entry, collect(future)))
+                if len(batch) == batch_size:
+                    yield from finish(batch)
+                    batch = []
+        while in_flight:
+            entry, future = in_flight.popleft()
+            batch.append((entry, collect(future)))
+            if len(batch) == batch_size:
+                yield from finish(batch)
+                batch = []
+        if batch:
+            yield from finish(batch)
+
+    yield {
+        "type": "summary",
+        "images": scored + errors,
+        "scored": scored,
+        "errors": errors,
+        "classes": dict(class_counts.most_common()),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000.0, 1),
+    }
@@ -0,0 +1,205 @@
+# cascade.py
+"""
+Confidence-gated model cascade for crop-health predictions.
+
+A small distilled student (crop_cnn.StudentCNN, trained by distill.py) answers
+every image first. Only images whose student softmax confidence is below
+CASCADE_THRESHOLD are sent to the full CNN. Easy cases (clear healthy leaves,
+obvious rust) never pay for the ten-conv teacher.
+
+Every decision is recorded. Escalated images have both the student's and the
+teacher's answer. A small random share of the confident ones (CASCADE_AUDIT_RATE)
+also runs through the teacher, so agreement above the threshold can be measured.
+`threshold_report` turns those records into escalation rate and
+agreement-with-teacher for candidate thresholds.
+
+Usage:
+    python cascade.py report --log cascade_log.jsonl
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import torch
+
+# --- Configuration ---
+CASCADE_THRESHOLD = float(os.getenv("CASCADE_THRESHOLD", "0.9"))
+CASCADE_AUDIT_RATE = float(os.getenv("CASCADE_AUDIT_RATE", "0.02"))
+CASCADE_LOG_PATH = os.getenv("CASCADE_LOG_PATH")  # Optional JSONL file with one record per image
+
+DEFAULT_THRESHOLDS = (0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 0.98, 0.99)
+
+
+def _top1(model, batch: torch.Tensor) -> Tuple[List[int], List[float]]:
+    with torch.no_grad():
+        probabilities = torch.nn.functional.softmax(model(batch), dim=1)
+        confidences, indices = torch.max(probabilities, 1)
+    return indices.tolist(), confidences.tolist()
+
+
+class ModelCascade:
+    """
+    Runs a batch through the student, then re-runs the uncertain (and audited)
+    images through the teacher as one smaller batch.
+
+    Both models come from model registries, so each is lazily loaded, warmed up
+    and hot-reloadable on its own.
+    """
+
+    def __init__(self, student_registry, teacher_registry, threshold: float = CASCADE_THRESHOLD,
+                 audit_rate: float = CASCADE_AUDIT_RATE, log_path: Optional[str] = CASCADE_LOG_PATH):
+        self.student_registry = student_registry
+        self.teacher_registry = teacher_registry
+        self.threshold = threshold
+        self.audit_rate = audit_rate
+        self.log_path = log_path
+        self.lock = threading.Lock()
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self._images = 0
+        self._escalated = 0
+        self._audited = 0
+        self._compared = 0
+        self._agreements = 0
+
+    # --- Prediction ---
+    def run(self, batch: torch.Tensor) -> List[Tuple[str, float, str]]:
+        """Return (class_name, confidence, stage) per image; stage is "student" or "teacher"."""
+        student, class_names = self.student_registry.get()
+        if student is None:
+            raise RuntimeError("Cascade student model is not loaded.")
+        indices, confidences = _top1(student, batch)
+
+        escalate = [i for i, confidence in enumerate(confidences) if confidence < self.threshold]
+        audit = [i for i, confidence in enumerate(confidences)
+                 if confidence >= self.threshold and random.random() < self.audit_rate]
+        teacher_results: Dict[int, Tuple[int, float]] = {}
+        if escalate or audit:
+            teacher, _ = self.teacher_registry.get()
+            if teacher is None:
+                raise RuntimeError("Cascade teacher model is not loaded.")
+            rows = escalate + audit
+            teacher_indices, teacher_confidences = _top1(teacher, batch[rows])
+            teacher_results = dict(zip(rows, zip(teacher_indices, teacher_confidences)))
+
+        results, records = [], []
+        escalated = set(escalate)
+        for i, (index, confidence) in enumerate(zip(indices, confidences)):
+            record = {
+                "student_class": class_names[index],
+                "student_confidence": round(confidence, 4),
+                "escalated": i in escalated,
+                "audited": i in teacher_results and i not in escalated,
+            }
+            if i in teacher_results:
+                teacher_index, teacher_confidence = teacher_results[i]
+                record.update({"teacher_class": class_names[teacher_index],
+                               "teacher_confidence": round(teacher_confidence, 4)})
+            records.append(record)
+            if i in escalated:
+                results.append((class_names[teacher_results[i][0]], teacher_results[i][1], "teacher"))
+            else:
+                results.append((class_names[index], confidence, "student"))
+
+        self._record(records)
+        return results
+
+    def fingerprint(self) -> str:
+        """Cache-key prefix: cascade answers depend on both models and the threshold."""
+        return (f"cascade({self.student_registry.fingerprint()}<{self.threshold}>"
+                f"{self.teacher_registry.fingerprint()})")
+
+    def readiness(self) -> Dict[str, Any]:
+        teacher = self.teacher_registry.readiness()
+        student = self.student_registry.readiness()
+        return {**teacher, "ready": teacher["ready"] and student["ready"],
+                "cascade": {"threshold": self.threshold, "student": student}}
+
+    # --- Recording ---
+    def _record(self, records: List[Dict[str, Any]]):
+        with self.lock:
+            self._images += len(records)
+            for record in records:
+                self._escalated += int(record["escalated"])
+                self._audited += int(record["audited"])
+                if "teacher_class" in record:
+                    self._compared += 1
+                    self._agreements += int(record["teacher_class"] == record["student_class"])
+            if self.log_path:
+                timestamp = datetime.datetime.utcnow().isoformat()
+                with open(self.log_path, "a") as f:
+                    for record in records:
+                        f.write(json.dumps({"timestamp": timestamp, "threshold": self.threshold, **record}) + "\n")
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "threshold": self.threshold,
+                "audit_rate": self.audit_rate,
+                "images": self._images,
+                "escalated": self._escalated,
+                "escalation_rate": round(self._escalated / self._images, 4) if self._images else 0,
+                "audited": self._audited,
+                "student_teacher_agreement": round(self._agreements / self._compared, 4) if self._compared else None,
+                "log_path": self.log_path,
+            }
+
+    def reset_stats(self):
+        with self.lock:
+            self._reset_stats()
+
+
+# --- Threshold Tuning ---
+def threshold_report(records: Iterable[Dict[str, Any]],
+                     thresholds: Sequence[float] = DEFAULT_THRESHOLDS) -> Dict[str, Any]:
+    """
+    For each candidate threshold: the share of images that would be escalated,
+    and how often the student agrees with the teacher on the images it would
+    keep (only records with a teacher answer count towards agreement).
+    """
+    records = list(records)
+    report = {}
+    for threshold in thresholds:
+        kept = [r for r in records if r["student_confidence"] >= threshold]
+        compared = [r for r in kept if "teacher_class" in r]
+        agree = sum(r["student_class"] == r["teacher_class"] for r in compared)
+        report[f"{threshold:.2f}"] = {
+            "escalation_rate": round(1 - len(kept) / len(records), 4) if records else None,
+            "kept_agreement": round(agree / len(compared), 4) if compared else None,
+            "compared": len(compared),
+        }
+    return {"images": len(records), "thresholds": report}
+
+
+def read_log(path: str) -> List[Dict[str, Any]]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tune the cascade confidence threshold")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rep = sub.add_parser("report", help="Escalation rate and agreement per threshold from a cascade log")
+    rep.add_argument("--log", default=CASCADE_LOG_PATH, required=CASCADE_LOG_PATH is None)
+    rep.add_argument("--thresholds", type=float, nargs="+", default=list(DEFAULT_THRESHOLDS))
+    args = parser.parse_args(argv)
+
+    records = read_log(args.log)
+    if not records:
+        print(f"❌ No records in '{args.log}'.")
+        return 1
+    print(f"📊 {len(records)} cascade records "
+          f"({sum(r['audited'] for r in records)} audited, {sum(r['escalated'] for r in records)} escalated)")
+    print(json.dumps(threshold_report(records, args.thresholds), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+# crop_cnn.py
+
+import torch
+
+# --- Model Definition ---
+class LowRankLinear(torch.nn.Sequential):
+    """Linear(in, out) factorized as Linear(in, rank) -> Linear(rank, out), see low_rank.py."""
+    def __init__(self, in_features, out_features, rank):
+        super(LowRankLinear, self).__init__(
+            torch.nn.Linear(in_features, rank, bias=False),
+            torch.nn.Linear(rank, out_features)
+        )
+        self.in_features = in_features
+        self.out_features = out_features
+        self.rank = rank
+
+
+# Output channels of the nine convolutions; MaxPool follows the 2nd, 4th, 6th and 8th
+DEFAULT_WIDTHS = (32, 32, 64, 64, 128, 128, 256, 256, 256)
+# Convolutions grouped by the resolution they run at (used by pruning.py for per-stage ratios)
+STAGES = ((0, 1), (2, 3), (4, 5), (6, 7), (8,))
+
+
+class CNN(torch.nn.Module):
+    """
+    A Convolutional Neural Network for image classification.
+
+    `widths` sets the output channels of the nine convolutions (pruned variants
+    written by pruning.py) and `head_rank` replaces the first dense layer with a
+    rank-`head_rank` factorization (the compressed variant written by low_rank.py).
+    """
+    def __init__(self, num_classes, head_rank=None, widths=DEFAULT_WIDTHS):
+        super(CNN, self).__init__()
+        if len(widths) != len(DEFAULT_WIDTHS):
+            raise ValueError(f"Expected {len(DEFAULT_WIDTHS)} conv widths, got {len(widths)}")
+        w = self.widths = tuple(int(width) for width in widths)
+        # Convolutional layers
+        self.conv_layers = torch.nn.Sequential(
+            torch.nn.Conv2d(3, w[0], 3, 1, 1), torch.nn.ReLU(), torch.nn.BatchNorm2d(w[0]),
+            torch.nn.Conv2d(w[0], w[1], 3, 1, 1), torch.nn.ReLU(), torch.nn.BatchNorm2d(w[1]),
+            torch.nn.MaxPool2d(2),
+            torch.nn.Conv2d(w[1], w[2], 3, 1, 1), torch.nn.ReLU(), torch.nn.BatchNorm2d(w[2]),
+            torch.nn.Conv2d(w[2], w[3], 3, 1, 1), torch.nn.ReLU(), torch.nn.BatchNorm2d(w[3]),
+            torch.nn.MaxPool2d(2),
+            torch.nn.Conv2d(w[3], w[4], 3, 1, 1), torch.nn.ReLU(), torch.nn.BatchNorm2d(w[4]),
+            torch.nn.Conv2d(w[4], w[5], 3, 1, 1), torch.nn.ReLU(), torch.nn.BatchNorm2d(w[5]),
+            torch.nn.MaxPool2d(2),
+            torch.nn.Conv2d(w[5], w[6], 3, 1, 1), torch.nn.ReLU(), torch.nn.BatchNorm2d(w[6]),
+            torch.nn.Conv2d(w[6], w[7], 3, 1, 1), torch.nn.ReLU(), torch.nn.BatchNorm2d(w[7]),
+            torch.nn.MaxPool2d(2),
+            torch.nn.Conv2d(w[7], w[8], 3, 1, 1), torch.nn.ReLU(), torch.nn.BatchNorm2d(w[8])
+        )
+        self.avgpool = torch.nn.AdaptiveAvgPool2d((7, 7))
+        # Dense (fully connected) layers
+        self.dense_layers = torch.nn.Sequential(
+            torch.nn.Dropout(0.4),
+            LowRankLinear(w[8] * 7 * 7, 1024, head_rank) if head_rank else torch.nn.Linear(w[8] * 7 * 7, 1024),
+            torch.nn.ReLU(),
+            torch.nn.Dropout(0.4),
+            torch.nn.Linear(1024, num_classes)
+        )
+
+    def forward(self, x):
+        x = self.conv_layers(x)
+        x = self.avgpool(x)
+        x = torch.flatten(x, 1)
+        x = self.dense_layers(x)
+        return x
+
+def conv_widths(model):
+    """Output channels of each convolution of a CNN (also works for checkpoints pickled before `widths` existed)."""
+    return tuple(m.out_channels for m in model.conv_layers if isinstance(m, torch.nn.Conv2d))
+
+# --- Student Model ---
+class StudentCNN(torch.nn.Module):
+    """
+    A small first-stage classifier for the confidence-gated cascade (cascade.py),
+    distilled from CNN by distill.py. Four Conv-BN-ReLU-MaxPool blocks and a
+    linear head: roughly a twentieth of CNN's multiply-adds.
+    """
+    def __init__(self, num_classes, widths=(16, 32, 64, 128)):
+        super(StudentCNN, self).__init__()
+        layers = []
+        in_channels = 3
+        for width in widths:
+            layers += [
+                torch.nn.Conv2d(in_channels, width, 3, 1, 1, bias=False), torch.nn.BatchNorm2d(width), torch.nn.ReLU(),
+                torch.nn.MaxPool2d(2),
+            ]
+            in_channels = width
+        self.conv_layers = torch.nn.Sequential(*layers)
+        self.avgpool = torch.nn.AdaptiveAvgPool2d((1, 1))
+        self.classifier = torch.nn.Sequential(
+            torch.nn.Dropout(0.2),
+            torch.nn.Linear(in_channels, num_classes)
+        )
+
+    def forward(self, x):
+        x = self.conv_layers(x)
+        x = self.avgpool(x)
+        x = torch.flatten(x, 1)
+        x = self.classifier(x)
+        return x
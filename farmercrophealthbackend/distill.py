@@ -0,0 +1,191 @@
+# distill.py
+"""
+Distill the full crop-health CNN into the cascade's StudentCNN.
+
+The teacher is the served CNN and the class list is classes.json. The student
+learns the teacher's temperature-softened class distribution. When images sit
+in PlantVillage-style class folders, it also learns the true labels; otherwise
+it learns the teacher's top-1. A held-out split reports student/teacher
+agreement, accuracy, latency and a threshold table (see cascade.threshold_report)
+for picking CASCADE_THRESHOLD.
+
+The student is saved in the memory-mapped format (weights_format.py) with its
+architecture in the metadata, so the model registry loads it like any weights file.
+
+Usage:
+    python distill.py --images ./plantvillage --epochs 10 --output student_weights.safetensors
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from typing import List, Optional
+
+import torch
+
+from cascade import threshold_report
+from crop_cnn import StudentCNN
+from image_folders import iter_image_files, label_from_path
+from model_registry import DEFAULT_CLASSES_PATH, load_class_names, load_model_file
+from preprocessing import preprocessor
+from weights_format import save_state_dict
+
+MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_STUDENT_PATH = os.path.join(MODEL_DIR, "student_weights.safetensors")
+
+
+def _load_batch(paths: List[str], augment: bool, rng: Optional[random.Random] = None) -> torch.Tensor:
+    batch = torch.empty((len(paths), 3, preprocessor.crop_size, preprocessor.crop_size), dtype=torch.float32)
+    for i, path in enumerate(paths):
+        with open(path, "rb") as f:
+            preprocessor(f, out=batch[i])
+        if augment and (rng or random).random() < 0.5:
+            batch[i] = batch[i].flip(-1)
+    return batch
+
+
+def distillation_loss(student_logits: torch.Tensor, teacher_logits: torch.Tensor, targets: torch.Tensor,
+                      temperature: float, alpha: float) -> torch.Tensor:
+    """alpha * T^2 * KL(teacher_T || student_T) + (1 - alpha) * CE(student, targets)."""
+    soft = torch.nn.functional.kl_div(
+        torch.nn.functional.log_softmax(student_logits / temperature, dim=1),
+        torch.nn.functional.softmax(teacher_logits / temperature, dim=1),
+        reduction="batchmean",
+    ) * (temperature ** 2)
+    hard = torch.nn.functional.cross_entropy(student_logits, targets)
+    return alpha * soft + (1 - alpha) * hard
+
+
+def _targets(paths: List[str], images_dir: str, class_names: List[str], teacher_logits: torch.Tensor) -> torch.Tensor:
+    """True labels from class folders where available, the teacher's top-1 otherwise."""
+    teacher_top1 = teacher_logits.argmax(dim=1).tolist()
+    labels = [label_from_path(p, images_dir, class_names) for p in paths]
+    return torch.tensor([label if label is not None else t for label, t in zip(labels, teacher_top1)])
+
+
+def evaluate(student: torch.nn.Module, teacher: torch.nn.Module, paths: List[str], images_dir: str,
+             class_names: List[str], batch_size: int) -> dict:
+    """Agreement, accuracy, per-image latency and the threshold table on held-out images."""
+    student.eval()
+    records, correct, labelled = [], {"student": 0, "teacher": 0}, 0
+    timings = {"student": 0.0, "teacher": 0.0}
+    with torch.no_grad():
+        for start in range(0, len(paths), batch_size):
+            chunk = paths[start:start + batch_size]
+            batch = _load_batch(chunk, augment=False)
+            started = time.perf_counter()
+            student_probs = torch.nn.functional.softmax(student(batch), dim=1)
+            timings["student"] += time.perf_counter() - started
+            started = time.perf_counter()
+            teacher_probs = torch.nn.functional.softmax(teacher(batch), dim=1)
+            timings["teacher"] += time.perf_counter() - started
+
+            student_conf, student_idx = torch.max(student_probs, 1)
+            teacher_idx = teacher_probs.argmax(dim=1)
+            for path, s_idx, s_conf, t_idx in zip(chunk, student_idx.tolist(), student_conf.tolist(), teacher_idx.tolist()):
+                records.append({"student_class": class_names[s_idx], "student_confidence": s_conf,
+                                "teacher_class": class_names[t_idx]})
+                label = label_from_path(path, images_dir, class_names)
+                if label is not None:
+                    labelled += 1
+                    correct["student"] += int(s_idx == label)
+                    correct["teacher"] += int(t_idx == label)
+
+    agreement = sum(r["student_class"] == r["teacher_class"] for r in records) / len(records)
+    return {
+        "images": len(records),
+        "student_teacher_agreement": round(agreement, 4),
+        "accuracy": {
+            "labelled_images": labelled,
+            "student": round(correct["student"] / labelled, 4) if labelled else None,
+            "teacher": round(correct["teacher"] / labelled, 4) if labelled else None,
+        },
+        "latency_ms_per_image": {
+            "student": round(timings["student"] * 1000.0 / len(records), 3),
+            "teacher": round(timings["teacher"] * 1000.0 / len(records), 3),
+        },
+        "threshold_table": threshold_report(records)["thresholds"],
+    }
+
+
+def distill(teacher: torch.nn.Module, class_names: List[str], images_dir: str, epochs: int = 10,
+            batch_size: int = 32, lr: float = 1e-3, temperature: float = 4.0, alpha: float = 0.7,
+            val_fraction: float = 0.1, seed: int = 0, student: Optional[torch.nn.Module] = None):
+    """Train a StudentCNN against the teacher. Returns (student, evaluation report)."""
+    paths = iter_image_files(images_dir)
+    if len(paths) < 2:
+        raise ValueError(f"Need at least two images in '{images_dir}', found {len(paths)}.")
+    rng = random.Random(seed)
+    rng.shuffle(paths)
+    n_val = max(1, int(len(paths) * val_fraction))
+    val_paths, train_paths = paths[:n_val], paths[n_val:]
+
+    torch.manual_seed(seed)
+    teacher.eval()
+    student = student or StudentCNN(num_classes=len(class_names))
+    optimizer = torch.optim.AdamW(student.parameters(), lr=lr, weight_decay=1e-4)
+    steps_per_epoch = (len(train_paths) + batch_size - 1) // batch_size
+    scheduler = torch.optim.lr_scheduler.OneCycleLR(optimizer, max_lr=lr, epochs=epochs, steps_per_epoch=steps_per_epoch)
+
+    print(f"📊 Distilling on {len(train_paths)} images, validating on {len(val_paths)}...")
+    for epoch in range(epochs):
+        student.train()
+        rng.shuffle(train_paths)
+        total_loss = 0.0
+        for start in range(0, len(train_paths), batch_size):
+            chunk = train_paths[start:start + batch_size]
+            batch = _load_batch(chunk, augment=True, rng=rng)
+            with torch.no_grad():
+                teacher_logits = teacher(batch)
+            targets = _targets(chunk, images_dir, class_names, teacher_logits)
+            loss = distillation_loss(student(batch), teacher_logits, targets, temperature, alpha)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            scheduler.step()
+            total_loss += loss.item() * len(chunk)
+        print(f"🔄 Epoch {epoch + 1}/{epochs}: loss {total_loss / len(train_paths):.4f}")
+
+    return student.eval(), evaluate(student, teacher, val_paths, images_dir, class_names, batch_size)
+
+
+def main(argv=None):
+    from inference import MODEL_PATH
+
+    parser = argparse.ArgumentParser(description="Distill the crop-health CNN into the cascade student")
+    parser.add_argument("--images", required=True, help="Folder of leaf images (class sub-folders optional)")
+    parser.add_argument("--teacher", default=MODEL_PATH, help="Teacher weights (default: the served CNN)")
+    parser.add_argument("--output", default=DEFAULT_STUDENT_PATH)
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--temperature", type=float, default=4.0)
+    parser.add_argument("--alpha", type=float, default=0.7, help="Weight of the soft (teacher) loss")
+    parser.add_argument("--val-fraction", type=float, default=0.1)
+    parser.add_argument("--report", help="Write the JSON evaluation report to this file")
+    args = parser.parse_args(argv)
+
+    class_names = load_class_names(DEFAULT_CLASSES_PATH)
+    teacher = load_model_file(args.teacher, len(class_names))
+    student, report = distill(teacher, class_names, args.images, args.epochs, args.batch_size, args.lr,
+                              args.temperature, args.alpha, args.val_fraction)
+
+    save_state_dict(student.state_dict(), args.output, metadata={
+        "format": "pt",
+        "architecture": "crop_cnn.StudentCNN",
+        "num_classes": len(class_names),
+        "teacher": os.path.basename(args.teacher),
+    })
+    print(json.dumps(report, indent=2))
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    print(f"✅ Student saved to '{args.output}'. Pick CASCADE_THRESHOLD from the threshold table above.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
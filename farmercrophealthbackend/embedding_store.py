@@ -0,0 +1,266 @@
+# embedding_store.py
+"""
+Store of penultimate CNN activations for head-only retraining.
+
+With EMBEDDING_STORE_DIR set, every image the server scores on the eager fp32
+PyTorch path leaves its 1024-d input to the final Linear layer behind. The
+vectors go into one memory-mapped float16 file (2 KB per image). Rows are
+indexed in a sqlite file next to it, together with the prediction and any
+label corrected through /agentic_learn. head_retrain.py refits only the final
+layer from these rows, which takes seconds on a CPU.
+
+The vectors depend on every layer except the final one, so each row records a
+fingerprint of those layers (the "trunk"). Retrained heads keep the trunk,
+so rows stay usable across head versions. One server process writes the
+store; readers such as head_retrain.py can open it at any time.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+
+from quantization import is_quantized
+
+# --- Configuration ---
+EMBEDDING_STORE_DIR = os.getenv("EMBEDDING_STORE_DIR", "")  # Empty: embeddings are not stored
+EMBEDDING_STORE_GROW_ROWS = int(os.getenv("EMBEDDING_STORE_GROW_ROWS", "4096"))
+EMBEDDING_DIM = 1024
+
+
+# --- Model Helpers ---
+def supports_embeddings(model) -> bool:
+    """
+    Eager fp32 CNNs. TorchScript (including the static-int8 artifact), ONNX and the
+    worker pool are not supported, nor are quantized models: their int8 activations
+    and trunk fingerprint would not match the fp32 weights head_retrain.py refits.
+    """
+    return (isinstance(model, torch.nn.Module) and not isinstance(model, torch.jit.ScriptModule)
+            and hasattr(model, "conv_layers") and hasattr(model, "dense_layers") and not is_quantized(model))
+
+
+def forward_with_embeddings(model, batch: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    """CNN.forward split before the final layer: returns (penultimate activations, logits)."""
+    x = torch.flatten(model.avgpool(model.conv_layers(batch)), 1)
+    features = model.dense_layers[:-1](x)
+    return features, model.dense_layers[-1](features)
+
+
+def trunk_fingerprint(model) -> str:
+    """Hash of every weight except the final layer's, cached on the model object."""
+    cached = getattr(model, "_trunk_fingerprint", None)
+    if cached is not None:
+        return cached
+    head_prefix = f"dense_layers.{len(model.dense_layers) - 1}."
+    digest = hashlib.blake2b(digest_size=8)
+    for name, tensor in sorted(model.state_dict().items()):
+        if name.startswith(head_prefix) or not isinstance(tensor, torch.Tensor):
+            continue
+        digest.update(name.encode())
+        digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    model._trunk_fingerprint = digest.hexdigest()
+    return model._trunk_fingerprint
+
+
+# --- Store ---
+class EmbeddingStore:
+    """Append-only float16 vectors in `embeddings.f16`, indexed by `index.db`."""
+
+    def __init__(self, directory: str, dim: int = EMBEDDING_DIM, grow_rows: int = EMBEDDING_STORE_GROW_ROWS):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.dim = dim
+        self.grow_rows = grow_rows
+        self.vectors_path = os.path.join(directory, "embeddings.f16")
+        self.db_path = os.path.join(directory, "index.db")
+        self.lock = threading.Lock()
+        self._listeners: List[Callable[[str, List[int], np.ndarray], None]] = []
+        self._init_database()
+        with sqlite3.connect(self.db_path) as conn:
+            self._count = conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM embeddings").fetchone()[0]
+        self._array = None
+        self._capacity = 0
+        self._open(max(self._count, self._file_rows()))
+
+    def _init_database(self):
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    row INTEGER PRIMARY KEY,
+                    image_id TEXT NOT NULL,
+                    trunk TEXT NOT NULL,
+                    predicted TEXT NOT NULL,
+                    confidence REAL NOT NULL,
+                    created_at REAL NOT NULL,
+                    UNIQUE (image_id, trunk)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS labels (
+                    image_id TEXT PRIMARY KEY,
+                    label TEXT NOT NULL,
+                    rating INTEGER,
+                    source TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+
+    def _file_rows(self) -> int:
+        if not os.path.exists(self.vectors_path):
+            return 0
+        return os.path.getsize(self.vectors_path) // (self.dim * 2)
+
+    def _open(self, rows: int):
+        """(Re)map the vector file with room for at least `rows` rows."""
+        capacity = max(rows, self.grow_rows)
+        if self._file_rows() < capacity:
+            with open(self.vectors_path, "ab") as f:
+                f.truncate(capacity * self.dim * 2)
+        if self._array is not None:
+            self._array.flush()
+        self._array = np.memmap(self.vectors_path, dtype=np.float16, mode="r+", shape=(capacity, self.dim))
+        self._capacity = capacity
+
+    # --- Writing ---
+    def append(self, image_ids: Sequence[str], trunk: str, embeddings: torch.Tensor,
+               predictions: Sequence[Tuple[str, float]]) -> int:
+        """Store the vectors of images not yet stored for this trunk. Returns the number of rows added."""
+        if not any(image_ids):
+            return 0
+        with self.lock:
+            with sqlite3.connect(self.db_path) as conn:
+                placeholders = ",".join("?" * len(image_ids))
+                known = {row[0] for row in conn.execute(
+                    f"SELECT image_id FROM embeddings WHERE trunk = ? AND image_id IN ({placeholders})",
+                    (trunk, *image_ids))}
+                new = []
+                for i, image_id in enumerate(image_ids):
+                    if image_id and image_id not in known:
+                        known.add(image_id)
+                        new.append(i)
+                if not new:
+                    return 0
+
+                start = self._count
+                if start + len(new) > self._capacity:
+                    self._open(start + len(new) + self.grow_rows)
+                vectors = embeddings[new].detach().float().cpu().numpy()
+                self._array[start:start + len(new)] = vectors.astype(np.float16)
+                now = time.time()
+                conn.executemany(
+                    "INSERT INTO embeddings (row, image_id, trunk, predicted, confidence, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(start + n, image_ids[i], trunk, predictions[i][0], float(predictions[i][1]), now)
+                     for n, i in enumerate(new)])
+                self._count = start + len(new)
+        for listener in self._listeners:
+            listener(trunk, list(range(start, start + len(new))), vectors)
+        return len(new)
+
+    def add_listener(self, listener: Callable[[str, List[int], np.ndarray], None]):
+        """Call listener(trunk, rows, float32 vectors) after every append (used by similar_cases.py)."""
+        self._listeners.append(listener)
+
+    def add_label(self, image_id: str, label: str, rating: Optional[int] = None, source: str = "feedback"):
+        """Record the correct class of an image (the latest label wins)."""
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO labels (image_id, label, rating, source, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, (image_id, label, rating, source, time.time()))
+
+    def flush(self):
+        with self.lock:
+            if self._array is not None:
+                self._array.flush()
+
+    # --- Reading ---
+    def rows(self, trunk: str) -> List[Dict[str, Any]]:
+        """Index rows for one trunk, each with its label (None if unlabeled)."""
+        with sqlite3.connect(self.db_path) as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.execute("""
+                SELECT e.row, e.image_id, e.predicted, e.confidence, l.label, l.rating, l.source
+                FROM embeddings e LEFT JOIN labels l ON l.image_id = e.image_id
+                WHERE e.trunk = ? ORDER BY e.row
+            """, (trunk,))
+            return [dict(row) for row in cursor]
+
+    def row_ids(self, trunk: str, after_row: int = -1) -> np.ndarray:
+        with sqlite3.connect(self.db_path) as conn:
+            rows = conn.execute("SELECT row FROM embeddings WHERE trunk = ? AND row > ? ORDER BY row",
+                                (trunk, after_row)).fetchall()
+        return np.array([row[0] for row in rows], dtype=np.int64)
+
+    def row_of(self, image_id: str, trunk: str) -> Optional[int]:
+        with sqlite3.connect(self.db_path) as conn:
+            row = conn.execute("SELECT row FROM embeddings WHERE image_id = ? AND trunk = ?", (image_id, trunk)).fetchone()
+        return row[0] if row else None
+
+    def latest_trunk(self) -> Optional[str]:
+        with sqlite3.connect(self.db_path) as conn:
+            row = conn.execute("SELECT trunk FROM embeddings ORDER BY row DESC LIMIT 1").fetchone()
+        return row[0] if row else None
+
+    def describe(self, rows: Sequence[int]) -> Dict[int, Dict[str, Any]]:
+        """row -> image_id, prediction, label and time stored."""
+        if not len(rows):
+            return {}
+        with sqlite3.connect(self.db_path) as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.execute(f"""
+                SELECT e.row, e.image_id, e.predicted, e.confidence, e.created_at, l.label, l.source
+                FROM embeddings e LEFT JOIN labels l ON l.image_id = e.image_id
+                WHERE e.row IN ({",".join("?" * len(rows))})
+            """, [int(r) for r in rows])
+            return {row["row"]: dict(row) for row in cursor}
+
+    def predicted_class(self, image_id: str) -> Optional[str]:
+        """What the most recently stored model predicted for an image."""
+        with sqlite3.connect(self.db_path) as conn:
+            row = conn.execute("SELECT predicted FROM embeddings WHERE image_id = ? ORDER BY row DESC LIMIT 1",
+                               (image_id,)).fetchone()
+        return row[0] if row else None
+
+    def vectors(self, rows: Sequence[int]) -> torch.Tensor:
+        """float32 copy of the given rows."""
+        return torch.from_numpy(np.asarray(self._array[list(rows)], dtype=np.float32))
+
+    def stats(self) -> Dict[str, Any]:
+        with sqlite3.connect(self.db_path) as conn:
+            trunks = dict(conn.execute("SELECT trunk, COUNT(*) FROM embeddings GROUP BY trunk").fetchall())
+            labels = conn.execute("SELECT COUNT(*) FROM labels").fetchone()[0]
+        return {"directory": self.directory, "rows": self._count, "capacity": self._capacity,
+                "size_mb": round(self._capacity * self.dim * 2 / (1024.0 * 1024.0), 2),
+                "rows_per_trunk": trunks, "labels": labels}
+
+
+_store: Optional[EmbeddingStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> Optional[EmbeddingStore]:
+    """The process-wide store, or None when EMBEDDING_STORE_DIR is not set."""
+    global _store
+    if not EMBEDDING_STORE_DIR:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = EmbeddingStore(EMBEDDING_STORE_DIR)
+        return _store
+
+
+def record(model, image_ids: Sequence[Optional[str]], embeddings: torch.Tensor,
+           predictions: Sequence[Tuple[str, float]]):
+    """Store the embeddings of a scored batch; failures are logged and never fail the prediction."""
+    store = get_store()
+    if store is None:
+        return
+    try:
+        store.append(list(image_ids), trunk_fingerprint(model), embeddings, predictions)
+    except (OSError, sqlite3.Error) as e:
+        print(f"⚠️ Could not store embeddings: {e}")
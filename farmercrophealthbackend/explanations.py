@@ -0,0 +1,112 @@
+# explanations.py
+"""
+Grad-CAM heatmaps computed in the same pass as the prediction.
+
+The conv stack runs once under no_grad, exactly as for a plain prediction.
+Only its output, the activations of the last conv block (14x14 for a 224x224
+input), is put on the autograd tape. The dense head then runs with gradients
+and one backward pass through the head gives d(top logit)/d(activations) for
+the whole batch at once. That is valid because in eval mode every image's
+logits depend only on its own activations. The extra cost is one
+backward pass through the dense head, not a second forward pass.
+
+A heatmap is returned as a 14x14 array in [0, 1] and as a small colour PNG
+(data URI). Heatmaps are cached by model fingerprint and pixel hash, so a
+re-upload is not explained twice.
+"""
+
+import base64
+import io
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+from PIL import Image
+
+from prediction_cache import TieredCache
+from quantization import is_quantized
+
+# --- Configuration ---
+EXPLANATION_PNG_SIZE = int(os.getenv("EXPLANATION_PNG_SIZE", "112"))  # Side of the heatmap PNG in pixels
+EXPLANATION_CACHE_MAX_ENTRIES = int(os.getenv("EXPLANATION_CACHE_MAX_ENTRIES", "2000"))
+
+explanation_cache = TieredCache("explanation", max_entries=EXPLANATION_CACHE_MAX_ENTRIES)
+
+
+def supports_explanations(model) -> bool:
+    """
+    Eager fp32 CNNs. TorchScript (including the static-int8 artifact), ONNX, the worker
+    pool and the cascade student are not explained, nor are quantized models
+    (quantization.py): their int8 layers have no backward.
+    """
+    return (isinstance(model, torch.nn.Module) and not isinstance(model, torch.jit.ScriptModule)
+            and hasattr(model, "conv_layers") and hasattr(model, "avgpool") and hasattr(model, "dense_layers")
+            and not is_quantized(model))
+
+
+# --- Grad-CAM ---
+def forward_with_cam(model, batch: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """
+    One batched pass returning (penultimate activations, logits, Grad-CAM maps
+    for the top class of each image). Maps are (N, H, W), scaled to [0, 1] per image.
+    """
+    with torch.no_grad():
+        activations = model.conv_layers(batch)
+    activations.requires_grad_(True)
+    with torch.enable_grad():
+        features = model.dense_layers[:-1](torch.flatten(model.avgpool(activations), 1))
+        logits = model.dense_layers[-1](features)
+        top_logits = logits.gather(1, logits.argmax(dim=1, keepdim=True))
+        gradients, = torch.autograd.grad(top_logits.sum(), activations)
+    with torch.no_grad():
+        channel_weights = gradients.mean(dim=(2, 3), keepdim=True)
+        cams = torch.relu((channel_weights * activations).sum(dim=1))
+        cams = cams / cams.amax(dim=(1, 2), keepdim=True).clamp_min(1e-8)
+    return features.detach(), logits.detach(), cams
+
+
+# --- Encoding ---
+def _jet_palette() -> List[int]:
+    palette = []
+    for i in range(256):
+        x = i / 255.0
+        palette.extend(int(255 * min(1.0, max(0.0, 1.5 - abs(4 * x - c)))) for c in (3, 2, 1))
+    return palette
+
+
+_PALETTE = _jet_palette()
+
+
+def heatmap_png(cam: torch.Tensor, size: int = EXPLANATION_PNG_SIZE) -> str:
+    """Bilinear upsample to size x size, colour with a jet palette, and return a PNG data URI."""
+    upsampled = torch.nn.functional.interpolate(cam[None, None], size=(size, size), mode="bilinear",
+                                                align_corners=False)[0, 0]
+    pixels = (upsampled.clamp(0, 1) * 255).round().to(torch.uint8)
+    image = Image.frombytes("L", (size, size), pixels.numpy().tobytes()).convert("P")
+    image.putpalette(_PALETTE)
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", optimize=True)
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+def encode(cam: torch.Tensor, class_name: str) -> Dict[str, Any]:
+    return {
+        "method": "grad-cam",
+        "class_name": class_name,
+        "size": list(cam.shape),
+        "heatmap": [[round(v, 3) for v in row] for row in cam.tolist()],
+        "png": heatmap_png(cam),
+    }
+
+
+# --- Cache ---
+def explanation_key(model_fingerprint: str, pixel_hash: str) -> str:
+    return f"{model_fingerprint}:{pixel_hash}"
+
+
+def put(key: str, cam: torch.Tensor, class_name: str):
+    explanation_cache.put(key, encode(cam, class_name))
+
+
+def get(key: Optional[str]) -> Optional[Dict[str, Any]]:
+    return explanation_cache.get(key) if key is not None else None
@@ -0,0 +1,294 @@
+# graph_optimization.py
+"""
+Inference-time graph optimization for the crop-health CNN.
+
+The conv stack is ordered Conv -> ReLU -> BatchNorm, so at inference every
+BatchNorm is a per-channel affine `a * y + b` applied after the ReLU. This
+pass folds each of them into the next linear op instead of running it as a
+separate memory pass:
+
+  * into the following convolution: its weights are scaled by `a` and the
+    shift `b` goes into the bias. The zero padding of that convolution used to
+    pad `a * y + b`, not `y`, so the shift is corrected on the one-pixel border
+    ring only, which keeps the result exact.
+  * through a MaxPool, which commutes with the affine when `a >= 0`.
+  * into the first dense layer for the last BatchNorm (AdaptiveAvgPool and
+    flatten are linear).
+
+The folded model is converted to channels_last, traced and frozen as
+TorchScript. The result is a normal `.ts` model file that the model registry
+loads like any other weights file.
+
+Usage:
+    python graph_optimization.py --output plantvillage_weights_v22_optimized.ts
+"""
+
+import argparse
+import copy
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+import torch
+import torch.nn.functional as F
+
+from crop_cnn import LowRankLinear
+
+INPUT_SIZE = 224
+
+
+def default_optimized_path(model_path: str) -> str:
+    """Where the optimized TorchScript model for a weights file lives by default."""
+    return os.path.splitext(model_path)[0] + "_optimized.ts"
+
+
+def _bn_affine(bn: torch.nn.BatchNorm2d) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Return the per-channel scale and shift an eval-mode BatchNorm applies."""
+    weight = bn.weight if bn.affine else torch.ones_like(bn.running_mean)
+    bias = bn.bias if bn.affine else torch.zeros_like(bn.running_mean)
+    scale = weight / torch.sqrt(bn.running_var + bn.eps)
+    shift = bias - bn.running_mean * scale
+    return scale.detach(), shift.detach()
+
+
+def _can_fold_into_conv(conv: torch.nn.Conv2d) -> bool:
+    kh, kw = conv.kernel_size
+    ph, pw = conv.padding if isinstance(conv.padding, tuple) else (conv.padding, conv.padding)
+    return (
+        conv.stride == (1, 1) and conv.dilation == (1, 1) and conv.groups == 1
+        and conv.padding_mode == "zeros" and kh % 2 == 1 and kw % 2 == 1
+        and ph == (kh - 1) // 2 and pw == (kw - 1) // 2
+    )
+
+
+class FoldedConv2d(torch.nn.Module):
+    """
+    A convolution with the preceding BatchNorm folded in.
+
+    `border` holds the exact correction for output pixels whose receptive field
+    overlaps the zero padding; interior pixels need none.
+    """
+
+    def __init__(self, conv: torch.nn.Conv2d, scale: torch.Tensor, shift: torch.Tensor):
+        super().__init__()
+        weight = conv.weight.detach()
+        bias = conv.bias.detach() if conv.bias is not None else torch.zeros(weight.shape[0])
+        shift_contribution = (weight * shift.view(1, -1, 1, 1)).sum(dim=(1, 2, 3))
+
+        self.conv = torch.nn.Conv2d(conv.in_channels, conv.out_channels, conv.kernel_size,
+                                    stride=1, padding=conv.padding, bias=True)
+        self.conv.weight.data.copy_(weight * scale.view(1, -1, 1, 1))
+        self.conv.bias.data.copy_(bias + shift_contribution)
+        self.ph, self.pw = self.conv.padding
+
+        # Template over a (2p+1)x(2p+1) image: corners, edges and a zero centre.
+        # It is what the shift actually contributes minus what the bias assumes.
+        template_size = (2 * self.ph + 1, 2 * self.pw + 1)
+        constant = shift.view(1, -1, 1, 1).expand(1, weight.shape[1], *template_size)
+        with torch.no_grad():
+            actual = F.conv2d(constant, weight, padding=(self.ph, self.pw))[0]
+        self.register_buffer("border", actual - shift_contribution.view(-1, 1, 1))
+
+    def _expand_columns(self, rows: torch.Tensor, width: int) -> torch.Tensor:
+        pw = self.pw
+        middle = rows[..., pw:pw + 1].expand(*rows.shape[:-1], width - 2 * pw)
+        return torch.cat([rows[..., :pw], middle, rows[..., pw + 1:]], dim=-1)
+
+    def forward(self, x):
+        out = self.conv(x)
+        ph, pw = self.ph, self.pw
+        if ph == 0 and pw == 0:
+            return out
+        height, width = out.shape[-2], out.shape[-1]
+        border = self.border
+        if ph > 0:
+            out[:, :, :ph, :] += self._expand_columns(border[:, :ph, :], width)
+            out[:, :, height - ph:, :] += self._expand_columns(border[:, ph + 1:, :], width)
+        if pw > 0:
+            out[:, :, ph:height - ph, :pw] += border[:, ph:ph + 1, :pw]
+            out[:, :, ph:height - ph, width - pw:] += border[:, ph:ph + 1, pw + 1:]
+        return out
+
+
+def _fold_into_linear(linear: torch.nn.Linear, scale: torch.Tensor, shift: torch.Tensor,
+                      spatial: int) -> torch.nn.Linear:
+    """Fold a per-channel affine applied before AdaptiveAvgPool + flatten into a Linear layer."""
+    folded = torch.nn.Linear(linear.in_features, linear.out_features)
+    weight = linear.weight.detach()
+    scale_flat = scale.repeat_interleave(spatial)
+    shift_flat = shift.repeat_interleave(spatial)
+    bias = linear.bias.detach() if linear.bias is not None else torch.zeros(linear.out_features)
+    folded.weight.data.copy_(weight * scale_flat.view(1, -1))
+    folded.bias.data.copy_(bias + weight @ shift_flat)
+    return folded
+
+
+class FoldedCNN(torch.nn.Module):
+    """The CNN with its BatchNorms folded away, optionally in channels_last layout."""
+
+    def __init__(self, conv_layers: torch.nn.Sequential, avgpool: torch.nn.Module,
+                 dense_layers: torch.nn.Sequential, channels_last: bool = True):
+        super().__init__()
+        self.conv_layers = conv_layers
+        self.avgpool = avgpool
+        self.dense_layers = dense_layers
+        self.channels_last = channels_last
+
+    def forward(self, x):
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+        x = self.conv_layers(x)
+        x = self.avgpool(x)
+        x = torch.flatten(x, 1)
+        x = self.dense_layers(x)
+        return x
+
+
+def fold_batchnorms(model: torch.nn.Module, channels_last: bool = True) -> Tuple[FoldedCNN, Dict[str, int]]:
+    """
+    Return an equivalent eval-mode model with every foldable BatchNorm removed,
+    plus counts of folded and kept BatchNorms.
+    """
+    model = model.eval()
+    layers: List[torch.nn.Module] = []
+    pending: Optional[torch.nn.BatchNorm2d] = None
+    stats = {"folded_into_conv": 0, "folded_into_dense": 0, "kept": 0}
+
+    def flush():
+        nonlocal pending
+        if pending is not None:
+            layers.append(copy.deepcopy(pending))
+            stats["kept"] += 1
+            pending = None
+
+    for module in model.conv_layers:
+        if isinstance(module, torch.nn.BatchNorm2d):
+            flush()
+            pending = module
+        elif isinstance(module, torch.nn.MaxPool2d) and pending is not None:
+            # max(a*y + b) == a*max(y) + b only for non-negative scales
+            if (_bn_affine(pending)[0] < 0).any():
+                flush()
+            layers.append(copy.deepcopy(module))
+        elif isinstance(module, torch.nn.Conv2d) and pending is not None and _can_fold_into_conv(module):
+            layers.append(FoldedConv2d(module, *_bn_affine(pending)))
+            stats["folded_into_conv"] += 1
+            pending = None
+        else:
+            flush()
+            layers.append(copy.deepcopy(module))
+
+    dense_layers = copy.deepcopy(model.dense_layers)
+    if pending is not None:
+        # The last BatchNorm goes through AdaptiveAvgPool and flatten, both linear,
+        # into the first Linear of the head (only Dropout, an eval no-op, may precede it).
+        children = list(dense_layers.named_children())
+        index = next((i for i, (_, m) in enumerate(children) if not isinstance(m, torch.nn.Dropout)), None)
+        first = children[index][1] if index is not None else None
+        if isinstance(first, LowRankLinear):
+            # Low-rank head (low_rank.py): fold into its first factor
+            parent, name, first = first, "0", first[0]
+        else:
+            parent, name = dense_layers, children[index][0] if index is not None else None
+        if isinstance(first, torch.nn.Linear) and isinstance(model.avgpool, torch.nn.AdaptiveAvgPool2d):
+            out_h, out_w = model.avgpool.output_size if isinstance(model.avgpool.output_size, tuple) else (model.avgpool.output_size,) * 2
+            setattr(parent, name, _fold_into_linear(first, *_bn_affine(pending), spatial=out_h * out_w))
+            stats["folded_into_dense"] += 1
+            pending = None
+        else:
+            flush()
+
+    folded = FoldedCNN(torch.nn.Sequential(*layers), copy.deepcopy(model.avgpool), dense_layers, channels_last)
+    folded.eval()
+    if channels_last:
+        folded = folded.to(memory_format=torch.channels_last)
+    return folded, stats
+
+
+def freeze(model: torch.nn.Module, batch_size: int = 1) -> torch.jit.ScriptModule:
+    """Trace and freeze a model into TorchScript for serving at the fixed input size."""
+    example = torch.zeros(batch_size, 3, INPUT_SIZE, INPUT_SIZE)
+    with torch.no_grad():
+        traced = torch.jit.trace(model.eval(), example)
+        frozen = torch.jit.freeze(traced)
+        try:
+            frozen = torch.jit.optimize_for_inference(frozen)
+        except Exception as e:
+            print(f"⚠️ optimize_for_inference skipped: {e}")
+    return frozen
+
+
+def optimize(model: torch.nn.Module, channels_last: bool = True) -> Tuple[torch.jit.ScriptModule, Dict[str, int]]:
+    """Fold BatchNorms, switch to channels_last and freeze the model."""
+    folded, stats = fold_batchnorms(model, channels_last=channels_last)
+    return freeze(folded), stats
+
+
+# --- Parity and Benchmark ---
+def check_parity(reference: torch.nn.Module, candidate: torch.nn.Module, batch_sizes=(1, 8),
+                 atol: float = 1e-3) -> Dict[int, Dict[str, float]]:
+    generator = torch.Generator().manual_seed(0)
+    results = {}
+    with torch.no_grad():
+        for batch_size in batch_sizes:
+            batch = torch.randn(batch_size, 3, INPUT_SIZE, INPUT_SIZE, generator=generator)
+            expected, actual = reference(batch), candidate(batch)
+            results[batch_size] = {
+                "max_abs_diff": float((expected - actual).abs().max()),
+                "allclose": bool(torch.allclose(expected, actual, atol=atol, rtol=1e-3)),
+                "top1_match": bool(torch.equal(expected.argmax(dim=1), actual.argmax(dim=1))),
+            }
+    return results
+
+
+def benchmark(model: torch.nn.Module, batch_size: int, iterations: int = 20, warmup: int = 3) -> float:
+    """Mean milliseconds per forward pass."""
+    batch = torch.randn(batch_size, 3, INPUT_SIZE, INPUT_SIZE)
+    with torch.no_grad():
+        for _ in range(warmup):
+            model(batch)
+        started = time.perf_counter()
+        for _ in range(iterations):
+            model(batch)
+    return (time.perf_counter() - started) * 1000.0 / iterations
+
+
+def main(argv=None):
+    from inference import MODEL_PATH
+    from model_registry import DEFAULT_CLASSES_PATH, load_class_names, load_model_file
+
+    parser = argparse.ArgumentParser(description="Fold BatchNorms, convert to channels_last and freeze the CNN")
+    parser.add_argument("--weights", default=MODEL_PATH)
+    parser.add_argument("--output", help="Output TorchScript path (default: <weights>_optimized.ts)")
+    parser.add_argument("--no-channels-last", action="store_true")
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    class_names = load_class_names(DEFAULT_CLASSES_PATH)
+    model = load_model_file(args.weights, len(class_names))
+    optimized, stats = optimize(model, channels_last=not args.no_channels_last)
+    print(f"📊 BatchNorms folded into conv: {stats['folded_into_conv']}, into dense head: "
+          f"{stats['folded_into_dense']}, kept: {stats['kept']}")
+
+    parity = check_parity(model, optimized)
+    for batch_size, result in parity.items():
+        status = "✅" if result["allclose"] and result["top1_match"] else "❌"
+        print(f"{status} parity batch={batch_size}: max |Δ| = {result['max_abs_diff']:.2e}")
+    if not all(r["allclose"] and r["top1_match"] for r in parity.values()):
+        print("❌ Optimized model does not match the original. Not saved.")
+        return 1
+
+    for batch_size in (1, 8):
+        base = benchmark(model, batch_size, args.iterations)
+        fast = benchmark(optimized, batch_size, args.iterations)
+        print(f"⏱️  batch={batch_size}: {base:.1f} ms -> {fast:.1f} ms ({base / fast:.2f}x)")
+
+    output = args.output or default_optimized_path(args.weights)
+    torch.jit.save(optimized, output)
+    print(f"✅ Optimized model saved to '{output}'. Set CROP_HEALTH_MODEL_PATH to serve it.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,222 @@
+# head_retrain.py
+"""
+Head-only retraining from the embedding store (embedding_store.py).
+
+Refits only the final Linear(1024, num_classes) of the served CNN on stored
+penultimate activations. The targets are the labels users corrected or
+confirmed through /agentic_learn. A replay sample of unlabeled rows, targeted
+at the current head's own predictions, keeps the head from forgetting the
+classes nobody gave feedback on. No image is decoded and the conv stack
+never runs, so a refit takes seconds on a CPU.
+
+A held-out share of the labeled rows decides whether the new head is
+published. It must do at least as well as the current head there, and agree
+with it on held-out replay rows at least --min-replay-agreement of the time.
+The published variant is the full model with the new head, saved as
+<weights>_head_v<N>.safetensors. Point CROP_HEALTH_MODEL_PATH or
+/model_reload at it to serve it.
+
+Usage:
+    python head_retrain.py --store ./embeddings
+    python head_retrain.py --store ./embeddings --epochs 30 --replay 5000 --dry-run
+"""
+
+import argparse
+import glob
+import json
+import os
+import random
+import re
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+
+from crop_cnn import CNN, LowRankLinear, conv_widths
+from embedding_store import EMBEDDING_STORE_DIR, EmbeddingStore, trunk_fingerprint
+from weights_format import save_state_dict
+
+
+def default_head_path(model_path: str) -> str:
+    """Next free <weights>_head_v<N>.safetensors; retraining a published head continues its numbering."""
+    base = re.sub(r"_head_v\d+$", "", os.path.splitext(model_path)[0])
+    versions = [int(m.group(1)) for path in glob.glob(f"{glob.escape(base)}_head_v*.safetensors")
+                for m in [re.search(r"_head_v(\d+)\.safetensors$", path)] if m]
+    return f"{base}_head_v{max(versions, default=0) + 1}.safetensors"
+
+
+# --- Training Set ---
+def training_set(store: EmbeddingStore, trunk: str, class_names: List[str], replay: int,
+                 val_fraction: float = 0.2, seed: int = 0) -> Dict[str, Any]:
+    """Labeled rows split into train/validation, plus a replay sample of unlabeled rows split the same way."""
+    index = {name: i for i, name in enumerate(class_names)}
+    rows = store.rows(trunk)
+    labeled = [r for r in rows if r["label"] in index]
+    unlabeled = [r for r in rows if r["label"] is None]
+    rng = random.Random(seed)
+    rng.shuffle(labeled)
+    rng.shuffle(unlabeled)
+    unlabeled = unlabeled[:replay]
+
+    n_val = int(len(labeled) * val_fraction)
+    n_replay_val = int(len(unlabeled) * val_fraction)
+
+    def tensors(subset):
+        if not subset:
+            return torch.empty((0, store.dim)), torch.empty((0,), dtype=torch.long)
+        return store.vectors([r["row"] for r in subset]), torch.tensor([index[r["label"]] for r in subset])
+
+    return {
+        "train": tensors(labeled[n_val:]),
+        "val": tensors(labeled[:n_val]),
+        "replay_train": store.vectors([r["row"] for r in unlabeled[n_replay_val:]]) if unlabeled[n_replay_val:] else None,
+        "replay_val": store.vectors([r["row"] for r in unlabeled[:n_replay_val]]) if unlabeled[:n_replay_val] else None,
+        "corrected": sum(1 for r in labeled if r["source"] == "corrected"),
+        "confirmed": sum(1 for r in labeled if r["source"] == "confirmed"),
+    }
+
+
+# --- Refit ---
+def refit_head(head: torch.nn.Linear, features: torch.Tensor, targets: torch.Tensor,
+               replay_features: Optional[torch.Tensor] = None, label_weight: float = 5.0,
+               epochs: int = 20, batch_size: int = 256, lr: float = 1e-3, weight_decay: float = 1e-4,
+               seed: int = 0) -> torch.nn.Linear:
+    """
+    Copy of `head` trained with cross-entropy on labeled features (weighted by
+    `label_weight`) and on replay features targeted at `head`'s own predictions.
+    """
+    torch.manual_seed(seed)
+    new_head = torch.nn.Linear(head.in_features, head.out_features)
+    new_head.load_state_dict(head.state_dict())
+    weights = torch.full((features.shape[0],), label_weight)
+    if replay_features is not None:
+        with torch.no_grad():
+            replay_targets = head(replay_features).argmax(dim=1)
+        features = torch.cat([features, replay_features])
+        targets = torch.cat([targets, replay_targets])
+        weights = torch.cat([weights, torch.ones(replay_features.shape[0])])
+    if features.shape[0] == 0:
+        return new_head
+
+    optimizer = torch.optim.AdamW(new_head.parameters(), lr=lr, weight_decay=weight_decay)
+    for _ in range(epochs):
+        order = torch.randperm(features.shape[0])
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            losses = torch.nn.functional.cross_entropy(new_head(features[rows]), targets[rows], reduction="none")
+            loss = (losses * weights[rows]).sum() / weights[rows].sum()
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+    return new_head.eval()
+
+
+def accuracy(head: torch.nn.Linear, features: torch.Tensor, targets: torch.Tensor) -> Optional[float]:
+    if features.shape[0] == 0:
+        return None
+    with torch.no_grad():
+        return round((head(features).argmax(dim=1) == targets).float().mean().item(), 4)
+
+
+def agreement(head: torch.nn.Linear, reference: torch.nn.Linear, features: Optional[torch.Tensor]) -> Optional[float]:
+    if features is None:
+        return None
+    with torch.no_grad():
+        return round((head(features).argmax(dim=1) == reference(features).argmax(dim=1)).float().mean().item(), 4)
+
+
+def accept(report: Dict[str, Any], min_replay_agreement: float) -> Tuple[bool, str]:
+    before, after = report["val_accuracy_before"], report["val_accuracy_after"]
+    if before is not None and after < before:
+        return False, f"held-out accuracy dropped from {before} to {after}"
+    replay = report["replay_agreement"]
+    if replay is not None and replay < min_replay_agreement:
+        return False, f"agreement with the current head on unlabeled rows is {replay} < {min_replay_agreement}"
+    return True, "ok"
+
+
+def publish(model: CNN, head: torch.nn.Linear, output: str, source: str, report: Dict[str, Any]):
+    """Save the served model with the new head as a loadable .safetensors variant."""
+    model.dense_layers[-1].load_state_dict(head.state_dict())
+    head_rank = model.dense_layers[1].rank if isinstance(model.dense_layers[1], LowRankLinear) else None
+    save_state_dict(model.state_dict(), output, metadata={
+        "format": "pt",
+        "architecture": "crop_cnn.CNN",
+        "num_classes": head.out_features,
+        "config": json.dumps({"head_rank": head_rank, "widths": list(conv_widths(model))}),
+        "source": source,
+        "trunk": report["trunk"],
+        "head_training": json.dumps({k: report[k] for k in ("labeled_train", "val_accuracy_after", "replay_agreement")}),
+    })
+
+
+def main(argv=None):
+    from inference import MODEL_PATH
+    from model_registry import DEFAULT_CLASSES_PATH, load_class_names, load_model_file
+
+    parser = argparse.ArgumentParser(description="Refit the CNN's final layer from stored embeddings and feedback labels")
+    parser.add_argument("--weights", default=MODEL_PATH)
+    parser.add_argument("--store", default=EMBEDDING_STORE_DIR or None, required=not EMBEDDING_STORE_DIR)
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--label-weight", type=float, default=5.0, help="Loss weight of a labeled row relative to a replay row")
+    parser.add_argument("--replay", type=int, default=5000, help="Unlabeled rows replayed with the current head's predictions")
+    parser.add_argument("--val-fraction", type=float, default=0.2)
+    parser.add_argument("--min-labels", type=int, default=20)
+    parser.add_argument("--min-replay-agreement", type=float, default=0.95)
+    parser.add_argument("--output", help="Path of the new variant (default: <weights>_head_v<N>.safetensors)")
+    parser.add_argument("--dry-run", action="store_true", help="Report without publishing")
+    args = parser.parse_args(argv)
+
+    class_names = load_class_names(DEFAULT_CLASSES_PATH)
+    model = load_model_file(args.weights, len(class_names))
+    if not isinstance(model, CNN):
+        print("❌ Head retraining needs an eager CNN checkpoint.")
+        return 1
+    model.eval()
+    store = EmbeddingStore(args.store)
+    trunk = trunk_fingerprint(model)
+
+    started = time.perf_counter()
+    data = training_set(store, trunk, class_names, args.replay, args.val_fraction)
+    train_features, train_targets = data["train"]
+    val_features, val_targets = data["val"]
+    labeled = train_features.shape[0] + val_features.shape[0]
+    if labeled < args.min_labels:
+        print(f"⚠️ Only {labeled} labeled images for this model (need {args.min_labels}); nothing to do.")
+        return 0
+
+    head = model.dense_layers[-1]
+    new_head = refit_head(head, train_features, train_targets, data["replay_train"], args.label_weight,
+                          epochs=args.epochs, lr=args.lr)
+    report = {
+        "trunk": trunk,
+        "labeled_train": int(train_features.shape[0]),
+        "labeled_val": int(val_features.shape[0]),
+        "corrected": data["corrected"],
+        "confirmed": data["confirmed"],
+        "replay_rows": sum(x.shape[0] for x in (data["replay_train"], data["replay_val"]) if x is not None),
+        "val_accuracy_before": accuracy(head, val_features, val_targets),
+        "val_accuracy_after": accuracy(new_head, val_features, val_targets),
+        "replay_agreement": agreement(new_head, head, data["replay_val"]),
+        "seconds": round(time.perf_counter() - started, 2),
+    }
+    accepted, reason = accept(report, args.min_replay_agreement)
+    report["accepted"] = accepted
+    print(json.dumps(report, indent=2))
+
+    if not accepted:
+        print(f"❌ New head rejected: {reason}.")
+        return 1
+    if args.dry_run:
+        print("✅ New head accepted (dry run, not published).")
+        return 0
+    output = args.output or default_head_path(args.weights)
+    publish(model, new_head, output, os.path.basename(args.weights), report)
+    print(f"✅ Published '{output}'. Serve it with CROP_HEALTH_MODEL_PATH or POST /model_reload {{\"model_path\": ...}}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
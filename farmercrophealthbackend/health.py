@@ -1,18 +1,50 @@
 import sys
 import os
-from flask import Flask, request, jsonify
+import json
+import asyncio
+import datetime
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 
 # Add the project root to the Python path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from inference import predict as model_predict
+from inference import predict_image, batching_stats, cache_stats, start_model_loading, model_readiness, reload_model
+import prediction_cache
+from near_duplicates import near_duplicates
+from similar_cases import SIMILAR_CASES_K, similar_cases
+from bulk_scoring import score_images, iter_multipart_images
+from tiling import predict_tiled
 from agents.orchestrator import run_agents as orchestrator_run_agents
 
 # --- Flask App Initialization ---
 app = Flask(__name__)
 CORS(app)
 
+# Load and warm up the model in the background; /model_ready reports when it is done
+start_model_loading()
+
+def explain_requested():
+    return request.form.get("explain") == "1"
+
+def annotate_response(response, prediction):
+    """
+    Attach the image_id, the upload this one duplicates (if any) and the top-k
+    similar past cases (SIMILAR_CASES=1); k from the 'similar_k' form field.
+    With 'explain=1', also the Grad-CAM heatmap (null when the model cannot be explained).
+    """
+    request_info = response.setdefault("request_info", {})
+    if prediction.near_duplicate_of:
+        request_info["near_duplicate_of"] = prediction.near_duplicate_of
+    if explain_requested():
+        response["explanation"] = prediction.explanation
+    if not prediction.image_id:
+        return
+    request_info["image_id"] = prediction.image_id
+    cases = similar_cases(prediction.image_id, request.form.get("similar_k", SIMILAR_CASES_K, type=int))
+    if cases is not None:
+        response["similar_cases"] = cases
+
 # --- API Endpoint Definition ---
 @app.route('/predict', methods=['POST'])
 async def predict(): # Make the function asynchronous
@@ -27,9 +59,10 @@ async def predict(): # Make the function asynchronous
         return jsonify({'error': 'No file selected.'}), 400
 
     try:
-        class_name, confidence = model_predict(file)
-        if class_name is None:
+        prediction = predict_image(file, user_id=request.form.get("user_id"), explain=explain_requested())
+        if prediction is None:
             return jsonify({'error': 'Model prediction failed.'}), 500
+        class_name, confidence = prediction.class_name, prediction.confidence
     except Exception as e:
         return jsonify({'error': f'Model error: {e}'}), 500
 
@@ -38,14 +71,123 @@ async def predict(): # Make the function asynchronous
         "language": request.headers.get("Accept-Language", "en-US")
     }
 
+    # Re-uploads of the same photo can reuse the enriched response (opt-in, see prediction_cache.py)
+    cache_scope = {"endpoint": "predict", "language": user_info["language"]}
+    cached_response = prediction_cache.get_response(prediction.image_key, cache_scope)
+    if cached_response is None and prediction.near_duplicate_of:
+        # A frame from a burst: reuse the response to the user's earlier, near-identical upload
+        cached_response = near_duplicates.response_for(request.form.get("user_id"), prediction.near_duplicate_of, cache_scope)
+    if cached_response is not None:
+        prediction_cache.replay_response(cached_response, {
+            "user_id": user_info["farmer_id"],
+            "language": user_info["language"],
+            "timestamp_utc": datetime.datetime.utcnow().isoformat()
+        })
+        annotate_response(cached_response, prediction)
+        return jsonify(cached_response)
+
     try:
         # Await the asynchronous orchestrator directly
         enriched_response = await orchestrator_run_agents(class_name, confidence, user_info)
+        prediction_cache.put_response(prediction.image_key, cache_scope, enriched_response)
+        near_duplicates.remember_response(request.form.get("user_id"), prediction.upload_id, cache_scope, enriched_response)
+        annotate_response(enriched_response, prediction)
         return jsonify(enriched_response)
     except Exception as e:
         print(f"❌ Orchestrator error: {e}")
         return jsonify({'error': f'Error processing result: {e}'}), 500
 
+# --- Tiled High-Resolution Endpoint ---
+@app.route('/predict_tiled', methods=['POST'])
+async def predict_tiled_endpoint():
+    """
+    Diagnoses full-field and drone photos tile by tile instead of squashing them to 224x224.
+    Returns the aggregated diagnosis, a per-tile class/confidence grid and, with enrich=1,
+    the agent analysis of the diagnosis.
+    """
+    if 'file' not in request.files or request.files['file'].filename == '':
+        return jsonify({'error': 'No file part provided.'}), 400
+
+    try:
+        analysis = predict_tiled(request.files['file'])
+    except Exception as e:
+        return jsonify({'error': f'Model error: {e}'}), 500
+
+    if request.form.get("enrich", "0") == "1":
+        user_info = {
+            "farmer_id": request.form.get("user_id", "user_placeholder_123"),
+            "language": request.headers.get("Accept-Language", "en-US")
+        }
+        diagnosis = analysis["diagnosis"]
+        try:
+            analysis["enrichment"] = await orchestrator_run_agents(diagnosis["class_name"], diagnosis["confidence"], user_info)
+        except Exception as e:
+            print(f"❌ Orchestrator error: {e}")
+            analysis["enrichment"] = {"error": f"Error processing result: {e}"}
+    return jsonify(analysis)
+
+# --- Bulk Scoring Endpoint ---
+@app.route('/bulk_predict', methods=['POST'])
+def bulk_predict():
+    """
+    Scores many images in one request (multipart 'files' and/or a zip archive) and
+    streams one NDJSON line per image, then a summary line. Pass enrich=1 to add
+    one agent enrichment per distinct disease found.
+    """
+    files = request.files.getlist('files') or request.files.getlist('file')
+    files = [f for f in files if f.filename]
+    if not files:
+        return jsonify({'error': 'No files provided.'}), 400
+
+    user_info = {
+        "farmer_id": request.form.get("user_id", "user_placeholder_123"),
+        "language": request.headers.get("Accept-Language", "en-US")
+    }
+    enrich = None
+    if request.form.get("enrich", "0") == "1":
+        enrich = lambda class_name, confidence: asyncio.run(
+            orchestrator_run_agents(class_name, confidence, user_info))
+
+    def generate():
+        try:
+            for record in score_images(iter_multipart_images(files), enrich=enrich):
+                yield json.dumps(record) + "\n"
+        except Exception as e:
+            print(f"❌ Bulk scoring error: {e}")
+            yield json.dumps({"type": "error", "error": f"Bulk scoring aborted: {e}"}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+# --- Inference Stats Endpoint ---
+@app.route('/inference_stats', methods=['GET'])
+def inference_stats():
+    """
+    Exposes micro-batching and prediction cache statistics for tuning.
+    """
+    return jsonify({"batching": batching_stats(), "cache": cache_stats()}), 200
+
+# --- Model Readiness and Reload Endpoints ---
+@app.route('/model_ready', methods=['GET'])
+def model_ready():
+    """
+    Readiness probe: 200 once the model is loaded and warmed up, 503 before that.
+    """
+    readiness = model_readiness()
+    return jsonify(readiness), (200 if readiness["ready"] else 503)
+
+@app.route('/model_reload', methods=['POST'])
+def model_reload():
+    """
+    Swap in a new weights file without a restart. Optional JSON body: {"model_path": "..."},
+    relative to (and confined to) MODEL_RELOAD_DIR.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        result = reload_model(data.get("model_path"))
+    except ValueError as e:
+        return jsonify({"reloaded": False, "error": str(e)}), 400
+    return jsonify(result), (200 if result["reloaded"] else 500)
+
 # --- Main Execution ---
 if __name__ == '__main__':
     app.run(debug=True, port=5002)
@@ -57,4 +199,10 @@ if __name__ == '__main__':
 # Replace `/path/to/your/test_image.jpg` with the actual path to a test image.
 # For example, if you have an image `apple_scab.jpg` in your Downloads folder:
 # curl -X POST -F "file=@~/Downloads/apple_scab.jpg" http://127.0.0.1:5002/predict
+#
+# Tiled diagnosis of a full-field or drone photo:
+# curl -X POST -F "file=@field.jpg" http://127.0.0.1:5002/predict_tiled
+#
+# Bulk scoring of a field survey, streamed as NDJSON:
+# curl -N -X POST -F "files=@survey.zip" -F "enrich=1" http://127.0.0.1:5002/bulk_predict
 #
\ No newline at end of file
@@ -0,0 +1,42 @@
+# image_folders.py
+"""
+Folders of leaf images for the offline model tools (quantization, distillation,
+low-rank compression, pruning).
+
+Folders are searched recursively. PlantVillage-style folders, with one sub-folder
+per class, also give each image its ground-truth label.
+"""
+
+import os
+from typing import List, Optional
+
+import torch
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".gif"}
+
+
+def iter_image_files(folder: str) -> List[str]:
+    """Every image under a folder, in a stable sorted order."""
+    paths = []
+    for root, _, files in os.walk(folder):
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                paths.append(os.path.join(root, name))
+    return sorted(paths)
+
+
+def load_batches(paths: List[str], batch_size: int):
+    """Yield preprocessed image batches using the serving transform."""
+    from inference import transform_image
+    for start in range(0, len(paths), batch_size):
+        tensors = []
+        for path in paths[start:start + batch_size]:
+            with open(path, "rb") as f:
+                tensors.append(transform_image(f))
+        yield torch.cat(tensors, dim=0)
+
+
+def label_from_path(path: str, images_dir: str, class_names: List[str]) -> Optional[int]:
+    """Class index from the image's top-level sub-folder, or None if it is not a class name."""
+    folder = os.path.relpath(os.path.dirname(path), images_dir).split(os.sep)[0]
+    return class_names.index(folder) if folder in class_names else None
@@ -0,0 +1,108 @@
+# image_hashing.py
+
+import hashlib
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+
+def content_hash(image: Image.Image) -> str:
+    """Hash of the decoded, normalized pixels: identical photos match regardless of file metadata."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def dhash(image: Image.Image, hash_size: int = 8) -> int:
+    """
+    64-bit difference hash: compares neighbouring pixels of a tiny grayscale
+    thumbnail, so re-encodes and small resizes of the same photo hash alike.
+    """
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | int(pixels[offset + col] < pixels[offset + col + 1])
+    return value
+
+
+def _dct_matrix(size: int, keep: int) -> List[List[float]]:
+    """First `keep` rows of the orthogonal DCT-II matrix of order `size`."""
+    return [[math.cos(math.pi * (2 * n + 1) * k / (2 * size)) for n in range(size)] for k in range(keep)]
+
+
+_PHASH_SIZE = 32
+_PHASH_DCT = _dct_matrix(_PHASH_SIZE, 8)
+
+
+def phash(image: Image.Image) -> int:
+    """
+    64-bit perceptual hash: signs of the lowest 8x8 DCT frequencies of a 32x32
+    grayscale thumbnail against their median. Robust to re-encoding, small
+    crops, exposure changes and the jitter between frames of a burst.
+    """
+    small = image.convert("L").resize((_PHASH_SIZE, _PHASH_SIZE), Image.BILINEAR)
+    pixels = list(small.getdata())
+    rows = [pixels[r * _PHASH_SIZE:(r + 1) * _PHASH_SIZE] for r in range(_PHASH_SIZE)]
+    # Separable 2-D DCT, keeping only the 8x8 low-frequency corner
+    partial = [[sum(d * x for d, x in zip(basis, row)) for basis in _PHASH_DCT] for row in rows]
+    coefficients = [sum(basis[r] * partial[r][c] for r in range(_PHASH_SIZE))
+                    for basis in _PHASH_DCT for c in range(8)]
+    median = sorted(coefficients[1:])[len(coefficients[1:]) // 2]  # The DC term only encodes brightness
+    value = 0
+    for coefficient in coefficients:
+        value = (value << 1) | int(coefficient > median)
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+# --- Hamming-Distance Index ---
+class BKTree:
+    """
+    Burkhard-Keller tree over integer hashes under Hamming distance. A search
+    within radius r only descends into children whose edge distance d from a
+    node satisfies |d - dist(query, node)| <= r, by the triangle inequality.
+    """
+
+    def __init__(self):
+        self._root: Optional[Tuple[int, List[Any], Dict[int, Any]]] = None
+        self.size = 0
+
+    def add(self, value: int, item: Any):
+        self.size += 1
+        if self._root is None:
+            self._root = (value, [item], {})
+            return
+        node = self._root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (value, [item], {})
+                return
+            node = child
+
+    def search(self, value: int, radius: int) -> List[Tuple[int, Any]]:
+        """(distance, item) for every item within `radius` bits, closest first."""
+        found = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= radius:
+                found.extend((distance, item) for item in node[1])
+            for edge, child in node[2].items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+        found.sort(key=lambda hit: hit[0])
+        return found
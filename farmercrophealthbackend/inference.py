@@ -1,126 +1,296 @@
 # model/inference.py
 
 import torch
-import json
-from torchvision import transforms
-from PIL import Image
 import os
+import time
+import multiprocessing
+from dataclasses import dataclass
+from typing import Optional
+
+# The tuned deployment profile (autotune.py) must be applied before the modules below read their settings
+from inference_profile import apply_profile, applied_profile
+apply_profile()
+
+from batching import MicroBatcher
+from crop_cnn import CNN # Re-exported for scripts that build the model directly
+from model_registry import check_reload_path, get_registry
+from preprocessing import preprocess_image, preprocessor
+from worker_pool import WorkerPool, INFERENCE_WORKERS, WORKER_RESULT_TIMEOUT
+from cascade import ModelCascade
+from image_hashing import content_hash
+import embedding_store
+import explanations
+import prediction_cache
+import similar_cases
+from near_duplicates import Upload, fingerprints, near_duplicates
 
 # Define the path to the model and classes files
 MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
-MODEL_PATH = os.path.join(MODEL_DIR, "plantvillage_weights_v22.pt")
+MODEL_PATH = os.getenv("CROP_HEALTH_MODEL_PATH", os.path.join(MODEL_DIR, "plantvillage_weights_v22.pt"))
 CLASSES_PATH = os.path.join(MODEL_DIR, "classes.json")
-
-# --- Model Definition ---
-class CNN(torch.nn.Module):
-    """A Convolutional Neural Network for image classification."""
-    def __init__(self, num_classes):
-        super(CNN, self).__init__()
-        # Convolutional layers
-        self.conv_layers = torch.nn.Sequential(
-            torch.nn.Conv2d(3, 32, 3, 1, 1), torch.nn.ReLU(), torch.nn.BatchNorm2d(32),
-            torch.nn.Conv2d(32, 32, 3, 1, 1), torch.nn.ReLU(), torch.nn.BatchNorm2d(32),
-            torch.nn.MaxPool2d(2),
-            torch.nn.Conv2d(32, 64, 3, 1, 1), torch.nn.ReLU(), torch.nn.BatchNorm2d(64),
-            torch.nn.Conv2d(64, 64, 3, 1, 1), torch.nn.ReLU(), torch.nn.BatchNorm2d(64),
-            torch.nn.MaxPool2d(2),
-            torch.nn.Conv2d(64, 128, 3, 1, 1), torch.nn.ReLU(), torch.nn.BatchNorm2d(128),
-            torch.nn.Conv2d(128, 128, 3, 1, 1), torch.nn.ReLU(), torch.nn.BatchNorm2d(128),
-            torch.nn.MaxPool2d(2),
-            torch.nn.Conv2d(128, 256, 3, 1, 1), torch.nn.ReLU(), torch.nn.BatchNorm2d(256),
-            torch.nn.Conv2d(256, 256, 3, 1, 1), torch.nn.ReLU(), torch.nn.BatchNorm2d(256),
-            torch.nn.MaxPool2d(2),
-            torch.nn.Conv2d(256, 256, 3, 1, 1), torch.nn.ReLU(), torch.nn.BatchNorm2d(256)
-        )
-        self.avgpool = torch.nn.AdaptiveAvgPool2d((7, 7))
-        # Dense (fully connected) layers
-        self.dense_layers = torch.nn.Sequential(
-            torch.nn.Dropout(0.4),
-            torch.nn.Linear(256 * 7 * 7, 1024),
-            torch.nn.ReLU(),
-            torch.nn.Dropout(0.4),
-            torch.nn.Linear(1024, num_classes)
-        )
-
-    def forward(self, x):
-        x = self.conv_layers(x)
-        x = self.avgpool(x)
-        x = torch.flatten(x, 1)
-        x = self.dense_layers(x)
-        return x
+# "off", "dynamic" (int8 dense layers) or "static" (calibrated int8 conv stack), see quantization.py
+QUANTIZATION_MODE = os.getenv("CROP_HEALTH_QUANTIZATION", "off")
+# "torch" (eager PyTorch) or "onnx" (ONNX Runtime on CPU), see onnx_backend.py
+EXECUTION_BACKEND = os.getenv("CROP_HEALTH_BACKEND", "torch")
+# Confidence-gated cascade: a distilled student answers first, the CNN only when it is unsure (cascade.py)
+CASCADE_ENABLED = os.getenv("CROP_HEALTH_CASCADE", "0") == "1"
+STUDENT_MODEL_PATH = os.getenv("CROP_HEALTH_STUDENT_PATH", os.path.join(MODEL_DIR, "student_weights.safetensors"))
 
 # --- Model Loading ---
+# The model is owned by the shared registry: loaded once per process, warmed up, hot-reloadable
+registry = get_registry(MODEL_PATH, CLASSES_PATH, quantization=QUANTIZATION_MODE, backend=EXECUTION_BACKEND)
+
+# With INFERENCE_WORKERS > 0 the model runs in worker processes that share one copy of the weights
+worker_pool = WorkerPool(MODEL_PATH, CLASSES_PATH) if INFERENCE_WORKERS > 0 else None
+if worker_pool is not None and (QUANTIZATION_MODE != "off" or EXECUTION_BACKEND != "torch"):
+    print("⚠️ Inference workers serve the fp32 PyTorch weights; CROP_HEALTH_QUANTIZATION and CROP_HEALTH_BACKEND are ignored.")
+
+# The teacher in cascade mode is the registry model above, so quantization and ONNX still apply to it
+cascade = None
+if CASCADE_ENABLED and worker_pool is None:
+    cascade = ModelCascade(get_registry(STUDENT_MODEL_PATH, CLASSES_PATH, quantization="off", backend="torch"), registry)
+elif CASCADE_ENABLED:
+    print("⚠️ CROP_HEALTH_CASCADE is not supported with INFERENCE_WORKERS; serving the full CNN only.")
+
+def _model_source():
+    """The worker pool when enabled, otherwise the in-process registry (or cascade)."""
+    if worker_pool is not None:
+        return worker_pool
+    return cascade if cascade is not None else registry
+
 def load_model():
-    """Load the CNN model and class names."""
-    try:
-        with open(CLASSES_PATH) as f:
-            class_names = json.load(f)
-        
-        model = CNN(num_classes=len(class_names))
-        
-        # Load the model weights, ensuring it runs on the CPU
-        model.load_state_dict(torch.load(MODEL_PATH, map_location="cpu"))
-        model.eval() # Set the model to evaluation mode
-        
-        print("✅ Model and class names loaded successfully.")
-        return model, class_names
-        
-    except FileNotFoundError as e:
-        print(f"❌ Error loading model files: {e}. Make sure '{os.path.basename(MODEL_PATH)}' and '{os.path.basename(CLASSES_PATH)}' are in the '{MODEL_DIR}' directory.")
-        return None, None
-    except Exception as e:
-        print(f"❌ An unexpected error occurred during model loading: {e}")
-        return None, None
+    """Return the CNN model and class names from the shared registry, loading them on first use."""
+    if worker_pool is not None:
+        worker_pool.start()
+        return worker_pool, worker_pool.class_names
+    model, class_names = registry.get()
+    if model is None:
+        print(f"❌ Error loading model files. Make sure '{os.path.basename(MODEL_PATH)}' and '{os.path.basename(CLASSES_PATH)}' are in the '{MODEL_DIR}' directory.")
+    return model, class_names
 
-# Load the model and classes at import time
-model, class_names = load_model()
+def start_model_loading():
+    """Load and warm up the model in the background so the first request is not a cold start."""
+    # Spawned inference workers re-import the server module; only the server process loads the model
+    if multiprocessing.parent_process() is not None:
+        return
+    if worker_pool is not None:
+        worker_pool.start_background()
+    else:
+        registry.start_background_load()
+        if cascade is not None:
+            cascade.student_registry.start_background_load()
+    # Builds the similar-case index from the embedding store in the background (SIMILAR_CASES=1)
+    similar_cases.get_service()
+
+def model_readiness():
+    """Readiness probe for the crop-health model."""
+    return _model_source().readiness()
+
+def reload_model(model_path=None):
+    """
+    Atomically swap in a new weights file without restarting the server. A
+    `model_path` from a client must lie inside MODEL_RELOAD_DIR (ValueError otherwise).
+    """
+    if model_path:
+        model_path = check_reload_path(model_path, _model_source().model_path)
+    if worker_pool is not None:
+        try:
+            worker_pool.restart(model_path)
+            return {"reloaded": True, **worker_pool.readiness()}
+        except Exception as e:
+            return {"reloaded": False, "error": str(e)}
+    return registry.reload(model_path)
 
 # --- Image Transformation ---
 def transform_image(image_bytes):
-    """Apply transformations to the input image to prepare it for the model."""
-    # Define the sequence of transformations
-    transform = transforms.Compose([
-        transforms.Resize((256, 256)),
-        transforms.CenterCrop(224),
-        transforms.ToTensor(),
-        transforms.Normalize(
-            [0.485, 0.456, 0.406], # Mean for normalization
-            [0.229, 0.224, 0.225]  # Standard deviation for normalization
-        )
-    ])
-    # Open the image from bytes, convert to RGB, and apply transformations
-    image = Image.open(image_bytes).convert("RGB")
-    return transform(image).unsqueeze(0) # Add a batch dimension
+    """Decode and normalize the input image into a (1, 3, 224, 224) tensor using the shared preprocessing pipeline."""
+    return preprocess_image(image_bytes)
+
+# --- Batched Forward Pass ---
+def _format_prediction(class_name, confidence):
+    return class_name, f"{confidence * 100:.2f}%"
+
+def classify_batch(image_tensors, image_ids=None, explain_keys=None):
+    """
+    Run preprocessed image tensors through the model and return (class_name, probability) per image.
+    With `image_ids`, the penultimate activations are kept in the embedding store (embedding_store.py).
+    This only happens on the in-process CNN: the worker pool and the cascade store no embeddings.
+    With `explain_keys`, Grad-CAM heatmaps of the flagged images are computed in the same pass and
+    put in the explanation cache under those keys (explanations.py).
+    """
+    if worker_pool is not None:
+        # Each worker micro-batches whatever is queued, so fan the items out individually
+        futures = [worker_pool.submit(image_tensor) for image_tensor in image_tensors]
+        return [
+            (worker_pool.class_names[index], confidence)
+            for index, confidence in (future.result(timeout=WORKER_RESULT_TIMEOUT) for future in futures)
+        ]
+
+    batch = torch.cat(image_tensors, dim=0)
+    if cascade is not None:
+        # Student features are not the CNN trunk's 1024-d activations, so nothing is recorded here
+        return [(class_name, confidence) for class_name, confidence, _ in cascade.run(batch)]
+
+    model, class_names = registry.get()
+    store_embeddings = image_ids is not None and embedding_store.supports_embeddings(model)
+    explain = explain_keys is not None and explanations.supports_explanations(model)
+    with torch.no_grad(): # Disable gradient calculation for inference
+        cams = None
+        if explain:
+            try:
+                embeddings, output, cams = explanations.forward_with_cam(model, batch)
+            except RuntimeError as e:
+                # Quantized layers have no backward pass
+                print(f"⚠️ Grad-CAM is not available for this model: {e}")
+        if cams is None and store_embeddings:
+            embeddings, output = embedding_store.forward_with_embeddings(model, batch)
+        elif cams is None:
+            output = model(batch)
+
+        # Calculate probabilities using softmax and pick the highest-scoring class per image
+        probabilities = torch.nn.functional.softmax(output, dim=1)
+        confidences, predicted_indices = torch.max(probabilities, 1)
+
+    results = [
+        (class_names[index], confidence)
+        for index, confidence in zip(predicted_indices.tolist(), confidences.tolist())
+    ]
+    if store_embeddings:
+        embedding_store.record(model, image_ids, embeddings, results)
+    if cams is not None:
+        for key, cam, (class_name, _) in zip(explain_keys, cams, results):
+            if key is not None:
+                explanations.put(key, cam, class_name)
+    return results
+
+def _run_batch(image_tensors):
+    """Run a list of preprocessed image tensors through the model in one forward pass."""
+    return [_format_prediction(class_name, confidence) for class_name, confidence in classify_batch(image_tensors)]
+
+def _run_identified_batch(items):
+    """
+    Micro-batcher callback: (image_tensor, image_id, explain_key) items. The ids select embeddings
+    to store, the keys the images to explain.
+    """
+    image_tensors = [image_tensor for image_tensor, _, _ in items]
+    image_ids = [image_id for _, image_id, _ in items]
+    explain_keys = [explain_key for _, _, explain_key in items]
+    results = classify_batch(image_tensors, image_ids if any(image_ids) else None,
+                             explain_keys if any(explain_keys) else None)
+    return [_format_prediction(class_name, confidence) for class_name, confidence in results]
+
+def predict_batch(image_tensors):
+    """Run already-batched callers (e.g. bulk scoring) straight through the model, bypassing the micro-batcher."""
+    return _run_batch(image_tensors)
+
+# Requests from concurrent Flask threads are grouped into a single forward pass
+batcher = MicroBatcher(_run_identified_batch, name="crop-health-batcher")
+
+def batching_stats():
+    """Return queue-depth and batch-size statistics of the micro-batcher (and the worker pool, if enabled)."""
+    if worker_pool is not None:
+        return {"workers": worker_pool.stats(), "profile": applied_profile()}
+    if cascade is not None:
+        return {**batcher.stats(), "cascade": cascade.stats(), "profile": applied_profile()}
+    return {**batcher.stats(), "profile": applied_profile()}
+
+def cache_stats():
+    """Return hit/miss counters of the prediction and explanation caches and the near-duplicate index."""
+    return {**prediction_cache.cache_stats(), "explanations": explanations.explanation_cache.stats(),
+            "near_duplicates": near_duplicates.stats()}
 
 # --- Prediction Function ---
-def predict(image_bytes):
+def image_cache_key(image):
+    """Prediction-cache key for a decoded image, tied to the model being served (None if caching is off)."""
+    key = prediction_cache.image_key(image)
+    return f"{_model_source().fingerprint()}:{key}" if key is not None else None
+
+@dataclass
+class Prediction:
+    class_name: str
+    confidence: str
+    image_key: Optional[str] = None # Content-addressed key used by the prediction cache
+    cached: bool = False
+    image_id: Optional[str] = None # Content hash under which the embedding store keeps this image
+    upload_id: Optional[str] = None # Identifies this upload to the near-duplicate index
+    near_duplicate_of: Optional[str] = None # upload_id of the recent upload whose result was reused
+    explanation: Optional[dict] = None # Grad-CAM heatmap, only when requested (explanations.py)
+
+def _remember_upload(user_id, hashes, image, prediction):
+    upload_id = prediction.image_id or content_hash(image)
+    near_duplicates.remember(user_id, Upload(upload_id, *hashes, time.time(), prediction.class_name,
+                                             prediction.confidence, prediction.image_key, prediction.image_id))
+    prediction.upload_id = upload_id
+    return prediction
+
+def _explainable():
+    """Grad-CAM needs the eager CNN in this process: not the worker pool, the cascade or ONNX."""
+    return worker_pool is None and cascade is None and explanations.supports_explanations(registry.get()[0])
+
+def _explanation_key(pixel_hash):
+    return explanations.explanation_key(_model_source().fingerprint(), pixel_hash)
+
+def predict_image(image_bytes, user_id=None, explain=False):
     """
-    Run inference on the preprocessed image and return the predicted class and confidence score.
+    Run inference on an uploaded image and return a Prediction, or None on failure.
+    Repeated uploads of the same image are answered from the prediction cache;
+    concurrent cache misses are micro-batched into a single forward pass.
+    With a user_id, a near-duplicate of one of that user's recent uploads
+    (near_duplicates.py) reuses the earlier result. With explain=True the
+    Prediction carries a Grad-CAM heatmap; a cached result is only reused when
+    its heatmap is cached too, otherwise the image goes through the model again.
     """
+    model, class_names = load_model()
     if not model or not class_names:
         raise RuntimeError("Model is not loaded. Cannot perform prediction.")
 
     try:
-        # Transform the image and get model output
-        image_tensor = transform_image(image_bytes)
-        
-        with torch.no_grad(): # Disable gradient calculation for inference
-            output = model(image_tensor)
-            
-            # Get the index of the highest-scoring class
-            _, predicted_class_index = torch.max(output, 1)
-            
-            # Calculate probabilities using softmax
-            probabilities = torch.nn.functional.softmax(output, dim=1)
-            
-            # Get the confidence score for the predicted class
-            confidence = probabilities[0, predicted_class_index.item()].item() * 100
-            
-            # Get the name of the predicted class
-            predicted_class_name = class_names[predicted_class_index.item()]
-            
-        return predicted_class_name, f"{confidence:.2f}%"
+        # Decode once in the caller's thread; the decoded pixels are both the cache key and the model input
+        image = preprocessor.decode(image_bytes)
+        hashes = None
+        if user_id and near_duplicates.enabled:
+            hashes = fingerprints(image)
+            earlier = near_duplicates.find(user_id, *hashes)
+            # An upload's upload_id is its pixel hash, so its heatmap is cached under that
+            explanation = None
+            if earlier is not None and explain:
+                explanation = explanations.get(_explanation_key(earlier.upload_id))
+            if earlier is not None and (not explain or explanation is not None or not _explainable()):
+                return Prediction(earlier.class_name, earlier.confidence, image_key=earlier.image_key, cached=True,
+                                  image_id=earlier.image_id, upload_id=earlier.upload_id,
+                                  near_duplicate_of=earlier.upload_id, explanation=explanation)
+
+        key = image_cache_key(image)
+        # Feedback on this image (/agentic_learn) refers to it by image_id
+        image_id = content_hash(image) if embedding_store.get_store() is not None else None
+        explain_key = _explanation_key(content_hash(image)) if explain and _explainable() else None
+        explanation = explanations.get(explain_key)
+        if key is not None and (explain_key is None or explanation is not None):
+            cached = prediction_cache.get_prediction(key)
+            if cached is not None:
+                prediction = Prediction(*cached, image_key=key, cached=True, image_id=image_id,
+                                        explanation=explanation)
+                return _remember_upload(user_id, hashes, image, prediction) if hashes else prediction
+
+        image_tensor = preprocessor.normalize(image).unsqueeze(0)
+        if worker_pool is not None:
+            predicted_class_name, confidence = predict_batch([image_tensor])[0]
+        else:
+            predicted_class_name, confidence = batcher.run((image_tensor, image_id, explain_key))
+        prediction_cache.put_prediction(key, predicted_class_name, confidence)
+        prediction = Prediction(predicted_class_name, confidence, image_key=key, image_id=image_id,
+                                explanation=explanations.get(explain_key))
+        return _remember_upload(user_id, hashes, image, prediction) if hashes else prediction
 
     except Exception as e:
         print(f"❌ An error occurred during prediction: {e}")
-        return None, None 
\ No newline at end of file
+        return None
+
+def predict(image_bytes, user_id=None):
+    """
+    Run inference on the preprocessed image and return the predicted class and confidence score.
+    """
+    prediction = predict_image(image_bytes, user_id)
+    if prediction is None:
+        return None, None
+    return prediction.class_name, prediction.confidence
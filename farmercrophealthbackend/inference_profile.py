@@ -0,0 +1,90 @@
+# inference_profile.py
+"""
+Deployment profile for CPU inference settings, written by autotune.py.
+
+The profile maps a host's usable core count to the best-measured torch thread
+counts, worker-process count and micro-batch settings. `apply_profile()` runs
+before the inference modules read their configuration. It picks the entry for
+this host (or the closest smaller core count) and fills in the matching
+environment variables. Variables that are already set always win over the
+profile, so one image can be deployed on 4-core and 32-core hosts alike.
+"""
+
+import json
+import os
+from typing import Any, Dict, Optional
+
+import torch
+
+MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
+PROFILE_PATH = os.getenv("CROP_HEALTH_PROFILE", os.path.join(MODEL_DIR, "inference_profile.json"))
+
+# Profile keys and the environment variables they configure
+SETTINGS = {
+    "torch_threads": "CROP_HEALTH_TORCH_THREADS",
+    "interop_threads": "CROP_HEALTH_INTEROP_THREADS",
+    "workers": "INFERENCE_WORKERS",
+    "worker_threads": "INFERENCE_WORKER_THREADS",
+    "max_batch_size": "INFERENCE_MAX_BATCH_SIZE",
+    "max_wait_ms": "INFERENCE_MAX_WAIT_MS",
+}
+
+_applied: Optional[Dict[str, Any]] = None
+
+
+def host_cores() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def load_profile(path: str = PROFILE_PATH) -> Dict[str, Any]:
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def select_entry(profile: Dict[str, Any], cores: int) -> Optional[Dict[str, Any]]:
+    """The entry tuned for `cores`, else the largest one tuned for fewer cores, else the smallest."""
+    hosts = {int(k): v for k, v in profile.get("hosts", {}).items()}
+    if not hosts:
+        return None
+    smaller = [c for c in hosts if c <= cores]
+    return hosts[max(smaller)] if smaller else hosts[min(hosts)]
+
+
+def apply_profile(path: str = PROFILE_PATH) -> Dict[str, Any]:
+    """Fill unset inference settings from the profile and apply the torch thread counts. Idempotent."""
+    global _applied
+    if _applied is not None:
+        return _applied
+
+    cores = host_cores()
+    entry = select_entry(load_profile(path), cores) or {}
+    applied = {}
+    for key, env_name in SETTINGS.items():
+        if key in entry and env_name not in os.environ:
+            os.environ[env_name] = str(entry[key])
+            applied[key] = entry[key]
+
+    torch_threads = int(os.getenv("CROP_HEALTH_TORCH_THREADS", "0"))
+    if torch_threads > 0:
+        torch.set_num_threads(torch_threads)
+    interop_threads = int(os.getenv("CROP_HEALTH_INTEROP_THREADS", "0"))
+    if interop_threads > 0:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:
+            # Only possible before any inter-op work has started in this process
+            print("⚠️ Could not set inter-op threads: torch parallel work already started.")
+
+    _applied = {"path": path if entry else None, "host_cores": cores, "settings": applied,
+                "torch_threads": torch.get_num_threads()}
+    if applied:
+        print(f"✅ Loaded inference profile for {cores} cores from '{os.path.basename(path)}': {applied}")
+    return _applied
+
+
+def applied_profile() -> Optional[Dict[str, Any]]:
+    return _applied
@@ -0,0 +1,213 @@
+# low_rank.py
+"""
+Low-rank factorization of the CNN's first dense layer.
+
+Linear(12544, 1024) holds about 12.8M of the CNN's parameters. A truncated SVD,
+W ~= (U_r sqrt(S_r)) (sqrt(S_r) V_r^T), replaces it with Linear(12544, r) followed
+by Linear(r, 1024), which is r * (12544 + 1024) weights. Optionally the dense
+head is then fine-tuned for a few epochs on cached penultimate features,
+distilling from the original model, which is cheap because the conv stack runs
+only once per image.
+
+The compressed model is an ordinary CNN(head_rank=r). It is saved as
+.safetensors with the rank in its metadata, so CROP_HEALTH_MODEL_PATH can point
+straight at it.
+
+Usage:
+    python low_rank.py --ranks 64 128 256 --images ./samples --fine-tune-epochs 3
+    python low_rank.py --ranks 128 --images ./samples --fine-tune-epochs 3 --save
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+
+from crop_cnn import CNN, LowRankLinear, conv_widths
+from graph_optimization import benchmark
+from image_folders import iter_image_files, label_from_path, load_batches
+from weights_format import save_state_dict
+
+HEAD_INDEX = 1  # dense_layers[1] is Linear(256 * 7 * 7, 1024)
+
+
+def default_low_rank_path(model_path: str, rank: int) -> str:
+    return f"{os.path.splitext(model_path)[0]}_rank{rank}.safetensors"
+
+
+# --- Factorization ---
+def factorize_linear(linear: torch.nn.Linear, rank: int) -> Tuple[LowRankLinear, float]:
+    """Truncated-SVD factorization of a Linear layer. Returns (layer, relative Frobenius error)."""
+    weight = linear.weight.detach().double()
+    U, S, Vh = torch.linalg.svd(weight, full_matrices=False)
+    rank = min(rank, S.numel())
+    root = S[:rank].sqrt()
+    factorized = LowRankLinear(linear.in_features, linear.out_features, rank)
+    factorized[0].weight.data.copy_((root.unsqueeze(1) * Vh[:rank]).float())
+    factorized[1].weight.data.copy_((U[:, :rank] * root.unsqueeze(0)).float())
+    factorized[1].bias.data.copy_(linear.bias.detach())
+    error = (S[rank:].square().sum() / S.square().sum()).sqrt().item()
+    return factorized, error
+
+
+def compress(model: CNN, rank: int) -> Tuple[CNN, float]:
+    """Copy of `model` with a rank-`rank` dense head. Returns (model, relative weight error)."""
+    num_classes = model.dense_layers[-1].out_features
+    compressed = CNN(num_classes=num_classes, head_rank=rank, widths=conv_widths(model))
+    compressed.conv_layers.load_state_dict(model.conv_layers.state_dict())
+    factorized, error = factorize_linear(model.dense_layers[HEAD_INDEX], rank)
+    compressed.dense_layers[HEAD_INDEX] = factorized
+    compressed.dense_layers[-1].load_state_dict(model.dense_layers[-1].state_dict())
+    return compressed.eval(), error
+
+
+# --- Head Fine-Tuning ---
+def penultimate_features(model: CNN, batch: torch.Tensor) -> torch.Tensor:
+    """Input of the dense head: conv stack, AdaptiveAvgPool and flatten."""
+    return torch.flatten(model.avgpool(model.conv_layers(batch)), 1)
+
+
+def cache_features(model: CNN, paths: List[str], batch_size: int = 16) -> Dict[str, torch.Tensor]:
+    """Run the conv stack once per image and keep the features and the original model's logits."""
+    features, logits = [], []
+    model.eval()
+    with torch.no_grad():
+        for batch in load_batches(paths, batch_size):
+            batch_features = penultimate_features(model, batch)
+            features.append(batch_features)
+            logits.append(model.dense_layers(batch_features))
+    return {"features": torch.cat(features), "logits": torch.cat(logits)}
+
+
+def fine_tune_head(model: CNN, features: torch.Tensor, teacher_logits: torch.Tensor, labels: torch.Tensor,
+                   epochs: int = 3, batch_size: int = 64, lr: float = 1e-4, temperature: float = 2.0,
+                   alpha: float = 0.8, seed: int = 0) -> CNN:
+    """Train only the dense head on cached features, distilling from the original model."""
+    from distill import distillation_loss
+
+    head = model.dense_layers
+    optimizer = torch.optim.AdamW(head.parameters(), lr=lr, weight_decay=1e-4)
+    order = list(range(features.shape[0]))
+    rng = random.Random(seed)
+    for epoch in range(epochs):
+        head.train()
+        rng.shuffle(order)
+        total = 0.0
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            loss = distillation_loss(head(features[rows]), teacher_logits[rows], labels[rows], temperature, alpha)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total += loss.item() * len(rows)
+        print(f"🔄 Head fine-tuning epoch {epoch + 1}/{epochs}: loss {total / len(order):.4f}")
+    return model.eval()
+
+
+# --- Reporting ---
+def _parameter_count(module: torch.nn.Module) -> int:
+    return sum(p.numel() for p in module.parameters())
+
+
+def evaluate_rank(original: CNN, compressed: CNN, error: float, cache: Optional[Dict[str, torch.Tensor]],
+                  batch_sizes=(1, 8)) -> Dict[str, Any]:
+    """Size, latency and (with cached features) top-1 agreement of a compressed model."""
+    report = {
+        "rank": compressed.dense_layers[HEAD_INDEX].rank,
+        "relative_weight_error": round(error, 5),
+        "parameters": _parameter_count(compressed),
+        "head_parameters": _parameter_count(compressed.dense_layers[HEAD_INDEX]),
+        "size_mb": round(_parameter_count(compressed) * 4 / (1024.0 * 1024.0), 2),
+        "size_ratio": round(_parameter_count(compressed) / _parameter_count(original), 4),
+        "latency_ms": {f"batch_{b}": round(benchmark(compressed, b), 3) for b in batch_sizes},
+    }
+    if cache is not None:
+        with torch.no_grad():
+            predictions = compressed.dense_layers(cache["features"]).argmax(dim=1)
+        report["top1_agreement"] = round((predictions == cache["logits"].argmax(dim=1)).float().mean().item(), 4)
+        report["images"] = int(cache["features"].shape[0])
+    return report
+
+
+def main(argv=None):
+    from inference import MODEL_PATH
+    from model_registry import DEFAULT_CLASSES_PATH, load_class_names, load_model_file
+
+    parser = argparse.ArgumentParser(description="Low-rank factorization of the CNN's first dense layer")
+    parser.add_argument("--weights", default=MODEL_PATH)
+    parser.add_argument("--ranks", type=int, nargs="+", default=[64, 128, 256])
+    parser.add_argument("--images", help="Leaf images for top-1 agreement and fine-tuning (class sub-folders optional)")
+    parser.add_argument("--limit", type=int, default=2000, help="Maximum number of images to cache features for")
+    parser.add_argument("--fine-tune-epochs", type=int, default=0)
+    parser.add_argument("--val-fraction", type=float, default=0.2)
+    parser.add_argument("--save", action="store_true", help="Save each compressed model as <weights>_rank<r>.safetensors")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    torch.manual_seed(0)
+    class_names = load_class_names(DEFAULT_CLASSES_PATH)
+    original = load_model_file(args.weights, len(class_names))
+    if not isinstance(original, CNN) or isinstance(original.dense_layers[HEAD_INDEX], LowRankLinear):
+        print("❌ Low-rank compression needs an uncompressed eager CNN checkpoint.")
+        return 1
+
+    train_cache = val_cache = None
+    train_labels = None
+    if args.images:
+        paths = iter_image_files(args.images)[:args.limit]
+        if not paths:
+            print(f"❌ No images found in '{args.images}'.")
+            return 1
+        random.Random(0).shuffle(paths)
+        n_val = max(1, int(len(paths) * args.val_fraction))
+        print(f"📊 Caching penultimate features for {len(paths)} images...")
+        val_cache = cache_features(original, paths[:n_val])
+        if args.fine_tune_epochs and len(paths) > n_val:
+            train_paths = paths[n_val:]
+            train_cache = cache_features(original, train_paths)
+            teacher_top1 = train_cache["logits"].argmax(dim=1).tolist()
+            train_labels = torch.tensor([
+                label if label is not None else t
+                for label, t in zip((label_from_path(p, args.images, class_names) for p in train_paths), teacher_top1)
+            ])
+
+    reports = {"original": {
+        "parameters": _parameter_count(original),
+        "head_parameters": _parameter_count(original.dense_layers[HEAD_INDEX]),
+        "size_mb": round(_parameter_count(original) * 4 / (1024.0 * 1024.0), 2),
+        "latency_ms": {f"batch_{b}": round(benchmark(original, b), 3) for b in (1, 8)},
+    }, "ranks": {}}
+    for rank in args.ranks:
+        compressed, error = compress(original, rank)
+        entry = evaluate_rank(original, compressed, error, val_cache)
+        if train_cache is not None:
+            compressed = fine_tune_head(compressed, train_cache["features"], train_cache["logits"], train_labels,
+                                        epochs=args.fine_tune_epochs)
+            entry["fine_tuned_top1_agreement"] = evaluate_rank(original, compressed, error, val_cache).get("top1_agreement")
+        if args.save:
+            output = default_low_rank_path(args.weights, rank)
+            save_state_dict(compressed.state_dict(), output, metadata={
+                "format": "pt",
+                "architecture": "crop_cnn.CNN",
+                "num_classes": len(class_names),
+                "config": json.dumps({"head_rank": rank, "widths": list(conv_widths(compressed))}),
+                "source": os.path.basename(args.weights),
+            })
+            entry["path"] = output
+        reports["ranks"][str(rank)] = entry
+        print(f"✅ rank {rank}: {entry['size_ratio'] * 100:.1f}% of parameters, "
+              f"agreement {entry.get('fine_tuned_top1_agreement', entry.get('top1_agreement', 'n/a'))}")
+
+    print(json.dumps(reports, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(reports, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
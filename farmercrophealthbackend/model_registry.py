@@ -0,0 +1,314 @@
+# model_registry.py
+
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+
+import crop_cnn
+from crop_cnn import CNN
+
+# Full-module checkpoints pickled by backend/app.py reference `cnn_model.CNN`
+sys.modules.setdefault("cnn_model", crop_cnn)
+
+MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MODEL_PATH = os.path.join(MODEL_DIR, "plantvillage_weights_v22.pt")
+DEFAULT_CLASSES_PATH = os.path.join(MODEL_DIR, "classes.json")
+INPUT_SHAPE = (3, 224, 224)
+
+# Execution backend: "torch" (eager PyTorch) or "onnx" (ONNX Runtime, see onnx_backend.py)
+EXECUTION_BACKEND = os.getenv("CROP_HEALTH_BACKEND", "torch")
+EXECUTION_BACKENDS = ("torch", "onnx")
+
+# Quantized execution mode: "off", "dynamic" or "static" (see quantization.py)
+QUANTIZATION_MODE = os.getenv("CROP_HEALTH_QUANTIZATION", "off")
+
+# Poll the weights file for changes and hot-reload it (0 disables the watcher)
+RELOAD_POLL_SECONDS = float(os.getenv("MODEL_RELOAD_POLL_SECONDS", "0"))
+
+# Reload endpoints only accept weights files inside this directory (default: the configured model's directory)
+MODEL_RELOAD_DIR = os.getenv("MODEL_RELOAD_DIR")
+
+
+def load_class_names(classes_path: str) -> List[str]:
+    """Load the ordered list of class names."""
+    with open(classes_path) as f:
+        return json.load(f)
+
+
+def load_model_file(model_path: str, num_classes: int) -> torch.nn.Module:
+    """
+    Load a crop-health model from disk, accepting a state_dict (farmercrophealthbackend),
+    a fully pickled module (backend), a TorchScript `.ts` file (graph_optimization.py)
+    or memory-mapped `.safetensors` weights (weights_format.py).
+    """
+    if model_path.endswith(".safetensors"):
+        from weights_format import load_model
+        return load_model(model_path, num_classes)
+    if model_path.endswith(".ts"):
+        model = torch.jit.load(model_path, map_location="cpu")
+        model.eval()
+        return model
+    checkpoint = torch.load(model_path, map_location="cpu")
+    if isinstance(checkpoint, torch.nn.Module):
+        model = checkpoint
+    else:
+        model = CNN(num_classes=num_classes)
+        model.load_state_dict(checkpoint)
+    model.eval()
+    return model
+
+
+def check_reload_path(model_path: str, current_path: str, allowed_dir: Optional[str] = MODEL_RELOAD_DIR) -> str:
+    """
+    Resolve a client-supplied weights path for a reload. torch.load unpickles,
+    so a file outside the allowed directory (after following symlinks and "..")
+    is refused with ValueError rather than loaded.
+    """
+    allowed_dir = os.path.realpath(allowed_dir or os.path.dirname(os.path.abspath(current_path)))
+    resolved = os.path.realpath(os.path.join(allowed_dir, model_path))
+    if os.path.commonpath([allowed_dir, resolved]) != allowed_dir:
+        raise ValueError(f"model_path must be inside {allowed_dir}")
+    if not os.path.isfile(resolved):
+        raise ValueError(f"No weights file at {resolved}")
+    return resolved
+
+
+class ModelRegistry:
+    """
+    Owns the crop-health model for the whole process.
+
+    The model is loaded lazily on first use (or eagerly via `start_background_load`),
+    warmed up with a dummy forward pass before it is reported ready, and can be
+    replaced with a new weights file while requests keep being served. Readers
+    always see a consistent (model, class_names) pair because the swap is a
+    single reference assignment.
+    """
+
+    def __init__(self, model_path: str = DEFAULT_MODEL_PATH, classes_path: str = DEFAULT_CLASSES_PATH,
+                 quantization: str = QUANTIZATION_MODE, backend: str = EXECUTION_BACKEND,
+                 warmup_batch_sizes: Tuple[int, ...] = (1,)):
+        if backend not in EXECUTION_BACKENDS:
+            raise ValueError(f"Unknown execution backend '{backend}'. Expected one of {EXECUTION_BACKENDS}.")
+        self.model_path = model_path
+        self.classes_path = classes_path
+        self.quantization = quantization
+        self.backend = backend
+        self.warmup_batch_sizes = warmup_batch_sizes
+        self._load_lock = threading.Lock()
+        self._state: Optional[Dict[str, Any]] = None
+        self._error: Optional[str] = None
+        self._loading = False
+        self._watcher = None
+
+    # --- Loading ---
+    def _build_state(self, model_path: str) -> Dict[str, Any]:
+        started = time.perf_counter()
+        class_names = load_class_names(self.classes_path)
+        served_path = self.served_path(model_path)
+        model, quantization = self._load_serving_model(model_path, served_path, len(class_names))
+        load_ms = (time.perf_counter() - started) * 1000.0
+
+        warmup_started = time.perf_counter()
+        self._warm_up(model)
+        warmup_ms = (time.perf_counter() - warmup_started) * 1000.0
+
+        return {
+            "model": model,
+            "class_names": class_names,
+            "model_path": model_path,
+            "served_path": served_path,
+            "mtime": os.path.getmtime(served_path),
+            "quantization": quantization,
+            "version": (self._state["version"] + 1) if self._state else 1,
+            "loaded_at": datetime.datetime.utcnow().isoformat(),
+            "load_ms": round(load_ms, 2),
+            "warmup_ms": round(warmup_ms, 2),
+        }
+
+    def served_path(self, model_path: str) -> str:
+        """
+        The file the backend actually reads: the exported graph for "onnx" (an .onnx
+        model_path, CROP_HEALTH_ONNX_PATH or <weights>.onnx), the calibrated artifact
+        for static quantization (CROP_HEALTH_INT8_MODEL_PATH or <weights>_int8.ts)
+        when it exists, else the weights file. Load time, hot-reload watching and
+        the fingerprint all follow this file.
+        """
+        if self.backend == "onnx":
+            if model_path.endswith(".onnx"):
+                return model_path
+            from onnx_backend import default_onnx_path
+            return os.getenv("CROP_HEALTH_ONNX_PATH") or default_onnx_path(model_path)
+        if self.quantization == "static":
+            from quantization import static_int8_path
+            int8_path = static_int8_path(model_path)
+            if os.path.exists(int8_path):
+                return int8_path
+        return model_path
+
+    def _load_serving_model(self, model_path: str, served_path: str, num_classes: int):
+        """
+        Load the callable the configured backend serves from served_path. Returns
+        (model, quantization actually applied): static falls back to dynamic while
+        the calibrated artifact is missing.
+        """
+        if self.backend == "onnx":
+            from onnx_backend import load_onnx_model
+            return load_onnx_model(served_path), self.quantization
+        if self.quantization == "static" and served_path != model_path:
+            from quantization import load_static
+            return load_static(served_path), "static"
+        model = load_model_file(model_path, num_classes)
+        if self.quantization == "off":
+            return model, "off"
+        from quantization import apply_quantization
+        quantization = self.quantization
+        if quantization == "static":
+            print(f"⚠️ Static int8 model for '{os.path.basename(model_path)}' not found. "
+                  f"Run `python quantization.py calibrate`; using dynamic quantization.")
+            quantization = "dynamic"
+        return apply_quantization(model, quantization, model_path), quantization
+
+    def _warm_up(self, model):
+        """Run dummy forward passes so the first real request does not pay for lazy init."""
+        with torch.no_grad():
+            for batch_size in self.warmup_batch_sizes:
+                model(torch.zeros((batch_size,) + INPUT_SHAPE))
+
+    def load(self) -> bool:
+        """Load and warm up the model if it is not loaded yet. Returns readiness."""
+        if self._state is not None:
+            return True
+        with self._load_lock:
+            if self._state is not None:
+                return True
+            self._loading = True
+            try:
+                self._state = self._build_state(self.model_path)
+                self._error = None
+                print(f"✅ Model loaded from '{os.path.basename(self.model_path)}' "
+                      f"({self._state['load_ms']:.0f} ms load, {self._state['warmup_ms']:.0f} ms warm-up).")
+            except Exception as e:
+                self._error = str(e)
+                print(f"❌ Error loading model '{self.model_path}': {e}")
+            finally:
+                self._loading = False
+        return self._state is not None
+
+    def start_background_load(self):
+        """Load and warm up the model in a background thread so startup is not blocked."""
+        threading.Thread(target=self.load, name="model-registry-load", daemon=True).start()
+        if RELOAD_POLL_SECONDS > 0:
+            self.start_watcher(RELOAD_POLL_SECONDS)
+
+    def get(self) -> Tuple[Optional[torch.nn.Module], Optional[List[str]]]:
+        """Return the current (model, class_names), loading on first use."""
+        if self._state is None:
+            self.load()
+        state = self._state
+        if state is None:
+            return None, None
+        return state["model"], state["class_names"]
+
+    # --- Hot Reload ---
+    def reload(self, model_path: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Load a new weights file next to the current model, warm it up, then swap
+        it in. On failure the current model keeps serving.
+        """
+        model_path = model_path or self.model_path
+        with self._load_lock:
+            self._loading = True
+            try:
+                new_state = self._build_state(model_path)
+            except Exception as e:
+                print(f"❌ Model reload from '{model_path}' failed, keeping current model: {e}")
+                return {"reloaded": False, "error": str(e), **self.readiness()}
+            finally:
+                self._loading = False
+            self._state = new_state
+            self.model_path = model_path
+            self._error = None
+        print(f"🔄 Model reloaded from '{os.path.basename(model_path)}' (version {new_state['version']}).")
+        return {"reloaded": True, **self.readiness()}
+
+    def reload_if_changed(self) -> bool:
+        """
+        Reload the model if the file it serves was modified since it was loaded, or if
+        a different file should now be served (e.g. a static-int8 artifact appeared).
+        """
+        state = self._state
+        try:
+            changed = state is not None and (self.served_path(state["model_path"]) != state["served_path"]
+                                             or os.path.getmtime(state["served_path"]) != state["mtime"])
+        except OSError:
+            return False
+        return changed and self.reload()["reloaded"]
+
+    def start_watcher(self, poll_seconds: float):
+        """Poll the weights file and hot-reload it whenever it changes."""
+        if self._watcher is not None:
+            return
+
+        def watch():
+            while True:
+                time.sleep(poll_seconds)
+                self.reload_if_changed()
+
+        self._watcher = threading.Thread(target=watch, name="model-registry-watch", daemon=True)
+        self._watcher.start()
+
+    def fingerprint(self) -> str:
+        """Identifies the weights being served, so caches never mix results from different models."""
+        state = self._state
+        if state is None:
+            return "unloaded"
+        return f"{os.path.basename(state['served_path'])}@{int(state['mtime'])}:{self.backend}:{state['quantization']}"
+
+    # --- Readiness ---
+    def is_ready(self) -> bool:
+        return self._state is not None
+
+    def readiness(self) -> Dict[str, Any]:
+        """Readiness probe payload."""
+        state = self._state
+        info = {
+            "ready": state is not None,
+            "loading": self._loading,
+            "model_path": state["model_path"] if state else self.model_path,
+            "served_path": state["served_path"] if state else self.served_path(self.model_path),
+            "backend": self.backend,
+            "quantization": self.quantization,
+            "error": self._error,
+        }
+        if state:
+            info.update({
+                "served_quantization": state["quantization"],
+                "version": state["version"],
+                "num_classes": len(state["class_names"]),
+                "loaded_at": state["loaded_at"],
+                "load_ms": state["load_ms"],
+                "warmup_ms": state["warmup_ms"],
+            })
+        return info
+
+
+# --- Process-wide Registries ---
+_registries: Dict[str, ModelRegistry] = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(model_path: str = DEFAULT_MODEL_PATH, classes_path: str = DEFAULT_CLASSES_PATH,
+                 quantization: str = QUANTIZATION_MODE, backend: str = EXECUTION_BACKEND) -> ModelRegistry:
+    """Return the shared registry for a weights file and execution mode, creating it on first use."""
+    key = f"{os.path.abspath(model_path)}::{backend}::{quantization}"
+    with _registries_lock:
+        if key not in _registries:
+            _registries[key] = ModelRegistry(os.path.abspath(model_path), os.path.abspath(classes_path),
+                                             quantization=quantization, backend=backend)
+        return _registries[key]
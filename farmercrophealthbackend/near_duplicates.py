@@ -0,0 +1,159 @@
+# near_duplicates.py
+"""
+Near-duplicate detection for bursts of uploads from the same user.
+
+Farmers often send several almost identical frames of the same leaf. Each
+user's recent uploads are indexed by perceptual hash (pHash) in a BK-tree.
+A new upload within NEAR_DUPLICATE_MAX_DISTANCE bits of one from the last
+NEAR_DUPLICATE_WINDOW_SECONDS is tagged as its near-duplicate, but only if
+the dHash agrees as well. It then gets the earlier prediction and, where the
+endpoint stored one, the earlier enriched response. So the CNN and the agents
+run once per burst, and the agents' learning memory records one event for it
+instead of one per frame.
+"""
+
+import copy
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Tuple
+
+from PIL import Image
+
+from image_hashing import BKTree, dhash, hamming, phash
+
+# --- Configuration ---
+NEAR_DUPLICATE_ENABLED = os.getenv("NEAR_DUPLICATE_DETECTION", "1") == "1"
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.getenv("NEAR_DUPLICATE_MAX_DISTANCE", "6"))  # Bits out of 64
+NEAR_DUPLICATE_WINDOW_SECONDS = float(os.getenv("NEAR_DUPLICATE_WINDOW_SECONDS", "600"))
+NEAR_DUPLICATE_MAX_PER_USER = int(os.getenv("NEAR_DUPLICATE_MAX_PER_USER", "256"))
+NEAR_DUPLICATE_MAX_USERS = int(os.getenv("NEAR_DUPLICATE_MAX_USERS", "10000"))
+
+
+def fingerprints(image: Image.Image) -> Tuple[int, int]:
+    """(pHash, dHash) of a decoded image."""
+    return phash(image), dhash(image)
+
+
+@dataclass
+class Upload:
+    upload_id: str
+    phash: int
+    dhash: int
+    uploaded_at: float
+    class_name: str
+    confidence: str
+    image_key: Optional[str] = None
+    image_id: Optional[str] = None
+    responses: Dict[str, Any] = field(default_factory=dict)  # Enriched responses by endpoint scope
+
+
+class UserHistory:
+    """One user's recent uploads in a BK-tree, rebuilt once most of them have expired."""
+
+    def __init__(self):
+        self.tree = BKTree()
+        self.uploads: "OrderedDict[str, Upload]" = OrderedDict()
+
+    def find(self, phash_value: int, dhash_value: int, now: float, max_distance: int,
+             window: float) -> Optional[Upload]:
+        for _, upload in self.tree.search(phash_value, max_distance):
+            if (upload.upload_id in self.uploads and now - upload.uploaded_at <= window
+                    and hamming(dhash_value, upload.dhash) <= max_distance):
+                return upload
+        return None
+
+    def add(self, upload: Upload, now: float, max_uploads: int, window: float):
+        self.uploads[upload.upload_id] = upload
+        self.uploads.move_to_end(upload.upload_id)
+        while len(self.uploads) > max_uploads:
+            self.uploads.popitem(last=False)
+        for upload_id in [u for u, up in self.uploads.items() if now - up.uploaded_at > window]:
+            del self.uploads[upload_id]
+        if self.tree.size > 2 * len(self.uploads) + 16:
+            # BK-trees have no delete: rebuild from the uploads still in the window
+            self.tree = BKTree()
+            for kept in self.uploads.values():
+                self.tree.add(kept.phash, kept)
+        else:
+            self.tree.add(upload.phash, upload)
+
+
+class NearDuplicateIndex:
+    def __init__(self, enabled: bool = NEAR_DUPLICATE_ENABLED, max_distance: int = NEAR_DUPLICATE_MAX_DISTANCE,
+                 window_seconds: float = NEAR_DUPLICATE_WINDOW_SECONDS,
+                 max_per_user: int = NEAR_DUPLICATE_MAX_PER_USER, max_users: int = NEAR_DUPLICATE_MAX_USERS):
+        self.enabled = enabled
+        self.max_distance = max_distance
+        self.window_seconds = window_seconds
+        self.max_per_user = max_per_user
+        self.max_users = max_users
+        self.lock = threading.Lock()
+        self._users: "OrderedDict[str, UserHistory]" = OrderedDict()
+        self._counters = {"lookups": 0, "near_duplicates": 0, "responses_reused": 0}
+
+    def find(self, user_id: str, phash_value: int, dhash_value: int) -> Optional[Upload]:
+        """The user's most similar recent upload within the distance threshold, if any."""
+        now = time.time()
+        with self.lock:
+            self._counters["lookups"] += 1
+            history = self._users.get(user_id)
+            if history is None:
+                return None
+            self._users.move_to_end(user_id)
+            upload = history.find(phash_value, dhash_value, now, self.max_distance, self.window_seconds)
+            if upload is not None:
+                self._counters["near_duplicates"] += 1
+            return upload
+
+    def remember(self, user_id: str, upload: Upload):
+        now = time.time()
+        with self.lock:
+            history = self._users.get(user_id)
+            if history is None:
+                history = self._users[user_id] = UserHistory()
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+            self._users.move_to_end(user_id)
+            history.add(upload, now, self.max_per_user, self.window_seconds)
+
+    # --- Enriched Responses ---
+    def remember_response(self, user_id: Optional[str], upload_id: Optional[str], scope: Dict[str, Any],
+                          response: Dict[str, Any]):
+        """Keep an endpoint's response so near-duplicates of this upload can reuse it."""
+        if not user_id or not upload_id:
+            return
+        with self.lock:
+            history = self._users.get(user_id)
+            upload = history.uploads.get(upload_id) if history is not None else None
+            if upload is not None:
+                upload.responses[json.dumps(scope, sort_keys=True)] = copy.deepcopy(response)
+
+    def response_for(self, user_id: Optional[str], upload_id: Optional[str],
+                     scope: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if not user_id or not upload_id:
+            return None
+        with self.lock:
+            history = self._users.get(user_id)
+            upload = history.uploads.get(upload_id) if history is not None else None
+            response = upload.responses.get(json.dumps(scope, sort_keys=True)) if upload is not None else None
+            if response is None:
+                return None
+            self._counters["responses_reused"] += 1
+        return copy.deepcopy(response)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "enabled": self.enabled,
+                "max_distance": self.max_distance,
+                "window_seconds": self.window_seconds,
+                "users": len(self._users),
+                **self._counters,
+            }
+
+
+near_duplicates = NearDuplicateIndex()
@@ -0,0 +1,132 @@
+# onnx_backend.py
+"""
+ONNX export and ONNX Runtime execution backend for the crop-health CNN.
+
+Set CROP_HEALTH_BACKEND=onnx to serve predictions through ONNX Runtime on CPU
+instead of eager PyTorch. The model registry then loads the exported graph
+(CROP_HEALTH_ONNX_PATH, default: <weights>.onnx) in place of the torch module.
+
+Usage:
+    python onnx_backend.py --output plantvillage_weights_v22.onnx
+"""
+
+import argparse
+import os
+import sys
+from typing import Tuple
+
+import numpy as np
+import torch
+
+INPUT_NAME = "image"
+OUTPUT_NAME = "logits"
+OPSET_VERSION = 17
+
+# 0 lets ONNX Runtime pick the number of intra-op threads
+ORT_THREADS = int(os.getenv("CROP_HEALTH_ORT_THREADS", "0"))
+
+
+def default_onnx_path(model_path: str) -> str:
+    """Where the exported ONNX graph for a weights file lives by default."""
+    return os.path.splitext(model_path)[0] + ".onnx"
+
+
+# --- Execution Backend ---
+class OnnxRuntimeModel:
+    """
+    Callable stand-in for the torch module: takes an NCHW float tensor and
+    returns logits as a tensor, so the batching and prediction code is unchanged.
+    """
+
+    def __init__(self, onnx_path: str, intra_op_threads: int = ORT_THREADS):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads > 0:
+            options.intra_op_num_threads = intra_op_threads
+        self.onnx_path = onnx_path
+        self.session = ort.InferenceSession(onnx_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch: torch.Tensor) -> torch.Tensor:
+        inputs = np.ascontiguousarray(batch.detach().cpu().numpy(), dtype=np.float32)
+        logits = self.session.run(None, {self.input_name: inputs})[0]
+        return torch.from_numpy(logits)
+
+    def eval(self):
+        return self
+
+
+def load_onnx_model(onnx_path: str) -> OnnxRuntimeModel:
+    if not os.path.exists(onnx_path):
+        raise FileNotFoundError(f"ONNX model '{onnx_path}' not found. Run `python onnx_backend.py` to export it.")
+    return OnnxRuntimeModel(onnx_path)
+
+
+# --- Export ---
+def export_onnx(model: torch.nn.Module, output_path: str, opset_version: int = OPSET_VERSION):
+    """Export the CNN to ONNX with a dynamic batch dimension."""
+    model.eval()
+    dummy = torch.zeros(1, 3, 224, 224)
+    torch.onnx.export(
+        model,
+        dummy,
+        output_path,
+        input_names=[INPUT_NAME],
+        output_names=[OUTPUT_NAME],
+        dynamic_axes={INPUT_NAME: {0: "batch"}, OUTPUT_NAME: {0: "batch"}},
+        opset_version=opset_version,
+        do_constant_folding=True,
+    )
+
+
+def check_parity(model: torch.nn.Module, onnx_path: str, batch_sizes: Tuple[int, ...] = (1, 4, 16),
+                 atol: float = 1e-4, rtol: float = 1e-3) -> dict:
+    """Compare ONNX Runtime logits with the PyTorch model on random batches of several sizes."""
+    ort_model = OnnxRuntimeModel(onnx_path)
+    generator = torch.Generator().manual_seed(0)
+    results = {}
+    with torch.no_grad():
+        for batch_size in batch_sizes:
+            batch = torch.randn(batch_size, 3, 224, 224, generator=generator)
+            expected = model(batch)
+            actual = ort_model(batch)
+            results[batch_size] = {
+                "max_abs_diff": float((expected - actual).abs().max()),
+                "allclose": bool(torch.allclose(expected, actual, atol=atol, rtol=rtol)),
+                "top1_match": bool(torch.equal(expected.argmax(dim=1), actual.argmax(dim=1))),
+            }
+    return results
+
+
+def main(argv=None):
+    from inference import MODEL_PATH
+    from model_registry import DEFAULT_CLASSES_PATH, load_class_names, load_model_file
+
+    parser = argparse.ArgumentParser(description="Export the crop-health CNN to ONNX and check parity")
+    parser.add_argument("--weights", default=MODEL_PATH, help="PyTorch weights (state_dict or full module)")
+    parser.add_argument("--output", help="Output ONNX path (default: <weights>.onnx)")
+    parser.add_argument("--opset", type=int, default=OPSET_VERSION)
+    parser.add_argument("--atol", type=float, default=1e-4)
+    args = parser.parse_args(argv)
+
+    class_names = load_class_names(DEFAULT_CLASSES_PATH)
+    model = load_model_file(args.weights, len(class_names))
+    output = args.output or default_onnx_path(args.weights)
+
+    export_onnx(model, output, args.opset)
+    print(f"✅ Exported ONNX model to '{output}'.")
+
+    parity = check_parity(model, output, atol=args.atol)
+    for batch_size, result in parity.items():
+        status = "✅" if result["allclose"] and result["top1_match"] else "❌"
+        print(f"{status} batch={batch_size}: max |Δ| = {result['max_abs_diff']:.2e}, top-1 match = {result['top1_match']}")
+    if not all(r["allclose"] and r["top1_match"] for r in parity.values()):
+        print("❌ ONNX Runtime output does not match PyTorch. Do not deploy this export.")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
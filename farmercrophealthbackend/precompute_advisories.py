@@ -0,0 +1,160 @@
+# precompute_advisories.py
+"""
+Offline precomputation of the agent advisories for every class.
+
+The class space is closed, so the LLM-backed sections of both pipelines can
+be generated ahead of time. The job walks classes.json x --locations x
+--languages and writes one new version of the advisory store
+(advisory_store.py), which /predict and /agentic_predict then serve without
+calling the LLM:
+
+  * orchestrator.run_agents: treatment plan, financial benefits, community
+    insights and eco tips for every diseased class (healthy classes get fixed
+    defaults there).
+  * AgenticOrchestrator: the advisor (per location and language),
+    sustainability and community agents for every class, as produced by
+    their process_request().
+
+Calls run with at most --concurrency in flight and no more than --rpm
+starts per minute. Failed sections are not stored, so those requests fall
+back to the LLM. The version is marked complete at the end; running servers
+pick it up within ADVISORY_STORE_POLL_SECONDS.
+
+Usage:
+    python precompute_advisories.py --store advisories.db --locations India Telangana Punjab --languages en hi
+    python precompute_advisories.py --store advisories.db --classes Tomato___Early_blight --rpm 30
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from advisory_store import ADVISORY_STORE_DB, AdvisoryStore
+from agents.agentic_orchestrator import PRECOMPUTABLE_AGENTS, AgenticOrchestrator, advisory_section
+from agents.orchestrator import advisory_sections, parse_class_name
+
+MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
+CLASSES_PATH = os.path.join(MODEL_DIR, "classes.json")
+
+
+class RateLimiter:
+    """Spaces call starts at least 60 / rpm seconds apart."""
+
+    def __init__(self, rpm: float):
+        self.interval = 60.0 / rpm if rpm > 0 else 0.0
+        self.lock = asyncio.Lock()
+        self.next_start = 0.0
+
+    async def wait(self):
+        async with self.lock:
+            now = time.monotonic()
+            if self.next_start > now:
+                await asyncio.sleep(self.next_start - now)
+            self.next_start = max(now, self.next_start) + self.interval
+
+
+def failed(payload: Any) -> bool:
+    """Agents answer failures with an error key or an '... Error' fallback title instead of raising."""
+    if not isinstance(payload, dict):
+        return True
+    answer = payload.get("final_response", payload)
+    return not isinstance(answer, dict) or "error" in answer or str(answer.get("title", "")).endswith("Error")
+
+
+# --- Jobs ---
+Job = Tuple[Dict[str, str], Callable[[], Awaitable[Any]]]
+
+
+def build_jobs(class_names: List[str], locations: List[str], languages: List[str],
+               orchestrator: AgenticOrchestrator) -> List[Job]:
+    """(store key, coroutine factory) for every section of every class."""
+    jobs = []
+    for class_name in class_names:
+        crop, disease = parse_class_name(class_name)
+        if "healthy" not in disease.lower():
+            for section, compute in advisory_sections(crop, disease).items():
+                jobs.append(({"class_name": class_name, "section": section}, compute))
+        for agent_name, per_location in PRECOMPUTABLE_AGENTS.items():
+            targets = [(loc, lang) for loc in locations for lang in languages] if per_location else [("", "")]
+            for location, language in targets:
+                key = {"class_name": class_name, "section": advisory_section(agent_name),
+                       "location": location, "language": language}
+                jobs.append((key, lambda a=agent_name, c=class_name, l=location or locations[0],
+                             g=language or languages[0]: orchestrator.precompute_agent(a, c, l, g)))
+    return jobs
+
+
+async def run_jobs(store: AdvisoryStore, version: str, jobs: List[Job], concurrency: int, rpm: float) -> Dict[str, int]:
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = RateLimiter(rpm)
+    counts = {"stored": 0, "failed": 0}
+
+    async def run(key, compute):
+        async with semaphore:
+            await limiter.wait()
+            try:
+                payload = await compute()
+            except Exception as e:
+                payload = {"error": str(e)}
+            if failed(payload):
+                counts["failed"] += 1
+                print(f"⚠️ {key['class_name']} / {key['section']} failed; it will be served live")
+                return
+            store.put(version, payload=payload, **key)
+            counts["stored"] += 1
+            done = counts["stored"] + counts["failed"]
+            if done % 25 == 0:
+                print(f"🔄 {done}/{len(jobs)} sections")
+
+    await asyncio.gather(*(run(key, compute) for key, compute in jobs))
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute agent advisories for every class into the advisory store")
+    parser.add_argument("--store", default=ADVISORY_STORE_DB, required=not ADVISORY_STORE_DB, help="Advisory store sqlite file")
+    parser.add_argument("--locations", nargs="+", default=["India"])
+    parser.add_argument("--languages", nargs="+", default=["en"])
+    parser.add_argument("--classes", nargs="+", help="Only these classes (default: all of classes.json)")
+    parser.add_argument("--concurrency", type=int, default=4, help="LLM-backed sections in flight")
+    parser.add_argument("--rpm", type=float, default=60, help="Section starts per minute, 0 = unlimited")
+    parser.add_argument("--keep", type=int, default=3, help="Complete versions to keep")
+    args = parser.parse_args(argv)
+
+    with open(CLASSES_PATH) as f:
+        class_names = json.load(f)
+    if args.classes:
+        unknown = sorted(set(args.classes) - set(class_names))
+        if unknown:
+            print(f"❌ Unknown classes: {', '.join(unknown)}")
+            return 1
+        class_names = [c for c in class_names if c in args.classes]
+
+    store = AdvisoryStore(args.store)
+    orchestrator = AgenticOrchestrator()
+    jobs = build_jobs(class_names, args.locations, args.languages, orchestrator)
+    version = store.begin_version({"classes": len(class_names), "locations": args.locations,
+                                   "languages": args.languages})
+    print(f"🔄 Precomputing {len(jobs)} sections for {len(class_names)} classes into version {version}...")
+
+    async def run():
+        try:
+            return await run_jobs(store, version, jobs, args.concurrency, args.rpm)
+        finally:
+            await orchestrator.close()
+
+    started = time.perf_counter()
+    counts = asyncio.run(run())
+    store.complete_version(version, counts["stored"], counts["failed"])
+    pruned = store.prune(args.keep)
+    print(f"✅ Version {version}: {counts['stored']} sections stored, {counts['failed']} failed "
+          f"in {time.perf_counter() - started:.0f} s; {pruned} old versions pruned")
+    return 0 if counts["stored"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,230 @@
+# prediction_cache.py
+"""
+Content-addressed cache for crop-health predictions.
+
+Re-uploads of the same photo (mobile retries, photos shared in farmer groups)
+are looked up by a hash of the decoded 224x224 image instead of rerunning the
+CNN. In "perceptual" mode the key is a dHash, so re-encoded copies of a photo
+hit too. Entries live in an in-memory LRU with a TTL and, optionally, in a
+sqlite file that survives restarts and is shared by worker processes.
+"""
+
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from PIL import Image
+
+from image_hashing import content_hash, dhash
+
+# --- Configuration ---
+CACHE_MODE = os.getenv("PREDICTION_CACHE_MODE", "exact")  # "exact", "perceptual" or "off"
+CACHE_MAX_ENTRIES = int(os.getenv("PREDICTION_CACHE_MAX_ENTRIES", "10000"))
+CACHE_TTL_SECONDS = float(os.getenv("PREDICTION_CACHE_TTL_SECONDS", str(24 * 3600)))
+CACHE_DB_PATH = os.getenv("PREDICTION_CACHE_DB")  # Optional on-disk sqlite tier
+CACHE_RESPONSES = os.getenv("PREDICTION_CACHE_RESPONSES", "0") == "1"
+
+
+class TieredCache:
+    """
+    LRU + TTL in-memory cache with an optional sqlite tier behind it.
+
+    With stale_seconds > 0, expired entries are kept that much longer and
+    lookup() returns them flagged as stale, for stale-while-revalidate callers.
+    get() only ever returns fresh entries.
+    """
+
+    def __init__(self, namespace: str, max_entries: int = CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = CACHE_TTL_SECONDS, db_path: Optional[str] = CACHE_DB_PATH,
+                 stale_seconds: float = 0.0):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._counters = {"hits": 0, "disk_hits": 0, "stale_hits": 0, "misses": 0, "evictions": 0,
+                          "expirations": 0, "puts": 0}
+        if self.db_path:
+            self._init_database()
+
+    def _init_database(self):
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS prediction_cache (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_prediction_cache_expires ON prediction_cache(expires_at)
+            """)
+
+    # --- Public API ---
+    def get(self, key: str) -> Optional[Any]:
+        value, fresh = self._lookup(key, allow_stale=False)
+        return value
+
+    def lookup(self, key: str) -> Tuple[Optional[Any], bool]:
+        """(value, fresh): like get(), but also returns an expired entry within stale_seconds, with fresh=False."""
+        return self._lookup(key, allow_stale=True)
+
+    def put(self, key: str, value: Any, ttl_seconds: Optional[float] = None):
+        """Store a value; ttl_seconds overrides the cache-wide TTL for this entry."""
+        expires_at = time.time() + (self.ttl_seconds if ttl_seconds is None else ttl_seconds)
+        with self.lock:
+            self._store(key, value, expires_at)
+            self._counters["puts"] += 1
+        if self.db_path:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute("""
+                    INSERT OR REPLACE INTO prediction_cache (namespace, key, value, expires_at)
+                    VALUES (?, ?, ?, ?)
+                """, (self.namespace, key, json.dumps(value), expires_at))
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self._counters["hits"] + self._counters["disk_hits"] + self._counters["misses"]
+            return {
+                **self._counters,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "stale_seconds": self.stale_seconds,
+                "hit_rate": ((self._counters["hits"] + self._counters["disk_hits"]) / lookups) if lookups else 0,
+                "disk_tier": bool(self.db_path),
+            }
+
+    def clear(self):
+        with self.lock:
+            self._entries.clear()
+        if self.db_path:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute("DELETE FROM prediction_cache WHERE namespace = ?", (self.namespace,))
+
+    # --- Internals ---
+    def _lookup(self, key: str, allow_stale: bool) -> Tuple[Optional[Any], bool]:
+        now = time.time()
+        with self.lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._counters["hits"] += 1
+                    return value, True
+                if expires_at + self.stale_seconds <= now:
+                    del self._entries[key]
+                    self._counters["expirations"] += 1
+                elif allow_stale:
+                    self._entries.move_to_end(key)
+                    self._counters["stale_hits"] += 1
+                    return value, False
+
+        if self.db_path:
+            value, expires_at = self._get_from_disk(key, now)
+            if value is not None and (expires_at > now or allow_stale):
+                with self.lock:
+                    self._counters["disk_hits" if expires_at > now else "stale_hits"] += 1
+                    self._store(key, value, expires_at)
+                return value, expires_at > now
+
+        with self.lock:
+            self._counters["misses"] += 1
+        return None, False
+
+    def _store(self, key: str, value: Any, expires_at: float):
+        """Insert under self.lock and evict least recently used entries beyond capacity."""
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counters["evictions"] += 1
+
+    def _get_from_disk(self, key: str, now: float):
+        with sqlite3.connect(self.db_path) as conn:
+            row = conn.execute("""
+                SELECT value, expires_at FROM prediction_cache WHERE namespace = ? AND key = ?
+            """, (self.namespace, key)).fetchone()
+            if row is None:
+                return None, None
+            if row[1] + self.stale_seconds <= now:
+                conn.execute("DELETE FROM prediction_cache WHERE namespace = ? AND key = ?", (self.namespace, key))
+                return None, None
+        return json.loads(row[0]), row[1]
+
+
+# --- Prediction Cache ---
+prediction_cache = TieredCache("prediction")
+response_cache = TieredCache("response")
+
+
+def image_key(image: Image.Image, mode: str = CACHE_MODE) -> Optional[str]:
+    """Cache key for a decoded image, or None when caching is off."""
+    if mode == "off":
+        return None
+    if mode == "perceptual":
+        return f"dhash:{dhash(image):016x}"
+    return f"px:{content_hash(image)}"
+
+
+def get_prediction(key: Optional[str]):
+    """Return a cached (class_name, confidence) or None."""
+    if key is None:
+        return None
+    value = prediction_cache.get(key)
+    return tuple(value) if value is not None else None
+
+
+def put_prediction(key: Optional[str], class_name: str, confidence: str):
+    if key is not None:
+        prediction_cache.put(key, [class_name, confidence])
+
+
+def _response_key(key: str, scope: Dict[str, Any]) -> str:
+    """Enriched responses depend on the endpoint and the user's language/location, not just the image."""
+    return key + "|" + json.dumps(scope, sort_keys=True)
+
+
+def get_response(key: Optional[str], scope: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Return a cached enriched agent response for this image and scope, if response caching is on."""
+    if key is None or not CACHE_RESPONSES:
+        return None
+    response = response_cache.get(_response_key(key, scope))
+    # Callers personalize request_info, so never hand out the cached object itself
+    return copy.deepcopy(response) if response is not None else None
+
+
+def put_response(key: Optional[str], scope: Dict[str, Any], response: Dict[str, Any]):
+    if key is not None and CACHE_RESPONSES:
+        # Store a snapshot: the endpoint goes on to annotate this response for the current request only
+        response_cache.put(_response_key(key, scope), copy.deepcopy(response))
+
+
+def replay_response(response: Dict[str, Any], request_info: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Prepare a cached enriched response for another request. request_info is
+    replaced wholesale, so the original request's per-session fields (session_id,
+    image_id, ...) never reach a different user; annotations are re-added by the endpoint.
+    """
+    response["request_info"] = {**request_info, "cached": True}
+    for field in ("similar_cases", "explanation"):
+        response.pop(field, None)
+    return response
+
+
+def cache_stats() -> Dict[str, Any]:
+    return {
+        "mode": CACHE_MODE,
+        "predictions": prediction_cache.stats(),
+        "responses": response_cache.stats() if CACHE_RESPONSES else {"enabled": False},
+    }
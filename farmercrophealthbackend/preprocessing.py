@@ -0,0 +1,83 @@
+# preprocessing.py
+"""
+Shared image decode and preprocessing for every crop-health prediction path.
+
+One recipe for both backends: squash to 256x256, center-crop 224, normalize
+with ImageNet statistics. The equivalent is done in one resample directly to
+224x224 (the crop box is mapped back to source coordinates), JPEGs are
+decoded at a reduced DCT scale when they are much larger than needed, and
+normalization is one vectorized op written into a preallocated tensor.
+"""
+
+import os
+from typing import List, Optional
+
+import numpy as np
+import torch
+from PIL import Image
+
+RESIZE_SIZE = 256
+CROP_SIZE = 224
+MEAN = (0.485, 0.456, 0.406)
+STD = (0.229, 0.224, 0.225)
+
+# Reduced-scale JPEG decoding; turn off for bit-for-bit comparisons
+DRAFT_DECODE = os.getenv("PREPROCESS_DRAFT_DECODE", "1") == "1"
+
+
+class Preprocessor:
+    """Decodes an uploaded image into a normalized (3, 224, 224) float tensor."""
+
+    def __init__(self, resize_size: int = RESIZE_SIZE, crop_size: int = CROP_SIZE,
+                 mean=MEAN, std=STD, draft: bool = DRAFT_DECODE):
+        self.resize_size = resize_size
+        self.crop_size = crop_size
+        self.draft = draft
+        # x_norm = (x / 255 - mean) / std  ==  x * scale + shift
+        std_t = torch.tensor(std, dtype=torch.float32).view(3, 1, 1)
+        mean_t = torch.tensor(mean, dtype=torch.float32).view(3, 1, 1)
+        self.scale = 1.0 / (255.0 * std_t)
+        self.shift = -mean_t / std_t
+
+    def _crop_box(self, width: int, height: int):
+        """The source region that ends up in the center crop after squashing to resize_size."""
+        margin = (self.resize_size - self.crop_size) / 2.0
+        sx, sy = width / self.resize_size, height / self.resize_size
+        return (margin * sx, margin * sy, (margin + self.crop_size) * sx, (margin + self.crop_size) * sy)
+
+    def decode(self, image_file) -> Image.Image:
+        """Decode to an RGB image of exactly crop_size x crop_size."""
+        image = Image.open(image_file)
+        if self.draft and image.format == "JPEG":
+            # Let libjpeg skip detail we would throw away: the decoded image stays >= resize_size per side
+            image.draft("RGB", (self.resize_size, self.resize_size))
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        box = self._crop_box(*image.size)
+        return image.resize((self.crop_size, self.crop_size), Image.BILINEAR, box=box)
+
+    def normalize(self, image: Image.Image, out: Optional[torch.Tensor] = None) -> torch.Tensor:
+        """Normalize an RGB image into `out` (allocated if not given) in one fused op."""
+        pixels = torch.from_numpy(np.array(image, dtype=np.uint8)).permute(2, 0, 1)
+        if out is None:
+            out = torch.empty((3, self.crop_size, self.crop_size), dtype=torch.float32)
+        return torch.addcmul(self.shift, pixels, self.scale, out=out)
+
+    def __call__(self, image_file, out: Optional[torch.Tensor] = None) -> torch.Tensor:
+        return self.normalize(self.decode(image_file), out=out)
+
+    def batch(self, image_files: List) -> torch.Tensor:
+        """Preprocess several images straight into one preallocated (N, 3, 224, 224) batch."""
+        batch = torch.empty((len(image_files), 3, self.crop_size, self.crop_size), dtype=torch.float32)
+        for i, image_file in enumerate(image_files):
+            self(image_file, out=batch[i])
+        return batch
+
+
+# Built once per process and shared by inference.py and backend/app.py
+preprocessor = Preprocessor()
+
+
+def preprocess_image(image_file) -> torch.Tensor:
+    """Decode and normalize an image into a (1, 3, 224, 224) model input."""
+    return preprocessor(image_file).unsqueeze(0)
@@ -0,0 +1,259 @@
+# pruning.py
+"""
+Structured channel pruning for the crop-health CNN.
+
+Conv channels are ranked by their BatchNorm scale |gamma| (the spread of the
+channel's output) or by the L1 norm of their filter. The lowest-ranked ones are
+removed at per-stage ratios. The result is rebuilt as a genuinely smaller CNN
+with narrower `widths`, not masked. A removed channel still contributed its
+BatchNorm shift (its mean output) to the next layer, so that constant is folded
+into the next layer's bias.
+
+The sweep reports parameters, multiply-adds, latency (optionally at an edge
+server's thread count) and, with sample images, top-1 agreement with the
+original and accuracy. A short distillation fine-tune can be run per variant.
+Variants are saved as .safetensors with their widths in the metadata, so the
+registry loads them via CROP_HEALTH_MODEL_PATH.
+
+Usage:
+    python pruning.py --sweep 0.25 0.5 0,0.25,0.5,0.5,0.5 --images ./samples --threads 2
+    python pruning.py --sweep 0,0.25,0.5,0.5,0.5 --images ./samples --fine-tune-epochs 3 --save
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import torch
+
+from crop_cnn import CNN, STAGES, LowRankLinear, conv_widths
+from graph_optimization import benchmark
+from image_folders import iter_image_files
+from weights_format import save_state_dict
+
+CRITERIA = ("bn", "l1")
+HEAD_INDEX = 1
+STAGE_RESOLUTIONS = (224, 112, 56, 28, 14)
+
+
+def parse_ratios(spec: str) -> Tuple[float, ...]:
+    """"0.25" prunes every stage by 25%; "0,0.25,0.5,0.5,0.5" sets one ratio per stage."""
+    ratios = tuple(float(r) for r in spec.split(","))
+    if len(ratios) == 1:
+        ratios = ratios * len(STAGES)
+    if len(ratios) != len(STAGES) or not all(0 <= r < 1 for r in ratios):
+        raise ValueError(f"Expected 1 or {len(STAGES)} ratios in [0, 1), got '{spec}'")
+    return ratios
+
+
+def default_pruned_path(model_path: str, ratios: Sequence[float]) -> str:
+    tag = "-".join(str(int(round(r * 100))) for r in ratios)
+    return f"{os.path.splitext(model_path)[0]}_pruned_{tag}.safetensors"
+
+
+# --- Ranking ---
+def _conv_bn_pairs(model: CNN) -> List[Tuple[torch.nn.Conv2d, torch.nn.BatchNorm2d]]:
+    """Each convolution with the BatchNorm that follows it (Conv -> ReLU -> BatchNorm)."""
+    layers = list(model.conv_layers)
+    return [(layer, layers[i + 2]) for i, layer in enumerate(layers) if isinstance(layer, torch.nn.Conv2d)]
+
+
+def channel_scores(conv: torch.nn.Conv2d, bn: torch.nn.BatchNorm2d, criterion: str = "bn") -> torch.Tensor:
+    if criterion == "bn":
+        return bn.weight.detach().abs()
+    if criterion == "l1":
+        return conv.weight.detach().abs().sum(dim=(1, 2, 3))
+    raise ValueError(f"Unknown criterion '{criterion}'. Expected one of {CRITERIA}.")
+
+
+def select_channels(model: CNN, ratios: Sequence[float], criterion: str = "bn", round_to: int = 1) -> List[torch.Tensor]:
+    """Sorted indices of the channels each convolution keeps."""
+    stage_of = {conv: stage for stage, convs in enumerate(STAGES) for conv in convs}
+    keep = []
+    for i, (conv, bn) in enumerate(_conv_bn_pairs(model)):
+        width = conv.out_channels
+        n_keep = math.ceil(width * (1 - ratios[stage_of[i]]))
+        n_keep = min(width, max(round_to, int(math.ceil(n_keep / round_to) * round_to)))
+        top = torch.topk(channel_scores(conv, bn, criterion), n_keep).indices
+        keep.append(torch.sort(top).values)
+    return keep
+
+
+# --- Rebuilding ---
+def prune(model: CNN, ratios: Sequence[float], criterion: str = "bn", round_to: int = 1) -> CNN:
+    """Build a narrower CNN holding the kept channels of `model`."""
+    model = model.eval()
+    keep = select_channels(model, ratios, criterion, round_to)
+    head = model.dense_layers[HEAD_INDEX]
+    head_rank = head.rank if isinstance(head, LowRankLinear) else None
+    num_classes = model.dense_layers[-1].out_features
+    pruned = CNN(num_classes=num_classes, head_rank=head_rank, widths=[len(k) for k in keep]).eval()
+
+    old_pairs, new_pairs = _conv_bn_pairs(model), _conv_bn_pairs(pruned)
+    in_keep = torch.arange(3)
+    shift_in = torch.zeros(0)  # Mean output of the previous layer's removed channels
+    removed_in = torch.zeros(0, dtype=torch.long)
+    with torch.no_grad():
+        for (old_conv, old_bn), (new_conv, new_bn), out_keep in zip(old_pairs, new_pairs, keep):
+            weight = old_conv.weight[out_keep]
+            new_conv.weight.copy_(weight[:, in_keep])
+            bias = old_conv.bias[out_keep].clone()
+            if removed_in.numel():
+                # Removed input channels output their BatchNorm shift on average; keep that contribution
+                bias += weight[:, removed_in].sum(dim=(2, 3)) @ shift_in
+            new_conv.bias.copy_(bias)
+            for name in ("weight", "bias", "running_mean", "running_var"):
+                getattr(new_bn, name).copy_(getattr(old_bn, name)[out_keep])
+            new_bn.num_batches_tracked.copy_(old_bn.num_batches_tracked)
+
+            removed_in = _complement(out_keep, old_conv.out_channels)
+            shift_in = old_bn.bias[removed_in]
+            in_keep = out_keep
+
+        spatial = _avgpool_area(model)
+        columns = _flattened_columns(in_keep, spatial)
+        removed_columns = _flattened_columns(removed_in, spatial)
+        removed_shift = shift_in.repeat_interleave(spatial)
+        if isinstance(head, LowRankLinear):
+            pruned.dense_layers[HEAD_INDEX][0].weight.copy_(head[0].weight[:, columns])
+            pruned.dense_layers[HEAD_INDEX][1].weight.copy_(head[1].weight)
+            pruned.dense_layers[HEAD_INDEX][1].bias.copy_(
+                head[1].bias + head[1].weight @ (head[0].weight[:, removed_columns] @ removed_shift))
+        else:
+            pruned.dense_layers[HEAD_INDEX].weight.copy_(head.weight[:, columns])
+            pruned.dense_layers[HEAD_INDEX].bias.copy_(head.bias + head.weight[:, removed_columns] @ removed_shift)
+        pruned.dense_layers[-1].load_state_dict(model.dense_layers[-1].state_dict())
+    return pruned
+
+
+def _complement(keep: torch.Tensor, size: int) -> torch.Tensor:
+    mask = torch.ones(size, dtype=torch.bool)
+    mask[keep] = False
+    return torch.nonzero(mask).flatten()
+
+
+def _avgpool_area(model: CNN) -> int:
+    size = model.avgpool.output_size
+    out_h, out_w = size if isinstance(size, tuple) else (size, size)
+    return out_h * out_w
+
+
+def _flattened_columns(channels: torch.Tensor, spatial: int) -> torch.Tensor:
+    """Columns of the first dense layer fed by these channels after AdaptiveAvgPool and flatten."""
+    return (channels.unsqueeze(1) * spatial + torch.arange(spatial).unsqueeze(0)).flatten()
+
+
+# --- Reporting ---
+def multiply_adds(model: CNN) -> int:
+    """Multiply-adds per 224x224 image."""
+    widths = conv_widths(model)
+    total, in_channels = 0, 3
+    for stage, convs in enumerate(STAGES):
+        for conv in convs:
+            total += STAGE_RESOLUTIONS[stage] ** 2 * 9 * in_channels * widths[conv]
+            in_channels = widths[conv]
+    for layer in model.dense_layers.modules():
+        if isinstance(layer, torch.nn.Linear):
+            total += layer.in_features * layer.out_features
+    return total
+
+
+def describe(model: CNN, threads: Optional[int] = None) -> Dict[str, Any]:
+    parameters = sum(p.numel() for p in model.parameters())
+    report = {
+        "widths": list(conv_widths(model)),
+        "parameters": parameters,
+        "size_mb": round(parameters * 4 / (1024.0 * 1024.0), 2),
+        "gmacs": round(multiply_adds(model) / 1e9, 3),
+    }
+    previous_threads = torch.get_num_threads()
+    if threads:
+        torch.set_num_threads(threads)
+    try:
+        report["latency_ms"] = {f"batch_{b}": round(benchmark(model, b), 3) for b in (1, 8)}
+    finally:
+        torch.set_num_threads(previous_threads)
+    return report
+
+
+def main(argv=None):
+    from distill import distill, evaluate
+    from inference import MODEL_PATH
+    from model_registry import DEFAULT_CLASSES_PATH, load_class_names, load_model_file
+
+    parser = argparse.ArgumentParser(description="Structured channel pruning sweep for the crop-health CNN")
+    parser.add_argument("--weights", default=MODEL_PATH)
+    parser.add_argument("--sweep", nargs="+", default=["0.25", "0.5", "0,0.25,0.5,0.5,0.5"],
+                        help="Pruning ratios: one for every stage, or five comma-separated per-stage ratios")
+    parser.add_argument("--criterion", choices=CRITERIA, default="bn")
+    parser.add_argument("--round-to", type=int, default=8, help="Keep channel counts a multiple of this (SIMD-friendly)")
+    parser.add_argument("--images", help="Leaf images for agreement/accuracy and fine-tuning (class sub-folders optional)")
+    parser.add_argument("--fine-tune-epochs", type=int, default=0)
+    parser.add_argument("--val-fraction", type=float, default=0.1)
+    parser.add_argument("--threads", type=int, help="Measure latency at this many threads (e.g. an edge server's cores)")
+    parser.add_argument("--save", action="store_true", help="Save each variant as <weights>_pruned_<ratios>.safetensors")
+    parser.add_argument("--output", help="Write the JSON sweep report to this file")
+    args = parser.parse_args(argv)
+
+    torch.manual_seed(0)
+    class_names = load_class_names(DEFAULT_CLASSES_PATH)
+    original = load_model_file(args.weights, len(class_names))
+    if not isinstance(original, CNN):
+        print("❌ Pruning needs an eager CNN checkpoint (state_dict, full module or .safetensors).")
+        return 1
+
+    val_paths = []
+    if args.images:
+        # Same split as distill.distill, so fine-tuned variants are scored on images they never saw
+        paths = iter_image_files(args.images)
+        random.Random(0).shuffle(paths)
+        val_paths = paths[:max(1, int(len(paths) * args.val_fraction))]
+
+    report = {"criterion": args.criterion, "original": describe(original, args.threads), "variants": {}}
+    for spec in args.sweep:
+        ratios = parse_ratios(spec)
+        pruned = prune(original, ratios, args.criterion, args.round_to)
+        entry = {"ratios": list(ratios)}
+        if args.images and args.fine_tune_epochs:
+            pruned, quality = distill(original, class_names, args.images, epochs=args.fine_tune_epochs,
+                                      lr=1e-4, val_fraction=args.val_fraction, student=pruned)
+        elif args.images:
+            quality = evaluate(pruned, original, val_paths, args.images, class_names, batch_size=16)
+        else:
+            quality = None
+        entry.update(describe(pruned, args.threads))
+        if quality is not None:
+            entry["top1_agreement"] = quality["student_teacher_agreement"]
+            entry["accuracy"] = quality["accuracy"]["student"]
+        if args.save:
+            output = default_pruned_path(args.weights, ratios)
+            config = {"widths": list(conv_widths(pruned))}
+            if isinstance(pruned.dense_layers[HEAD_INDEX], LowRankLinear):
+                config["head_rank"] = pruned.dense_layers[HEAD_INDEX].rank
+            save_state_dict(pruned.state_dict(), output, metadata={
+                "format": "pt",
+                "architecture": "crop_cnn.CNN",
+                "num_classes": len(class_names),
+                "config": json.dumps(config),
+                "source": os.path.basename(args.weights),
+            })
+            entry["path"] = output
+        report["variants"][spec] = entry
+        print(f"✅ {spec}: {entry['gmacs']} GMACs, {entry['latency_ms']['batch_1']} ms/image, "
+              f"agreement {entry.get('top1_agreement', 'n/a')}")
+
+    if args.images:
+        report["original"]["accuracy"] = evaluate(original, original, val_paths, args.images, class_names, 16)["accuracy"]["teacher"]
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
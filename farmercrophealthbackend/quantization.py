@@ -0,0 +1,293 @@
+# quantization.py
+"""
+INT8 quantized execution for the crop-health CNN.
+
+Modes (selected with CROP_HEALTH_QUANTIZATION):
+    off      fp32 eager model (default)
+    dynamic  dense layers quantized to int8 at load time, no calibration needed
+    static   conv stack statically quantized with a calibrated artifact produced by
+             `python quantization.py calibrate`, dense layers dynamically quantized
+
+Usage:
+    python quantization.py calibrate --images ./samples --output plantvillage_int8.ts
+    python quantization.py report --images ./samples --quantized plantvillage_int8.ts
+"""
+
+import argparse
+import copy
+import json
+import os
+import random
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import torch
+from torch.ao.quantization import DeQuantStub, QuantStub, convert, fuse_modules, get_default_qconfig, prepare
+
+from image_folders import iter_image_files, label_from_path, load_batches
+
+QUANTIZATION_MODES = ("off", "dynamic", "static")
+
+
+def select_engine() -> str:
+    """Pick the best quantized kernel backend available on this CPU."""
+    supported = torch.backends.quantized.supported_engines
+    for engine in ("x86", "fbgemm", "qnnpack"):
+        if engine in supported:
+            torch.backends.quantized.engine = engine
+            return engine
+    raise RuntimeError("No quantized engine is available in this PyTorch build.")
+
+
+def default_int8_path(model_path: str) -> str:
+    """Where the calibrated static-int8 artifact for a weights file lives by default."""
+    return os.path.splitext(model_path)[0] + "_int8.ts"
+
+
+def static_int8_path(model_path: Optional[str]) -> str:
+    """The static-int8 artifact served for a weights file: CROP_HEALTH_INT8_MODEL_PATH or the default."""
+    return os.getenv("CROP_HEALTH_INT8_MODEL_PATH") or default_int8_path(model_path or "")
+
+
+def is_quantized(model: torch.nn.Module) -> bool:
+    """True if any layer of an eager model is an int8 (torch.ao quantized) module."""
+    return any(".quantized" in type(module).__module__ for module in model.modules())
+
+
+# --- Dynamic Quantization ---
+def quantize_dynamic(model: torch.nn.Module) -> torch.nn.Module:
+    """Quantize the Linear layers of the dense head to int8 weights with dynamic activations."""
+    select_engine()
+    return torch.ao.quantization.quantize_dynamic(copy.deepcopy(model).eval(), {torch.nn.Linear}, dtype=torch.qint8)
+
+
+# --- Static Post-Training Quantization ---
+class QuantizableCNN(torch.nn.Module):
+    """Wraps a trained CNN with quant/dequant stubs around the conv stack."""
+
+    def __init__(self, model: torch.nn.Module):
+        super().__init__()
+        self.quant = QuantStub()
+        self.conv_layers = copy.deepcopy(model.conv_layers)
+        self.avgpool = copy.deepcopy(model.avgpool)
+        self.dequant = DeQuantStub()
+        self.dense_layers = copy.deepcopy(model.dense_layers)
+
+    def forward(self, x):
+        x = self.quant(x)
+        x = self.conv_layers(x)
+        x = self.avgpool(x)
+        x = self.dequant(x)
+        x = torch.flatten(x, 1)
+        x = self.dense_layers(x)
+        return x
+
+
+def _conv_relu_pairs(conv_layers: torch.nn.Sequential) -> List[List[str]]:
+    """Names of every Conv2d directly followed by a ReLU, for fusion."""
+    modules = list(conv_layers.named_children())
+    return [
+        [name, modules[i + 1][0]]
+        for i, (name, module) in enumerate(modules[:-1])
+        if isinstance(module, torch.nn.Conv2d) and isinstance(modules[i + 1][1], torch.nn.ReLU)
+    ]
+
+
+def prepare_static(model: torch.nn.Module) -> QuantizableCNN:
+    """Fuse Conv+ReLU pairs and insert observers into the conv stack."""
+    engine = select_engine()
+    qmodel = QuantizableCNN(model).eval()
+    fuse_modules(qmodel.conv_layers, _conv_relu_pairs(qmodel.conv_layers), inplace=True)
+    qmodel.qconfig = None
+    qconfig = get_default_qconfig(engine)
+    qmodel.quant.qconfig = qconfig
+    qmodel.conv_layers.qconfig = qconfig
+    qmodel.dequant.qconfig = qconfig
+    return prepare(qmodel, inplace=False)
+
+
+def convert_static(prepared: QuantizableCNN) -> torch.nn.Module:
+    """Convert a calibrated model to int8 and dynamically quantize its dense head."""
+    qmodel = convert(prepared.eval(), inplace=False)
+    qmodel.dense_layers = torch.ao.quantization.quantize_dynamic(qmodel.dense_layers, {torch.nn.Linear}, dtype=torch.qint8)
+    return qmodel
+
+
+def calibrate(model: torch.nn.Module, batches) -> torch.nn.Module:
+    """Run calibration batches through an observed copy of the model and return the int8 model."""
+    prepared = prepare_static(model)
+    with torch.no_grad():
+        for batch in batches:
+            prepared(batch)
+    return convert_static(prepared)
+
+
+def save_static(qmodel: torch.nn.Module, output_path: str):
+    """Save a static-int8 model as TorchScript so it loads without the Python wrapper class."""
+    scripted = torch.jit.trace(qmodel, torch.zeros(1, 3, 224, 224))
+    torch.jit.save(scripted, output_path)
+
+
+def load_static(path: str) -> torch.nn.Module:
+    select_engine()
+    model = torch.jit.load(path, map_location="cpu")
+    model.eval()
+    return model
+
+
+def apply_quantization(model: torch.nn.Module, mode: str, model_path: Optional[str] = None) -> torch.nn.Module:
+    """Return the model to serve for a quantization mode. Used by the model registry."""
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization mode '{mode}'. Expected one of {QUANTIZATION_MODES}.")
+    if mode == "off":
+        return model
+    if mode == "static":
+        int8_path = static_int8_path(model_path)
+        if os.path.exists(int8_path):
+            return load_static(int8_path)
+        print(f"⚠️ Static int8 model '{int8_path}' not found. Run `python quantization.py calibrate`; using dynamic quantization.")
+    return quantize_dynamic(model)
+
+
+# --- Calibration and Regression Report ---
+def _timed_predictions(model: torch.nn.Module, batches) -> Dict[str, Any]:
+    predictions, latencies = [], []
+    with torch.no_grad():
+        for batch in batches:
+            started = time.perf_counter()
+            output = model(batch)
+            latencies.append((time.perf_counter() - started) * 1000.0 / batch.shape[0])
+            predictions.extend(output.argmax(dim=1).tolist())
+    latencies.sort()
+    return {
+        "predictions": predictions,
+        "mean_ms_per_image": sum(latencies) / len(latencies) if latencies else 0,
+        "p95_ms_per_image": latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0,
+    }
+
+
+def split_calibration(paths: List[str], val_fraction: float, seed: int = 0):
+    """Shuffle with a fixed seed and split into (calibration, held-out) paths."""
+    paths = list(paths)
+    random.Random(seed).shuffle(paths)
+    n_val = max(1, int(len(paths) * val_fraction))
+    return paths[n_val:], paths[:n_val]
+
+
+def regression_report(fp32_model: torch.nn.Module, int8_model: torch.nn.Module, images_dir: str,
+                      class_names: List[str], batch_size: int = 1,
+                      paths: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Compare top-1 agreement, per-class agreement, accuracy and latency of int8 vs fp32.
+
+    Scores every image under images_dir unless paths names a subset (e.g. a held-out split).
+    """
+    paths = iter_image_files(images_dir) if paths is None else paths
+    if not paths:
+        raise ValueError(f"No images found in '{images_dir}'.")
+    fp32 = _timed_predictions(fp32_model, load_batches(paths, batch_size))
+    int8 = _timed_predictions(int8_model, load_batches(paths, batch_size))
+
+    per_class: Dict[str, Dict[str, int]] = {name: {"images": 0, "agree": 0} for name in class_names}
+    labels = [label_from_path(p, images_dir, class_names) for p in paths]
+    correct = {"fp32": 0, "int8": 0}
+    labelled = 0
+    for ref, quant, label in zip(fp32["predictions"], int8["predictions"], labels):
+        entry = per_class[class_names[ref]]
+        entry["images"] += 1
+        entry["agree"] += int(ref == quant)
+        if label is not None:
+            labelled += 1
+            correct["fp32"] += int(ref == label)
+            correct["int8"] += int(quant == label)
+
+    agreement = sum(a == b for a, b in zip(fp32["predictions"], int8["predictions"])) / len(paths)
+    return {
+        "images": len(paths),
+        "num_classes": len(class_names),
+        "top1_agreement": round(agreement, 4),
+        "per_class_agreement": {
+            name: round(v["agree"] / v["images"], 4) for name, v in per_class.items() if v["images"]
+        },
+        "accuracy": {
+            "labelled_images": labelled,
+            "fp32": round(correct["fp32"] / labelled, 4) if labelled else None,
+            "int8": round(correct["int8"] / labelled, 4) if labelled else None,
+        },
+        "latency_ms_per_image": {
+            "fp32_mean": round(fp32["mean_ms_per_image"], 3),
+            "int8_mean": round(int8["mean_ms_per_image"], 3),
+            "fp32_p95": round(fp32["p95_ms_per_image"], 3),
+            "int8_p95": round(int8["p95_ms_per_image"], 3),
+            "speedup": round(fp32["mean_ms_per_image"] / int8["mean_ms_per_image"], 2) if int8["mean_ms_per_image"] else None,
+        },
+        "engine": torch.backends.quantized.engine,
+    }
+
+
+def _load_fp32():
+    from model_registry import DEFAULT_CLASSES_PATH, load_class_names, load_model_file
+    from inference import MODEL_PATH
+    class_names = load_class_names(DEFAULT_CLASSES_PATH)
+    return load_model_file(MODEL_PATH, len(class_names)), class_names, MODEL_PATH
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="INT8 quantization tools for the crop-health CNN")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    cal = sub.add_parser("calibrate", help="Calibrate and save a static-int8 model from sample leaf images")
+    cal.add_argument("--images", required=True, help="Folder of sample leaf images (searched recursively)")
+    cal.add_argument("--output", help="Output TorchScript path (default: <weights>_int8.ts)")
+    cal.add_argument("--limit", type=int, default=512, help="Maximum number of calibration images")
+    cal.add_argument("--val-fraction", type=float, default=0.2,
+                     help="Fraction of images held out of calibration for the accuracy gate")
+    cal.add_argument("--seed", type=int, default=0)
+    cal.add_argument("--batch-size", type=int, default=16)
+    cal.add_argument("--min-agreement", type=float, default=0.98, help="Accuracy gate on top-1 agreement with fp32")
+    cal.add_argument("--force", action="store_true", help="Save the model even if the accuracy gate fails")
+
+    rep = sub.add_parser("report", help="Compare an int8 model against fp32")
+    rep.add_argument("--images", required=True)
+    rep.add_argument("--quantized", help="Static-int8 TorchScript model (default: dynamic quantization)")
+    rep.add_argument("--output", help="Write the JSON report to this file")
+    rep.add_argument("--min-agreement", type=float, default=0.98)
+
+    args = parser.parse_args(argv)
+    torch.set_grad_enabled(False)
+    fp32_model, class_names, model_path = _load_fp32()
+
+    if args.command == "calibrate":
+        paths = iter_image_files(args.images)
+        if len(paths) < 2:
+            print(f"❌ Need at least two images in '{args.images}', found {len(paths)}.")
+            return 1
+        calibration_paths, held_out = split_calibration(paths, args.val_fraction, args.seed)
+        calibration_paths = calibration_paths[:args.limit]
+        print(f"📊 Calibrating on {len(calibration_paths)} images, gating on {len(held_out)} held-out images...")
+        int8_model = calibrate(fp32_model, load_batches(calibration_paths, args.batch_size))
+        report = regression_report(fp32_model, int8_model, args.images, class_names, paths=held_out)
+        print(json.dumps(report, indent=2))
+        if report["top1_agreement"] < args.min_agreement and not args.force:
+            print(f"❌ Accuracy gate failed: top-1 agreement {report['top1_agreement']} < {args.min_agreement}. Model not saved.")
+            return 1
+        output = args.output or default_int8_path(model_path)
+        save_static(int8_model, output)
+        print(f"✅ Static int8 model saved to '{output}'.")
+        return 0
+
+    int8_model = load_static(args.quantized) if args.quantized else quantize_dynamic(fp32_model)
+    report = regression_report(fp32_model, int8_model, args.images, class_names)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if report["top1_agreement"] < args.min_agreement:
+        print(f"❌ Accuracy gate failed: top-1 agreement {report['top1_agreement']} < {args.min_agreement}.")
+        return 1
+    print("✅ Accuracy gate passed.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
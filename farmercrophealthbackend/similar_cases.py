@@ -0,0 +1,399 @@
+# similar_cases.py
+"""
+"Past cases that looked like this one": nearest-neighbour search over the
+penultimate CNN embeddings kept by embedding_store.py.
+
+Two index types, both plain NumPy over cosine similarity:
+
+- exact: one normalized float32 matrix and a single matrix-vector product per
+  query. Used up to SIMILAR_CASES_EXACT_MAX vectors, where it stays well
+  below 10 ms.
+- ivfpq: an inverted file (k-means coarse centroids) holding product-quantized
+  codes, SIMILAR_CASES_PQ_M bytes per vector. A query scores the codes in the
+  SIMILAR_CASES_NPROBE closest lists through a lookup table. The best
+  candidates are then re-ranked with their exact vectors from the store.
+  Trained ivfpq indexes are saved next to the store and only catch up on new
+  rows at startup.
+
+The index follows the store: every appended batch is added as it is scored.
+If the served model's trunk changes (a new checkpoint rather than a retrained
+head), the index is rebuilt in the background for the new trunk.
+"""
+
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import embedding_store
+
+# --- Configuration ---
+SIMILAR_CASES_ENABLED = os.getenv("SIMILAR_CASES", "0") == "1"  # Needs EMBEDDING_STORE_DIR
+SIMILAR_CASES_K = int(os.getenv("SIMILAR_CASES_K", "5"))
+SIMILAR_CASES_MODE = os.getenv("SIMILAR_CASES_MODE", "auto")  # auto | exact | ivfpq
+SIMILAR_CASES_EXACT_MAX = int(os.getenv("SIMILAR_CASES_EXACT_MAX", "10000"))  # auto: ivfpq above this
+SIMILAR_CASES_NPROBE = int(os.getenv("SIMILAR_CASES_NPROBE", "16"))
+SIMILAR_CASES_PQ_M = int(os.getenv("SIMILAR_CASES_PQ_M", "64"))  # Sub-quantizers (bytes per vector)
+SIMILAR_CASES_REFINE = int(os.getenv("SIMILAR_CASES_REFINE", "10"))  # Candidates re-ranked per result
+
+BUILD_CHUNK_ROWS = 20000
+TRAIN_SAMPLE_MAX = 50000
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    best = np.argpartition(-scores, k - 1)[:k]
+    return best[np.argsort(-scores[best])]
+
+
+# --- K-Means ---
+def nearest_centroid(data: np.ndarray, centroids: np.ndarray, chunk: int = 8192) -> np.ndarray:
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    assignments = np.empty(len(data), dtype=np.int64)
+    for start in range(0, len(data), chunk):
+        block = data[start:start + chunk]
+        assignments[start:start + chunk] = np.argmin(centroid_norms - 2.0 * block @ centroids.T, axis=1)
+    return assignments
+
+
+def kmeans(data: np.ndarray, k: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Lloyd's k-means; empty clusters are re-seeded with random points."""
+    rng = np.random.default_rng(seed)
+    k = min(k, len(data))
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = nearest_centroid(data, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, data)
+        counts = np.bincount(assignments, minlength=k)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        centroids[empty] = data[rng.choice(len(data), int(empty.sum()))]
+    return centroids
+
+
+# --- Indexes ---
+class ExactIndex:
+    """Normalized float32 vectors in one growing matrix."""
+
+    kind = "exact"
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self._vectors = np.empty((0, dim), dtype=np.float32)
+        self._rows = np.empty(0, dtype=np.int64)
+        self.count = 0
+
+    def add(self, rows: np.ndarray, vectors: np.ndarray):
+        needed = self.count + len(rows)
+        if needed > len(self._rows):
+            capacity = max(needed, 2 * len(self._rows), 1024)
+            grown = np.empty((capacity, self.dim), dtype=np.float32)
+            grown[:self.count] = self._vectors[:self.count]
+            grown_rows = np.empty(capacity, dtype=np.int64)
+            grown_rows[:self.count] = self._rows[:self.count]
+            self._vectors, self._rows = grown, grown_rows
+        self._vectors[self.count:needed] = normalize(vectors)
+        self._rows[self.count:needed] = rows
+        self.count = needed
+
+    def search(self, query: np.ndarray, k: int, exclude_row: Optional[int] = None) -> List[Tuple[int, float]]:
+        scores = self._vectors[:self.count] @ query
+        best = top_k(scores, k + 1)
+        return [(int(self._rows[i]), float(scores[i])) for i in best if self._rows[i] != exclude_row][:k]
+
+    @property
+    def max_row(self) -> int:
+        return int(self._rows[:self.count].max()) if self.count else -1
+
+
+class IVFPQIndex:
+    """Inverted file over k-means centroids with product-quantized codes in each list."""
+
+    kind = "ivfpq"
+
+    def __init__(self, dim: int, nlist: int, m: int = SIMILAR_CASES_PQ_M, nprobe: int = SIMILAR_CASES_NPROBE,
+                 refine: int = SIMILAR_CASES_REFINE):
+        if dim % m:
+            raise ValueError(f"dim {dim} is not divisible by {m} sub-quantizers")
+        self.dim, self.nlist, self.m, self.nprobe, self.refine = dim, nlist, m, nprobe, refine
+        self.sub_dim = dim // m
+        self.centroids: Optional[np.ndarray] = None  # (nlist, dim)
+        self.codebooks: Optional[np.ndarray] = None  # (m, 256, sub_dim)
+        self._codes = [np.empty((0, m), dtype=np.uint8) for _ in range(nlist)]
+        self._rows = [np.empty(0, dtype=np.int64) for _ in range(nlist)]
+        self._sizes = np.zeros(nlist, dtype=np.int64)
+        self.count = 0
+        self.max_row = -1
+
+    def train(self, sample: np.ndarray):
+        sample = normalize(sample)
+        self.nlist = min(self.nlist, len(sample))
+        self.centroids = kmeans(sample, self.nlist)
+        self.nlist = len(self.centroids)
+        self._codes, self._rows = self._codes[:self.nlist], self._rows[:self.nlist]
+        self._sizes = self._sizes[:self.nlist]
+        self.codebooks = np.stack([
+            self._pad_codebook(kmeans(np.ascontiguousarray(sample[:, j * self.sub_dim:(j + 1) * self.sub_dim]), 256, seed=j))
+            for j in range(self.m)
+        ])
+
+    @staticmethod
+    def _pad_codebook(codebook: np.ndarray) -> np.ndarray:
+        """Small training samples give fewer than 256 codewords; repeat the last one."""
+        if len(codebook) < 256:
+            codebook = np.concatenate([codebook, np.repeat(codebook[-1:], 256 - len(codebook), axis=0)])
+        return codebook
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.empty((len(vectors), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            codes[:, j] = nearest_centroid(vectors[:, j * self.sub_dim:(j + 1) * self.sub_dim], self.codebooks[j])
+        return codes
+
+    def add(self, rows: np.ndarray, vectors: np.ndarray):
+        vectors = normalize(vectors)
+        lists = nearest_centroid(vectors, self.centroids)
+        codes = self.encode(vectors)
+        for list_id in np.unique(lists):
+            members = lists == list_id
+            size, added = self._sizes[list_id], int(members.sum())
+            if size + added > len(self._rows[list_id]):
+                capacity = max(size + added, 2 * len(self._rows[list_id]), 64)
+                codes_grown = np.empty((capacity, self.m), dtype=np.uint8)
+                codes_grown[:size] = self._codes[list_id][:size]
+                rows_grown = np.empty(capacity, dtype=np.int64)
+                rows_grown[:size] = self._rows[list_id][:size]
+                self._codes[list_id], self._rows[list_id] = codes_grown, rows_grown
+            self._codes[list_id][size:size + added] = codes[members]
+            self._rows[list_id][size:size + added] = rows[members]
+            self._sizes[list_id] = size + added
+        self.count += len(rows)
+        self.max_row = max(self.max_row, int(rows.max()))
+
+    def candidates(self, query: np.ndarray, count: int) -> np.ndarray:
+        """Store rows of the `count` codes closest to the query in the probed lists."""
+        probe = top_k(self.centroids @ query, self.nprobe)
+        # Squared distance from each query sub-vector to each of the 256 codewords
+        table = ((self.codebooks - query.reshape(self.m, 1, self.sub_dim)) ** 2).sum(axis=2)
+        codes = np.concatenate([self._codes[p][:self._sizes[p]] for p in probe])
+        rows = np.concatenate([self._rows[p][:self._sizes[p]] for p in probe])
+        if not len(rows):
+            return rows
+        distances = table[np.arange(self.m), codes].sum(axis=1)
+        return rows[top_k(-distances, count)]
+
+    def search(self, query: np.ndarray, k: int, exclude_row: Optional[int] = None,
+               store: Optional[embedding_store.EmbeddingStore] = None) -> List[Tuple[int, float]]:
+        rows = self.candidates(query, (k + 1) * self.refine)
+        rows = rows[rows != exclude_row] if exclude_row is not None else rows
+        if not len(rows):
+            return []
+        # Re-rank with the exact vectors; PQ distances only choose the candidates
+        scores = normalize(store.vectors(rows).numpy()) @ query
+        return [(int(rows[i]), float(scores[i])) for i in top_k(scores, k)]
+
+    # --- Persistence ---
+    def save(self, path: str, trunk: str):
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, trunk=np.array(trunk), centroids=self.centroids, codebooks=self.codebooks,
+                 sizes=self._sizes, codes=np.concatenate([c[:s] for c, s in zip(self._codes, self._sizes)]),
+                 rows=np.concatenate([r[:s] for r, s in zip(self._rows, self._sizes)]),
+                 params=np.array([self.m, self.nprobe, self.refine, self.max_row]))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, trunk: str) -> Optional["IVFPQIndex"]:
+        if not os.path.exists(path):
+            return None
+        data = np.load(path)
+        if str(data["trunk"]) != trunk:
+            return None
+        m, nprobe, refine, max_row = (int(v) for v in data["params"])
+        centroids = data["centroids"]
+        index = cls(centroids.shape[1], len(centroids), m, nprobe, refine)
+        index.centroids, index.codebooks = centroids, data["codebooks"]
+        offsets = np.concatenate([[0], np.cumsum(data["sizes"])])
+        for list_id in range(index.nlist):
+            index._codes[list_id] = data["codes"][offsets[list_id]:offsets[list_id + 1]].copy()
+            index._rows[list_id] = data["rows"][offsets[list_id]:offsets[list_id + 1]].copy()
+        index._sizes = data["sizes"].copy()
+        index.count, index.max_row = int(index._sizes.sum()), max_row
+        return index
+
+
+def default_nlist(count: int) -> int:
+    return int(min(4096, max(16, 4 * np.sqrt(count))))
+
+
+# --- Similar-Case Service ---
+class SimilarCases:
+    """Keeps one index in step with the embedding store and answers top-k queries by image_id."""
+
+    def __init__(self, store: embedding_store.EmbeddingStore, mode: str = SIMILAR_CASES_MODE,
+                 exact_max: int = SIMILAR_CASES_EXACT_MAX):
+        if mode not in ("auto", "exact", "ivfpq"):
+            raise ValueError(f"Unknown similar-case index mode '{mode}'")
+        self.store = store
+        self.mode = mode
+        self.exact_max = exact_max
+        self.lock = threading.RLock()
+        self.index = None
+        self.trunk: Optional[str] = None
+        self._building: Optional[str] = None
+        self._built_at: Optional[float] = None
+        self._queries = 0
+        self._query_ms = 0.0
+        store.add_listener(self._on_append)
+
+    def _index_path(self, trunk: str) -> str:
+        return os.path.join(self.store.directory, f"similar_ivfpq_{trunk}.npz")
+
+    def _wants_ivfpq(self, count: int) -> bool:
+        return self.mode == "ivfpq" or (self.mode == "auto" and count > self.exact_max)
+
+    # --- Building ---
+    def build(self, trunk: str):
+        """Build (or load and catch up) the index for `trunk`, then swap it in."""
+        rows = self.store.row_ids(trunk)
+        started = time.perf_counter()
+        if len(rows) and self._wants_ivfpq(len(rows)):
+            index = IVFPQIndex.load(self._index_path(trunk), trunk)
+            if index is None:
+                index = IVFPQIndex(self.store.dim, default_nlist(len(rows)))
+                sample = np.sort(np.random.default_rng(0).choice(rows, min(len(rows), TRAIN_SAMPLE_MAX), replace=False))
+                index.train(self.store.vectors(sample).numpy())
+            rows = rows[rows > index.max_row]
+        else:
+            index = ExactIndex(self.store.dim)
+        for start in range(0, len(rows), BUILD_CHUNK_ROWS):
+            chunk = rows[start:start + BUILD_CHUNK_ROWS]
+            index.add(chunk, self.store.vectors(chunk).numpy())
+
+        with self.lock:
+            # Rows appended while building
+            missed = self.store.row_ids(trunk, after_row=index.max_row)
+            if len(missed):
+                index.add(missed, self.store.vectors(missed).numpy())
+            self.index, self.trunk, self._built_at = index, trunk, time.time()
+            self._building = None
+        if index.kind == "ivfpq":
+            index.save(self._index_path(trunk), trunk)
+        print(f"✅ Similar-case index ({index.kind}) ready: {index.count} cases in {time.perf_counter() - started:.1f}s.")
+
+    def start_background_build(self, trunk: Optional[str] = None):
+        """Build for `trunk` (default: the trunk of the latest stored row) without blocking."""
+        trunk = trunk or self.store.latest_trunk()
+        with self.lock:
+            if trunk is None or self._building == trunk:
+                return
+            self._building = trunk
+
+        def run():
+            try:
+                self.build(trunk)
+            except Exception as e:
+                print(f"❌ Similar-case index build failed: {e}")
+                with self.lock:
+                    self._building = None
+
+        threading.Thread(target=run, name="similar-cases-build", daemon=True).start()
+
+    def _on_append(self, trunk: str, rows: List[int], vectors: np.ndarray):
+        with self.lock:
+            if self.index is not None and trunk == self.trunk:
+                self.index.add(np.array(rows, dtype=np.int64), vectors)
+                if self.index.kind == "exact" and self._wants_ivfpq(self.index.count):
+                    # Outgrew exact search: serve it until the IVF-PQ index is ready
+                    self.start_background_build(trunk)
+                return
+        # First rows of a new trunk (or of an empty store)
+        self.start_background_build(trunk)
+
+    # --- Queries ---
+    def lookup(self, image_id: str, k: int = SIMILAR_CASES_K) -> Optional[List[Dict[str, Any]]]:
+        """The k most similar stored cases to a scored image, or None while the index is not ready."""
+        started = time.perf_counter()
+        with self.lock:
+            index, trunk = self.index, self.trunk
+        if index is None:
+            return None
+        row = self.store.row_of(image_id, trunk)
+        if row is None:
+            return None
+        query = normalize(self.store.vectors([row]).numpy())[0]
+        with self.lock:
+            if index.kind == "ivfpq":
+                hits = index.search(query, k, exclude_row=row, store=self.store)
+            else:
+                hits = index.search(query, k, exclude_row=row)
+        details = self.store.describe([r for r, _ in hits])
+        cases = []
+        for hit_row, similarity in hits:
+            info = details.get(hit_row)
+            if info is None or info["image_id"] == image_id:
+                continue
+            cases.append({
+                "image_id": info["image_id"],
+                "similarity": round(similarity, 4),
+                "label": info["label"] or info["predicted"],
+                "label_source": info["source"] or "model",
+                "predicted": info["predicted"],
+                "confidence": round(info["confidence"], 4),
+                "seen_at": info["created_at"],
+            })
+        with self.lock:
+            self._queries += 1
+            self._query_ms += (time.perf_counter() - started) * 1000.0
+        return cases
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "mode": self.mode,
+                "index": self.index.kind if self.index is not None else None,
+                "cases": self.index.count if self.index is not None else 0,
+                "trunk": self.trunk,
+                "building": self._building,
+                "built_at": self._built_at,
+                "queries": self._queries,
+                "avg_query_ms": round(self._query_ms / self._queries, 3) if self._queries else 0.0,
+            }
+
+
+_service: Optional[SimilarCases] = None
+_service_lock = threading.Lock()
+
+
+def get_service() -> Optional[SimilarCases]:
+    """The process-wide service, or None unless SIMILAR_CASES=1 and the embedding store is enabled."""
+    global _service
+    if not SIMILAR_CASES_ENABLED:
+        return None
+    store = embedding_store.get_store()
+    if store is None:
+        return None
+    with _service_lock:
+        if _service is None:
+            _service = SimilarCases(store)
+            _service.start_background_build()
+        return _service
+
+
+def similar_cases(image_id: Optional[str], k: int = SIMILAR_CASES_K) -> Optional[List[Dict[str, Any]]]:
+    """Top-k similar past cases for a prediction's image_id (None when disabled or not ready)."""
+    service = get_service()
+    if service is None or not image_id or k <= 0:
+        return None
+    return service.lookup(image_id, k)
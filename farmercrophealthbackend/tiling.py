@@ -0,0 +1,192 @@
+# tiling.py
+"""
+Tiled inference for full-field and drone photos.
+
+Squashing a 12MP photo to 224x224 erases small lesions. In tiled mode the
+image is cut into overlapping tiles that go through the CNN at close to
+native resolution, and the per-tile answers are aggregated into one
+diagnosis plus a class/confidence grid.
+
+Memory stays bounded regardless of input size. JPEGs are decoded at a
+reduced DCT scale so the working image is never much larger than
+TILED_MAX_SIDE. Other formats above TILED_MAX_PIXELS are rejected before they
+are decoded. Tiles are cut and normalized lazily, TILED_BATCH_SIZE at a time,
+into one reused input buffer.
+"""
+
+import math
+import os
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List, Tuple
+
+import torch
+from PIL import Image
+
+import inference
+from preprocessing import preprocessor
+
+# --- Configuration ---
+TILED_MAX_SIDE = int(os.getenv("TILED_MAX_SIDE", "2048"))  # Long side of the working image
+TILED_MAX_PIXELS = int(os.getenv("TILED_MAX_PIXELS", str(64 * 1024 * 1024)))  # Non-JPEG decode limit
+TILED_TILE_SIZE = int(os.getenv("TILED_TILE_SIZE", "224"))  # Tile side in working-image pixels
+TILED_OVERLAP = float(os.getenv("TILED_OVERLAP", "0.25"))
+TILED_BATCH_SIZE = int(os.getenv("TILED_BATCH_SIZE", "16"))
+TILED_MIN_CONFIDENCE = float(os.getenv("TILED_MIN_CONFIDENCE", "0.6"))  # Tiles below this are ignored
+TILED_MIN_DISEASE_TILES = int(os.getenv("TILED_MIN_DISEASE_TILES", "2"))
+
+
+def is_healthy(class_name: str) -> bool:
+    return "healthy" in class_name.lower()
+
+
+# --- Decoding ---
+def decode_bounded(image_file, max_side: int = TILED_MAX_SIDE, max_pixels: int = TILED_MAX_PIXELS) -> Image.Image:
+    """Decode to RGB with the long side at most `max_side`, never holding a full-resolution JPEG in memory."""
+    image = Image.open(image_file)
+    width, height = image.size
+    scale = min(1.0, max_side / max(width, height))
+    if image.format == "JPEG":
+        # libjpeg decodes straight to 1/2, 1/4 or 1/8 scale: at most twice the target per side
+        image.draft("RGB", (max(1, int(width * scale)), max(1, int(height * scale))))
+    elif width * height > max_pixels:
+        raise ValueError(f"Image of {width}x{height} pixels exceeds the {max_pixels}-pixel limit for tiled inference.")
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    if max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.BILINEAR)
+    return image
+
+
+def tile_positions(length: int, tile: int, stride: int) -> List[int]:
+    """Tile offsets along one axis; the last tile is flush with the edge."""
+    if length <= tile:
+        return [0]
+    positions = list(range(0, length - tile, stride))
+    positions.append(length - tile)
+    return positions
+
+
+# --- Tiled Prediction ---
+class TiledPredictor:
+    """Cuts an image into overlapping tiles, classifies them in bounded batches and aggregates."""
+
+    def __init__(self, tile_size: int = TILED_TILE_SIZE, overlap: float = TILED_OVERLAP,
+                 batch_size: int = TILED_BATCH_SIZE, max_side: int = TILED_MAX_SIDE,
+                 min_confidence: float = TILED_MIN_CONFIDENCE, min_disease_tiles: int = TILED_MIN_DISEASE_TILES):
+        if not 0 <= overlap < 1:
+            raise ValueError("overlap must be in [0, 1)")
+        self.tile_size = tile_size
+        self.stride = max(1, int(round(tile_size * (1 - overlap))))
+        self.batch_size = batch_size
+        self.max_side = max_side
+        self.min_confidence = min_confidence
+        self.min_disease_tiles = min_disease_tiles
+
+    def _working_image(self, image_file) -> Image.Image:
+        image = decode_bounded(image_file, self.max_side)
+        if min(image.size) < self.tile_size:
+            # Small inputs: upscale so at least one full tile fits
+            scale = self.tile_size / min(image.size)
+            image = image.resize((math.ceil(image.width * scale), math.ceil(image.height * scale)), Image.BILINEAR)
+        return image
+
+    def _tiles(self, image: Image.Image) -> Iterator[Tuple[int, int, Image.Image]]:
+        crop_size = preprocessor.crop_size
+        for row, top in enumerate(tile_positions(image.height, self.tile_size, self.stride)):
+            for col, left in enumerate(tile_positions(image.width, self.tile_size, self.stride)):
+                tile = image.crop((left, top, left + self.tile_size, top + self.tile_size))
+                if self.tile_size != crop_size:
+                    tile = tile.resize((crop_size, crop_size), Image.BILINEAR)
+                yield row, col, tile
+
+    def classify_tiles(self, image: Image.Image) -> Dict[Tuple[int, int], Tuple[str, float]]:
+        """(row, col) -> (class_name, confidence), never holding more than one batch of tiles."""
+        crop_size = preprocessor.crop_size
+        buffer = torch.empty((self.batch_size, 3, crop_size, crop_size), dtype=torch.float32)
+        results = {}
+        pending: List[Tuple[int, int]] = []
+
+        def flush():
+            outputs = inference.classify_batch([buffer[i:i + 1] for i in range(len(pending))])
+            results.update(zip(pending, outputs))
+            pending.clear()
+
+        for row, col, tile in self._tiles(image):
+            preprocessor.normalize(tile, out=buffer[len(pending)])
+            pending.append((row, col))
+            if len(pending) == self.batch_size:
+                flush()
+        if pending:
+            flush()
+        return results
+
+    def aggregate(self, tiles: Dict[Tuple[int, int], Tuple[str, float]]) -> Dict[str, Any]:
+        """
+        A disease found on at least `min_disease_tiles` confident tiles wins over
+        healthy tiles (lesions are local); otherwise the most common confident class.
+        """
+        summary: Dict[str, Dict[str, Any]] = defaultdict(lambda: {"tiles": 0, "max_confidence": 0.0, "sum": 0.0})
+        confident = 0
+        for class_name, confidence in tiles.values():
+            if confidence < self.min_confidence:
+                continue
+            confident += 1
+            entry = summary[class_name]
+            entry["tiles"] += 1
+            entry["sum"] += confidence
+            entry["max_confidence"] = max(entry["max_confidence"], confidence)
+
+        class_summary = {
+            name: {"tiles": v["tiles"], "share": round(v["tiles"] / confident, 4),
+                   "mean_confidence": round(v["sum"] / v["tiles"], 4), "max_confidence": round(v["max_confidence"], 4)}
+            for name, v in sorted(summary.items(), key=lambda item: -item[1]["tiles"])
+        }
+        diseased = {name: v for name, v in class_summary.items()
+                    if not is_healthy(name) and v["tiles"] >= self.min_disease_tiles}
+        if diseased:
+            class_name = max(diseased, key=lambda name: (diseased[name]["tiles"], diseased[name]["max_confidence"]))
+            confidence = diseased[class_name]["max_confidence"]
+        elif class_summary:
+            class_name = next(iter(class_summary))
+            confidence = class_summary[class_name]["mean_confidence"]
+        else:
+            # No tile is confident: fall back to the single most confident tile
+            class_name, confidence = max(tiles.values(), key=lambda result: result[1])
+
+        affected = sum(v["tiles"] for name, v in class_summary.items() if not is_healthy(name))
+        return {
+            "class_name": class_name,
+            "confidence": f"{confidence * 100:.2f}%",
+            "is_healthy": is_healthy(class_name),
+            "confident_tiles": confident,
+            "affected_share": round(affected / confident, 4) if confident else 0.0,
+            "class_summary": class_summary,
+        }
+
+    def predict(self, image_file) -> Dict[str, Any]:
+        image = self._working_image(image_file)
+        tiles = self.classify_tiles(image)
+        rows = 1 + max(row for row, _ in tiles)
+        cols = 1 + max(col for _, col in tiles)
+        grid = [[None] * cols for _ in range(rows)]
+        for (row, col), (class_name, confidence) in tiles.items():
+            grid[row][col] = {"class_name": class_name, "confidence": round(confidence, 4)}
+        return {
+            "diagnosis": self.aggregate(tiles),
+            "grid": grid,
+            "tiles": len(tiles),
+            "tile_size": self.tile_size,
+            "stride": self.stride,
+            "working_size": list(image.size),
+        }
+
+
+tiled_predictor = TiledPredictor()
+
+
+def predict_tiled(image_file) -> Dict[str, Any]:
+    """Tiled diagnosis and per-tile grid for a high-resolution photo."""
+    model, class_names = inference.load_model()
+    if model is None:
+        raise RuntimeError("Model is not loaded. Cannot perform prediction.")
+    return tiled_predictor.predict(image_file)
@@ -0,0 +1,263 @@
+# weights_format.py
+"""
+Memory-mapped weights format for fast cold starts.
+
+`torch.load` unpickles the checkpoint and copies every tensor into freshly
+allocated memory before the first prediction can run. This module writes the
+state_dict in the safetensors layout (8-byte header length, JSON header, raw
+little-endian tensor bytes) and loads it by mapping the file: every parameter
+is a zero-copy view into the mapping, the model is built on the meta device
+and the views are assigned to it directly. Pages are read from disk only when
+the first forward pass touches them and are shared through the page cache by
+every process that serves the same file.
+
+Files written here can be read by the `safetensors` package and vice versa.
+
+Usage:
+    python weights_format.py convert --weights plantvillage_weights_v22.pt
+    python weights_format.py benchmark --weights plantvillage_weights_v22.pt --repeats 5
+"""
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import subprocess
+import sys
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import torch
+
+SAFETENSORS_EXTENSION = ".safetensors"
+
+DTYPES = {
+    torch.float64: "F64",
+    torch.float32: "F32",
+    torch.float16: "F16",
+    torch.bfloat16: "BF16",
+    torch.int64: "I64",
+    torch.int32: "I32",
+    torch.int16: "I16",
+    torch.int8: "I8",
+    torch.uint8: "U8",
+    torch.bool: "BOOL",
+}
+TORCH_DTYPES = {name: dtype for dtype, name in DTYPES.items()}
+# Output-layer biases of crop_cnn.CNN and crop_cnn.StudentCNN, for files without num_classes metadata
+CLASSIFIER_BIASES = ("dense_layers.4.bias", "classifier.1.bias")
+
+
+def default_safetensors_path(model_path: str) -> str:
+    """Where the converted weights for a checkpoint live by default."""
+    return os.path.splitext(model_path)[0] + SAFETENSORS_EXTENSION
+
+
+# --- Writing ---
+def save_state_dict(state_dict: Dict[str, torch.Tensor], path: str, metadata: Optional[Dict[str, str]] = None):
+    """Write a state_dict in the safetensors layout."""
+    # Widest dtypes first keeps every tensor naturally aligned inside the mapping
+    items = sorted(state_dict.items(), key=lambda item: (-item[1].element_size(), item[0]))
+    header: Dict[str, Any] = {"__metadata__": {k: str(v) for k, v in (metadata or {}).items()}}
+    offset = 0
+    for name, tensor in items:
+        if tensor.dtype not in DTYPES:
+            raise ValueError(f"Unsupported dtype {tensor.dtype} for '{name}'")
+        size = tensor.numel() * tensor.element_size()
+        header[name] = {"dtype": DTYPES[tensor.dtype], "shape": list(tensor.shape),
+                        "data_offsets": [offset, offset + size]}
+        offset += size
+
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    header_bytes += b" " * (-len(header_bytes) % 8)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for _, tensor in items:
+            f.write(tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy().tobytes())
+    os.replace(tmp_path, path)
+
+
+# --- Loading ---
+def read_header(path: str) -> Tuple[Dict[str, Any], int]:
+    """Return the JSON header and the byte offset at which tensor data starts."""
+    with open(path, "rb") as f:
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size))
+    return header, 8 + header_size
+
+
+def load_state_dict(path: str) -> Tuple[Dict[str, torch.Tensor], Dict[str, str]]:
+    """
+    Map the file and return (state_dict, metadata). Tensors are zero-copy views
+    of a private copy-on-write mapping that stays open as long as they live.
+    """
+    header, data_start = read_header(path)
+    metadata = header.pop("__metadata__", {})
+    with open(path, "rb") as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    state_dict = {}
+    for name, info in header.items():
+        dtype = TORCH_DTYPES[info["dtype"]]
+        begin, end = info["data_offsets"]
+        count = (end - begin) // torch.empty((), dtype=dtype).element_size()
+        if count == 0:
+            state_dict[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        tensor = torch.frombuffer(mapping, dtype=dtype, count=count, offset=data_start + begin)
+        state_dict[name] = tensor.view(info["shape"])
+    return state_dict, metadata
+
+
+def load_model(path: str, num_classes: Optional[int] = None) -> torch.nn.Module:
+    """
+    Build the model named by the `architecture` metadata (default: crop_cnn.CNN),
+    with the constructor arguments in the `config` metadata, around the mapped
+    tensors without allocating its parameters first. The class count comes from
+    the `num_classes` metadata or the output layer; a caller's num_classes that
+    disagrees with the file raises ValueError.
+    """
+    import crop_cnn
+
+    state_dict, metadata = load_state_dict(path)
+    architecture = getattr(crop_cnn, metadata.get("architecture", "crop_cnn.CNN").rsplit(".", 1)[-1])
+    stored = int(metadata.get("num_classes", 0))
+    if not stored:
+        head = next((state_dict[k] for k in CLASSIFIER_BIASES if k in state_dict), None)
+        stored = head.shape[0] if head is not None else 0
+    if num_classes and stored and num_classes != stored:
+        raise ValueError(f"'{os.path.basename(path)}' has {stored} classes, expected {num_classes}.")
+    num_classes = num_classes or stored
+    # Constructor arguments of model variants, e.g. {"head_rank": 128}
+    config = json.loads(metadata.get("config", "{}"))
+    try:
+        with torch.device("meta"):
+            model = architecture(num_classes=num_classes, **config)
+        model.load_state_dict(state_dict, assign=True)
+    except (AttributeError, TypeError):
+        # torch < 2.1 has no meta-device construction or assign=True: fall back to copying
+        model = architecture(num_classes=num_classes, **config)
+        model.load_state_dict(state_dict)
+    model.eval()
+    return model
+
+
+# --- Conversion ---
+def convert(model_path: str, output: Optional[str] = None, num_classes: Optional[int] = None) -> str:
+    """Convert a state_dict or full-module checkpoint into the memory-mapped format."""
+    from model_registry import DEFAULT_CLASSES_PATH, load_class_names, load_model_file
+
+    num_classes = num_classes or len(load_class_names(DEFAULT_CLASSES_PATH))
+    model = load_model_file(model_path, num_classes)
+    output = output or default_safetensors_path(model_path)
+    save_state_dict(model.state_dict(), output, metadata={
+        "format": "pt",
+        "architecture": "crop_cnn.CNN",
+        "num_classes": num_classes,
+        "source": os.path.basename(model_path),
+    })
+    return output
+
+
+# --- Startup Benchmark ---
+def _memory_kb() -> Dict[str, int]:
+    """Resident memory of this process, split into anonymous and file-backed pages where available."""
+    memory = {}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "RssAnon", "RssFile"):
+                    memory[key] = int(value.split()[0])
+    except OSError:
+        import resource
+        memory["VmRSS"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return memory
+
+
+def _probe(weights: str) -> Dict[str, Any]:
+    """Measure one cold start in this (fresh) process: load, then first prediction."""
+    from model_registry import DEFAULT_CLASSES_PATH, INPUT_SHAPE, load_class_names, load_model_file
+
+    torch.set_grad_enabled(False)
+    baseline = _memory_kb()
+    started = time.perf_counter()
+    model = load_model_file(weights, len(load_class_names(DEFAULT_CLASSES_PATH)))
+    loaded = time.perf_counter()
+    model(torch.zeros((1,) + INPUT_SHAPE))
+    first_prediction = time.perf_counter()
+    memory = _memory_kb()
+    return {
+        "load_ms": round((loaded - started) * 1000.0, 2),
+        "time_to_first_prediction_ms": round((first_prediction - started) * 1000.0, 2),
+        "rss_delta_mb": round((memory["VmRSS"] - baseline["VmRSS"]) / 1024.0, 1),
+        "anon_rss_delta_mb": round((memory.get("RssAnon", 0) - baseline.get("RssAnon", 0)) / 1024.0, 1),
+    }
+
+
+def benchmark(paths, repeats: int = 3) -> Dict[str, Any]:
+    """Cold-start each weights file `repeats` times in fresh interpreters and report the medians."""
+    results = {}
+    for path in paths:
+        runs = []
+        for _ in range(repeats):
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "_probe", "--weights", path],
+                check=True, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+            runs.append(json.loads(output.stdout.strip().splitlines()[-1]))
+        results[os.path.basename(path)] = {
+            key: sorted(run[key] for run in runs)[len(runs) // 2] for key in runs[0]
+        }
+        results[os.path.basename(path)]["file_mb"] = round(os.path.getsize(path) / (1024.0 * 1024.0), 1)
+    return results
+
+
+def main(argv=None):
+    from inference import MODEL_PATH
+
+    parser = argparse.ArgumentParser(description="Memory-mapped weights format for the crop-health CNN")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    conv = sub.add_parser("convert", help="Convert a .pt checkpoint to the memory-mapped format")
+    conv.add_argument("--weights", default=MODEL_PATH, help="PyTorch weights (state_dict or full module)")
+    conv.add_argument("--output", help=f"Output path (default: <weights>{SAFETENSORS_EXTENSION})")
+
+    bench = sub.add_parser("benchmark", help="Compare time-to-first-prediction and RSS of both formats")
+    bench.add_argument("--weights", default=MODEL_PATH)
+    bench.add_argument("--converted", help=f"Converted weights (default: <weights>{SAFETENSORS_EXTENSION})")
+    bench.add_argument("--repeats", type=int, default=3)
+    bench.add_argument("--output", help="Write the JSON results to this file")
+
+    probe = sub.add_parser("_probe")
+    probe.add_argument("--weights", required=True)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "_probe":
+        print(json.dumps(_probe(args.weights)))
+        return 0
+
+    if args.command == "convert":
+        output = convert(args.weights, args.output)
+        print(f"✅ Converted '{os.path.basename(args.weights)}' to '{output}'.")
+        return 0
+
+    converted = args.converted or default_safetensors_path(args.weights)
+    if not os.path.exists(converted):
+        convert(args.weights, converted)
+        print(f"✅ Converted '{os.path.basename(args.weights)}' to '{converted}'.")
+    print(f"⏱️ Cold-starting each format {args.repeats} times...")
+    results = benchmark([args.weights, converted], args.repeats)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,456 @@
+# worker_pool.py
+"""
+Multi-process inference workers that share one copy of the CNN weights.
+
+The server process loads the model once and moves its parameters into shared
+memory (`Module.share_memory`). Worker processes are spawned with the model as
+an argument, so torch hands each of them a read-only mapping of the same
+shared-memory segments instead of a private copy of the weights. Requests
+reach the workers over one multiprocessing queue; each worker micro-batches
+whatever is waiting, and results come back on a second queue. Every worker is
+pinned to its own slice of the CPU cores and uses that many intra-op threads,
+so N workers do not oversubscribe the machine.
+
+The collector thread also watches the workers. If one dies (crash, OOM
+kill), the whole set is replaced: a worker killed while reading a queue can
+leave it unusable. The new workers map the same shared weights, and pending
+requests are re-queued once (a request may be what killed the worker), then
+failed. restart() starts and warms up the new workers first and only then
+drains the old ones, so a bad weights file leaves the current pool serving.
+"""
+
+import datetime
+import itertools
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+from batching import MAX_BATCH_SIZE, MAX_WAIT_MS
+from model_registry import INPUT_SHAPE, load_class_names, load_model_file
+
+# --- Configuration ---
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "0"))  # 0 = run the model in the server process
+INFERENCE_WORKER_THREADS = int(os.getenv("INFERENCE_WORKER_THREADS", "0"))  # 0 = cores / workers
+INFERENCE_WORKER_PINNING = os.getenv("INFERENCE_WORKER_PINNING", "1") == "1"
+WORKER_START_TIMEOUT = float(os.getenv("INFERENCE_WORKER_START_TIMEOUT", "120"))
+WORKER_RESULT_TIMEOUT = float(os.getenv("INFERENCE_WORKER_RESULT_TIMEOUT", "60"))  # Longest a request waits for a worker
+WORKER_HEALTH_CHECK_SECONDS = float(os.getenv("INFERENCE_WORKER_HEALTH_CHECK_SECONDS", "1"))
+WORKER_MAX_RETRIES = 1  # Re-queue a request at most once after its worker died
+
+
+def available_cores() -> List[int]:
+    """CPU cores this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def partition_cores(cores: List[int], num_workers: int) -> List[List[int]]:
+    """Split the cores into `num_workers` contiguous, non-overlapping slices (shared round-robin if too few)."""
+    if num_workers <= len(cores):
+        size, extra = divmod(len(cores), num_workers)
+        slices, start = [], 0
+        for i in range(num_workers):
+            end = start + size + (1 if i < extra else 0)
+            slices.append(cores[start:end])
+            start = end
+        return slices
+    return [[cores[i % len(cores)]] for i in range(num_workers)]
+
+
+# --- Worker Process ---
+def _worker_main(worker_id: int, model: torch.nn.Module, tasks, results, cores: Optional[List[int]],
+                 num_threads: int, max_batch_size: int, max_wait_ms: float):
+    """
+    Entry point of a spawned worker: pin, warm up, then serve micro-batches until a None task arrives.
+    Tasks are (task_id, array, solo); solo tasks were re-queued after a crash and run in a batch of their own.
+    """
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(num_threads)
+    torch.set_num_interop_threads(1)
+    torch.set_grad_enabled(False)
+    model.eval()
+
+    model(torch.zeros((1, *INPUT_SHAPE)))
+    results.put(("ready", worker_id, os.getpid()))
+
+    carried = None
+    while True:
+        first, carried = (carried if carried is not None else tasks.get()), None
+        if first is None:
+            return
+        batch = [first]
+        deadline = time.perf_counter() + max_wait_ms / 1000.0
+        while len(batch) < max_batch_size and not first[2]:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                task = tasks.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if task is None:
+                # Put the sentinel back so it stops this worker after the current batch
+                tasks.put(None)
+                break
+            if task[2]:
+                carried = task
+                break
+            batch.append(task)
+
+        task_ids = [task_id for task_id, _, _ in batch]
+        try:
+            inputs = torch.from_numpy(np.concatenate([array for _, array, _ in batch], axis=0))
+            probabilities = torch.nn.functional.softmax(model(inputs), dim=1)
+            confidences, indices = torch.max(probabilities, 1)
+            results.put(("done", worker_id, list(zip(task_ids, indices.tolist(), confidences.tolist()))))
+        except Exception as e:
+            results.put(("failed", worker_id, (task_ids, str(e))))
+
+
+# --- Pool ---
+class _Generation:
+    """One set of worker processes serving one weights file: its queues, processes and pending requests."""
+
+    def __init__(self, model_path: str, class_names: List[str], model: torch.nn.Module, model_mtime: float, context):
+        self.model_path = model_path
+        self.class_names = class_names
+        self.model = model
+        self.model_mtime = model_mtime
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        self.processes: Dict[int, Any] = {}
+        self.worker_pids: Dict[int, int] = {}
+        # task_id -> [future, input array, retries]; the input is kept so it can be re-queued
+        self.pending: Dict[int, list] = {}
+        self.collector = None
+        self.closing = False
+        self.crashed = False
+
+
+class WorkerPool:
+    """
+    A pool of spawned inference processes serving one shared-memory model.
+
+    `run(tensor)` takes a preprocessed (1, 3, 224, 224) tensor and returns
+    (class_index, confidence); `predict(tensor)` maps the index to the class
+    name. Calls are thread-safe and may come from many Flask threads at once.
+    """
+
+    def __init__(self, model_path: str, classes_path: str, num_workers: int = INFERENCE_WORKERS,
+                 threads_per_worker: int = INFERENCE_WORKER_THREADS, pin_cores: bool = INFERENCE_WORKER_PINNING,
+                 max_batch_size: int = MAX_BATCH_SIZE, max_wait_ms: float = MAX_WAIT_MS):
+        if num_workers < 1:
+            raise ValueError("num_workers must be at least 1")
+        _check_shareable(model_path)
+        self.model_path = model_path
+        self.classes_path = classes_path
+        self.num_workers = num_workers
+        self.pin_cores = pin_cores
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.core_slices = partition_cores(available_cores(), num_workers)
+        self.threads_per_worker = threads_per_worker or max(1, min(len(s) for s in self.core_slices))
+
+        self._context = mp.get_context("spawn")
+        self._lock = threading.Lock()  # Guards the current generation and pending requests
+        self._lifecycle_lock = threading.Lock()  # Serializes start, restart, healing and shutdown
+        self._task_ids = itertools.count()
+        self._generation: Optional[_Generation] = None
+        self._started = threading.Event()
+        self._completed = 0
+        self._failed = 0
+        self._retried = 0
+        self._replacements = 0
+        self.class_names: List[str] = []
+        self.model_mtime = 0.0
+        self.started_at = None
+        self.error: Optional[str] = None
+
+    # --- Lifecycle ---
+    def start(self):
+        """Load the weights into shared memory once and spawn the workers."""
+        with self._lifecycle_lock:
+            if self._generation is not None:
+                return
+            self._install(self._launch(self.model_path))
+
+    def start_background(self) -> threading.Thread:
+        """Start the workers without blocking the server; failures are reported by readiness()."""
+        def target():
+            try:
+                self.start()
+                self.error = None
+            except Exception as e:
+                self.error = str(e)
+                print(f"❌ Failed to start inference workers: {e}")
+
+        thread = threading.Thread(target=target, name="crop-health-worker-start", daemon=True)
+        thread.start()
+        return thread
+
+    def _launch(self, model_path: str, previous: Optional[_Generation] = None) -> _Generation:
+        """Spawn and warm up a new generation; `previous` lends its already shared model instead of a new load."""
+        started = time.perf_counter()
+        if previous is not None:
+            class_names, model, model_mtime = previous.class_names, previous.model, previous.model_mtime
+        else:
+            _check_shareable(model_path)
+            class_names = load_class_names(self.classes_path)
+            model = load_model_file(model_path, len(class_names))
+            model_mtime = os.path.getmtime(model_path)
+            for parameter in model.parameters():
+                parameter.requires_grad_(False)
+            model.share_memory()
+
+        generation = _Generation(model_path, class_names, model, model_mtime, self._context)
+        for worker_id in range(self.num_workers):
+            self._spawn(generation, worker_id)
+        try:
+            self._wait_until_ready(generation)
+        except Exception:
+            self._terminate(generation)
+            raise
+        generation.collector = threading.Thread(target=self._collect, args=(generation,),
+                                                name="crop-health-worker-results", daemon=True)
+        generation.collector.start()
+        print(f"✅ {self.num_workers} inference workers ready with shared weights "
+              f"({self.threads_per_worker} threads each) in {(time.perf_counter() - started) * 1000.0:.0f} ms")
+        return generation
+
+    def _spawn(self, generation: _Generation, worker_id: int):
+        cores = self.core_slices[worker_id] if self.pin_cores else None
+        process = self._context.Process(
+            target=_worker_main, name=f"crop-health-worker-{worker_id}", daemon=True,
+            args=(worker_id, generation.model, generation.tasks, generation.results, cores,
+                  self.threads_per_worker, self.max_batch_size, self.max_wait_ms))
+        process.start()
+        generation.processes[worker_id] = process
+
+    def _wait_until_ready(self, generation: _Generation):
+        deadline = time.monotonic() + WORKER_START_TIMEOUT
+        while len(generation.worker_pids) < self.num_workers:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Inference workers did not start within {WORKER_START_TIMEOUT:.0f}s")
+            try:
+                kind, worker_id, pid = generation.results.get(timeout=WORKER_HEALTH_CHECK_SECONDS)
+            except queue.Empty:
+                dead = [worker_id for worker_id, process in generation.processes.items() if not process.is_alive()]
+                if dead:
+                    raise RuntimeError(f"Inference workers {dead} exited during start-up")
+                continue
+            if kind == "ready":
+                generation.worker_pids[worker_id] = pid
+
+    def _install(self, generation: _Generation) -> Optional[_Generation]:
+        """Make `generation` the one new requests go to; returns the one it replaces."""
+        with self._lock:
+            previous, self._generation = self._generation, generation
+        self.model_path = generation.model_path
+        self.class_names = generation.class_names
+        self.model_mtime = generation.model_mtime
+        self.started_at = datetime.datetime.utcnow().isoformat()
+        self._started.set()
+        return previous
+
+    def _retire(self, generation: _Generation, successor: Optional[_Generation] = None, drain: bool = True,
+                timeout: float = 5.0, error: str = "Inference workers were shut down."):
+        """
+        Stop a generation. With `drain`, its workers first finish what is queued.
+        Requests still pending afterwards move to `successor` (once) or fail.
+        """
+        generation.closing = True
+        if drain:
+            for _ in generation.processes:
+                generation.tasks.put(None)
+            for process in generation.processes.values():
+                process.join(timeout=timeout)
+        self._terminate(generation)
+        generation.results.put(None)
+        if generation.collector is not None:
+            generation.collector.join(timeout=timeout)
+        with self._lock:
+            leftovers, generation.pending = generation.pending, {}
+        self._requeue(leftovers, successor, error)
+
+    def shutdown(self, timeout: float = 5.0):
+        """Stop the workers after they finish queued requests."""
+        with self._lifecycle_lock:
+            with self._lock:
+                generation, self._generation = self._generation, None
+            self._started.clear()
+            if generation is not None:
+                self._retire(generation, timeout=timeout)
+
+    def restart(self, model_path: Optional[str] = None):
+        """
+        Replace the workers with new ones serving `model_path` (or the current file,
+        re-read). The new workers are warmed up before they take requests; if they
+        fail to start, the error is raised and the current workers keep serving.
+        """
+        with self._lifecycle_lock:
+            successor = self._launch(model_path or self.model_path)
+            previous = self._install(successor)
+            if previous is not None:
+                self._retire(previous, successor)
+
+    def _heal(self, generation: _Generation):
+        """Replace a generation that lost a worker, reusing its shared weights."""
+        with self._lifecycle_lock:
+            if self._generation is not generation:
+                return # Restarted or shut down meanwhile
+            exit_codes = {worker_id: process.exitcode for worker_id, process in generation.processes.items()
+                          if not process.is_alive()}
+            print(f"❌ Inference workers died {exit_codes}; replacing the workers")
+            try:
+                successor = self._launch(generation.model_path, previous=generation)
+            except Exception as e:
+                self.error = str(e)
+                print(f"❌ Could not replace the inference workers: {e}")
+                with self._lock:
+                    self._generation = None
+                self._started.clear()
+                self._retire(generation, drain=False, error=f"Inference workers died and could not be replaced: {e}")
+                return
+            self._install(successor)
+            self._replacements += 1
+            self._retire(generation, successor, drain=False, error="Inference worker died while serving this request.")
+
+    def _terminate(self, generation: _Generation):
+        for process in generation.processes.values():
+            if process.is_alive():
+                process.terminate()
+
+    # --- Requests ---
+    def submit(self, image_tensor: torch.Tensor) -> Future:
+        """Queue a preprocessed (1, 3, 224, 224) tensor and return a future for (class_index, confidence)."""
+        if not self._started.is_set():
+            self.start()
+        future: Future = Future()
+        task_id = next(self._task_ids)
+        # Plain numpy pickles straight through the pipe; no per-request shared-memory segments
+        array = image_tensor.detach().contiguous().numpy()
+        with self._lock:
+            generation = self._generation
+            if generation is None:
+                raise RuntimeError("Inference workers are not running.")
+            generation.pending[task_id] = [future, array, 0]
+            generation.tasks.put((task_id, array, False))
+        return future
+
+    def run(self, image_tensor: torch.Tensor, timeout: float = WORKER_RESULT_TIMEOUT) -> Tuple[int, float]:
+        return self.submit(image_tensor).result(timeout=timeout)
+
+    def predict(self, image_tensor: torch.Tensor, timeout: float = WORKER_RESULT_TIMEOUT) -> Tuple[str, float]:
+        index, confidence = self.run(image_tensor, timeout=timeout)
+        return self.class_names[index], confidence
+
+    def _collect(self, generation: _Generation):
+        """Resolve futures from worker results and watch the workers until the generation is retired."""
+        checked_at = time.monotonic()
+        while True:
+            try:
+                message = generation.results.get(timeout=WORKER_HEALTH_CHECK_SECONDS)
+            except queue.Empty:
+                message = ()
+            if message is None:
+                return
+            if message:
+                self._handle(generation, message)
+            if time.monotonic() - checked_at >= WORKER_HEALTH_CHECK_SECONDS:
+                checked_at = time.monotonic()
+                if not generation.closing and not generation.crashed and not all(
+                        process.is_alive() for process in generation.processes.values()):
+                    generation.crashed = True
+                    threading.Thread(target=self._heal, args=(generation,), name="crop-health-worker-heal",
+                                     daemon=True).start()
+
+    def _handle(self, generation: _Generation, message):
+        kind, worker_id, payload = message
+        if kind == "done":
+            for task_id, index, confidence in payload:
+                future = self._pop(generation, task_id)
+                if future is not None:
+                    future.set_result((index, confidence))
+            with self._lock:
+                self._completed += len(payload)
+        elif kind == "failed":
+            task_ids, error = payload
+            for task_id in task_ids:
+                future = self._pop(generation, task_id)
+                if future is not None:
+                    future.set_exception(RuntimeError(f"Inference worker failed: {error}"))
+            with self._lock:
+                self._failed += len(task_ids)
+
+    def _pop(self, generation: _Generation, task_id: int) -> Optional[Future]:
+        with self._lock:
+            task = generation.pending.pop(task_id, None)
+        return task[0] if task is not None else None
+
+    def _requeue(self, tasks: Dict[int, list], successor: Optional[_Generation], error: str):
+        """
+        Move requests to `successor`, each at most WORKER_MAX_RETRIES times; fail the rest.
+        Moved requests run alone, so a request that kills its worker does not take others down again.
+        """
+        failed = []
+        with self._lock:
+            for task_id, task in tasks.items():
+                future, array, retries = task
+                if successor is not None and not successor.closing and retries < WORKER_MAX_RETRIES:
+                    successor.pending[task_id] = [future, array, retries + 1]
+                    successor.tasks.put((task_id, array, True))
+                    self._retried += 1
+                else:
+                    failed.append(future)
+            self._failed += len(failed)
+        for future in failed:
+            future.set_exception(RuntimeError(error))
+
+    def fingerprint(self) -> str:
+        """Same shape as ModelRegistry.fingerprint: workers always serve the fp32 torch weights."""
+        if not self._started.is_set():
+            return "unloaded"
+        return f"{os.path.basename(self.model_path)}@{int(self.model_mtime)}:torch:off"
+
+    def readiness(self) -> Dict[str, Any]:
+        return {
+            "ready": self._started.is_set(),
+            "model_path": self.model_path,
+            "backend": "torch",
+            "quantization": "off",
+            "error": self.error,
+            "workers": self.stats(),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            generation = self._generation
+            processes = generation.processes.values() if generation else []
+            return {
+                "workers": self.num_workers,
+                "alive": sum(1 for process in processes if process.is_alive()),
+                "worker_pids": dict(generation.worker_pids) if generation else {},
+                "threads_per_worker": self.threads_per_worker,
+                "core_slices": self.core_slices if self.pin_cores else None,
+                "pending": len(generation.pending) if generation else 0,
+                "completed": self._completed,
+                "failed": self._failed,
+                "retried": self._retried,
+                "replacements": self._replacements,
+                "model_path": self.model_path,
+                "started_at": self.started_at,
+            }
+
+
+def _check_shareable(model_path: str):
+    if model_path.endswith(".ts"):
+        raise ValueError("The worker pool shares eager PyTorch checkpoints; TorchScript files cannot be shared.")
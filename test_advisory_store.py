@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the versioned advisory store
+"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'farmercrophealthbackend'))
+
+from advisory_store import AdvisoryStore
+
+CLASS = "Tomato___Early_blight"
+PLAN = {"title": "Treatment for Early blight on Tomato", "steps": ["Remove infected leaves."]}
+
+def new_store(**kwargs):
+    return AdvisoryStore(os.path.join(tempfile.mkdtemp(), "advisories.db"), poll_seconds=0, **kwargs)
+
+def test_only_complete_versions_are_served():
+    """A version is served once it is complete, and replaces the previous one"""
+    store = new_store()
+    first = store.begin_version({})
+    store.put(first, CLASS, "advisory", PLAN)
+    assert store.get(CLASS, "advisory") is None
+    store.complete_version(first, entries=1, failures=0)
+    assert store.get(CLASS, "advisory") == PLAN
+
+    second = store.begin_version({})
+    store.put(second, CLASS, "advisory", {**PLAN, "steps": ["Spray copper fungicide."]})
+    assert store.get(CLASS, "advisory") == PLAN
+    store.complete_version(second, entries=1, failures=0)
+    assert store.get(CLASS, "advisory")["steps"] == ["Spray copper fungicide."]
+    assert store.stats()["version"] == second
+
+def test_location_and_language_fallback():
+    """Lookups try the exact location and language, then the default language, then the generic entry"""
+    store = new_store()
+    version = store.begin_version({})
+    store.put(version, CLASS, "agentic_advisor", {"plan": "telangana-hi"}, location="Telangana", language="hi")
+    store.put(version, CLASS, "agentic_advisor", {"plan": "telangana-en"}, location="Telangana", language="en")
+    store.put(version, CLASS, "agentic_community", {"tips": "generic"})
+    store.complete_version(version, entries=3, failures=0)
+    assert store.get(CLASS, "agentic_advisor", " telangana ", "hi-IN,hi;q=0.9") == {"plan": "telangana-hi"}
+    assert store.get(CLASS, "agentic_advisor", "Telangana", "ta-IN") == {"plan": "telangana-en"}
+    assert store.get(CLASS, "agentic_advisor", "Punjab", "en-US") is None
+    assert store.get(CLASS, "agentic_community", "Punjab", "en-US") == {"tips": "generic"}
+
+def test_hits_are_copies():
+    """Callers may add per-request fields without changing the stored advisory"""
+    store = new_store()
+    version = store.begin_version({})
+    store.put(version, CLASS, "advisory", PLAN)
+    store.complete_version(version, entries=1, failures=0)
+    store.get(CLASS, "advisory")["steps"].append("mutated")
+    assert store.get(CLASS, "advisory") == PLAN
+
+def test_pinning_and_pruning():
+    """A pinned version is served and survives pruning; older versions are deleted"""
+    db_path = os.path.join(tempfile.mkdtemp(), "advisories.db")
+    store = AdvisoryStore(db_path, poll_seconds=0)
+    versions = []
+    for i in range(4):
+        version = store.begin_version({})
+        store.put(version, CLASS, "advisory", {"run": i})
+        store.complete_version(version, entries=1, failures=0)
+        versions.append(version)
+    pinned = AdvisoryStore(db_path, version=versions[0], poll_seconds=0)
+    assert pinned.get(CLASS, "advisory") == {"run": 0}
+    assert pinned.prune(keep=2) == 1
+    assert pinned.get(CLASS, "advisory") == {"run": 0}
+    assert store.get(CLASS, "advisory") == {"run": 3}
+    assert AdvisoryStore(db_path, version=versions[1], poll_seconds=0).get(CLASS, "advisory") is None
+
+def main():
+    print("🧪 Testing the advisory store...")
+    test_only_complete_versions_are_served()
+    print("✅ Only complete versions are served, newest first")
+    test_location_and_language_fallback()
+    print("✅ Location and language fall back to defaults")
+    test_hits_are_copies()
+    print("✅ Hits are copies")
+    test_pinning_and_pruning()
+    print("✅ Pinned versions are served and kept when pruning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the inference micro-batcher
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'farmercrophealthbackend'))
+
+from batching import MicroBatcher
+
+def test_max_batch_size():
+    """Batches never exceed max_batch_size, and every item gets its own result"""
+    sizes = []
+    def run_batch(items):
+        sizes.append(len(items))
+        return [item * 10 for item in items]
+    batcher = MicroBatcher(run_batch, max_batch_size=4, max_wait_ms=200)
+    try:
+        futures = [batcher.submit(i) for i in range(10)]
+        assert [future.result(timeout=5) for future in futures] == [i * 10 for i in range(10)]
+    finally:
+        batcher.shutdown()
+    assert max(sizes) <= 4 and sum(sizes) == 10 and sizes[0] == 4
+    assert batcher.stats()["batches"] == len(sizes)
+
+def test_max_wait():
+    """A lone request runs once max_wait_ms has passed, without waiting for a full batch"""
+    sizes = []
+    def run_batch(items):
+        sizes.append(len(items))
+        return items
+    batcher = MicroBatcher(run_batch, max_batch_size=64, max_wait_ms=50)
+    try:
+        started = time.perf_counter()
+        assert batcher.run("leaf", timeout=5) == "leaf"
+        elapsed = time.perf_counter() - started
+    finally:
+        batcher.shutdown()
+    assert sizes == [1]
+    assert 0.04 <= elapsed < 1.0, elapsed
+
+def test_error_reaches_every_waiter():
+    """A failing batch fails every request in it, and the batcher keeps serving afterwards"""
+    calls = []
+    def run_batch(items):
+        calls.append(list(items))
+        if len(calls) == 1:
+            raise ValueError("model exploded")
+        if len(calls) == 2:
+            return items[:-1] # One result short
+        return items
+    batcher = MicroBatcher(run_batch, max_batch_size=3, max_wait_ms=200)
+    try:
+        for expected in (ValueError, RuntimeError):
+            futures = [batcher.submit(i) for i in range(3)]
+            for future in futures:
+                try:
+                    future.result(timeout=5)
+                    raise AssertionError("the batch should have failed")
+                except expected:
+                    pass
+        assert batcher.run("after", timeout=5) == "after"
+    finally:
+        batcher.shutdown()
+    assert batcher.stats()["failed_batches"] == 2
+
+def main():
+    print("🧪 Testing the micro-batcher...")
+    test_max_batch_size()
+    print("✅ Batches respect max_batch_size")
+    test_max_wait()
+    print("✅ A partial batch runs after max_wait_ms")
+    test_error_reaches_every_waiter()
+    print("✅ A failed batch fails every waiter and the batcher recovers")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the confidence-gated student/teacher cascade
+"""
+
+import math
+import os
+import random
+import sys
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'farmercrophealthbackend'))
+
+from cascade import ModelCascade, _top1, threshold_report
+
+CLASS_NAMES = ["Tomato___healthy", "Tomato___Early_blight"]
+
+class StaticRegistry:
+    """Stands in for a model registry that already holds its model"""
+    def __init__(self, model):
+        self.model = model
+
+    def get(self):
+        return self.model, CLASS_NAMES
+
+def build_cascade(threshold=0.9, audit_rate=0.0):
+    # The batch holds logits: the student returns them as they are, the teacher always answers the other class
+    student = StaticRegistry(lambda batch: batch)
+    teacher = StaticRegistry(lambda batch: batch.flip(1))
+    return ModelCascade(student, teacher, threshold=threshold, audit_rate=audit_rate, log_path=None)
+
+def test_gate_routes_at_threshold():
+    """Confidence equal to the threshold stays with the student; anything below goes to the teacher"""
+    batch = torch.tensor([[3.0, 0.0], [0.0, 0.2]])
+    _, confidences = _top1(lambda b: b, batch)
+    cascade = build_cascade(threshold=confidences[0])
+    results = cascade.run(batch)
+    assert results[0] == (CLASS_NAMES[0], confidences[0], "student")
+    assert results[1][0] == CLASS_NAMES[0] and results[1][2] == "teacher"
+
+    cascade = build_cascade(threshold=math.nextafter(confidences[0], 1.0))
+    assert [stage for _, _, stage in cascade.run(batch)] == ["teacher", "teacher"]
+    stats = cascade.stats()
+    assert stats["escalated"] == 2 and stats["escalation_rate"] == 1.0 and stats["student_teacher_agreement"] == 0.0
+
+def test_audit_sample_rate():
+    """About audit_rate of the confident answers are re-checked by the teacher, without changing them"""
+    batch = torch.tensor([[5.0, 0.0]]).repeat(4000, 1)
+    random.seed(0)
+    cascade = build_cascade(audit_rate=0.25)
+    results = cascade.run(batch)
+    assert all(stage == "student" for _, _, stage in results)
+    stats = cascade.stats()
+    assert stats["escalated"] == 0 and 0.22 < stats["audited"] / 4000 < 0.28
+    none_audited = build_cascade(audit_rate=0.0)
+    none_audited.run(batch[:100])
+    assert none_audited.stats()["audited"] == 0 and none_audited.stats()["student_teacher_agreement"] is None
+
+def test_threshold_report():
+    """Each threshold row reports the escalation rate and the agreement on the images the student keeps"""
+    records = [
+        {"student_class": "A", "student_confidence": 0.95, "teacher_class": "A"},
+        {"student_class": "A", "student_confidence": 0.92, "teacher_class": "B"},
+        {"student_class": "B", "student_confidence": 0.85},
+        {"student_class": "B", "student_confidence": 0.60, "teacher_class": "B"},
+    ]
+    report = threshold_report(records, thresholds=(0.5, 0.9, 0.99))
+    assert report["images"] == 4
+    assert report["thresholds"]["0.50"] == {"escalation_rate": 0.0, "kept_agreement": 0.6667, "compared": 3}
+    assert report["thresholds"]["0.90"] == {"escalation_rate": 0.5, "kept_agreement": 0.5, "compared": 2}
+    assert report["thresholds"]["0.99"] == {"escalation_rate": 1.0, "kept_agreement": None, "compared": 0}
+    assert threshold_report([], thresholds=(0.9,))["thresholds"]["0.90"]["escalation_rate"] is None
+
+def main():
+    print("🧪 Testing the model cascade...")
+    test_gate_routes_at_threshold()
+    print("✅ The confidence gate routes images at the threshold")
+    test_audit_sample_rate()
+    print("✅ Confident answers are audited at the configured rate")
+    test_threshold_report()
+    print("✅ The threshold report computes escalation and agreement")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the embedding store and head-only retraining
+"""
+
+import os
+import sys
+import tempfile
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'farmercrophealthbackend'))
+
+from crop_cnn import CNN
+from embedding_store import EmbeddingStore, forward_with_embeddings, supports_embeddings, trunk_fingerprint
+from head_retrain import refit_head
+from quantization import calibrate, load_static, quantize_dynamic, save_static
+
+def build_model():
+    torch.manual_seed(0)
+    return CNN(num_classes=38).eval()
+
+def test_split_forward_matches_model():
+    """Penultimate activations plus the final layer reproduce the model's logits"""
+    model = build_model()
+    inputs = torch.randn(2, 3, 224, 224)
+    with torch.no_grad():
+        features, logits = forward_with_embeddings(model, inputs)
+        assert features.shape == (2, 1024)
+        assert torch.allclose(logits, model(inputs), atol=1e-5)
+
+def test_trunk_ignores_head():
+    """A retrained head keeps the trunk fingerprint; a changed conv layer does not"""
+    model, other = build_model(), build_model()
+    torch.nn.init.zeros_(other.dense_layers[-1].weight)
+    assert trunk_fingerprint(model) == trunk_fingerprint(other)
+    third = build_model()
+    with torch.no_grad():
+        third.conv_layers[0].weight.add_(1.0)
+    assert trunk_fingerprint(third) != trunk_fingerprint(model)
+
+def test_quantized_models_store_nothing():
+    """Dynamic and static int8 models would store activations under a trunk head_retrain.py never sees"""
+    model = build_model()
+    assert supports_embeddings(model)
+    assert not supports_embeddings(quantize_dynamic(model))
+    # The static-int8 artifact is TorchScript: it keeps conv_layers, but its int8 stack needs its QuantStub
+    path = os.path.join(tempfile.mkdtemp(), "weights_int8.ts")
+    save_static(calibrate(model, [torch.randn(2, 3, 224, 224)]), path)
+    assert not supports_embeddings(load_static(path))
+
+def test_store_round_trip():
+    """Rows survive growth and reopening, duplicates are skipped, labels join the rows"""
+    directory = tempfile.mkdtemp()
+    store = EmbeddingStore(directory, dim=8, grow_rows=4)
+    vectors = torch.randn(6, 8)
+    added = store.append([f"img{i}" for i in range(6)], "trunk", vectors, [("A", 0.9)] * 6)
+    assert added == 6
+    assert store.append(["img0", "img6"], "trunk", vectors[:2], [("A", 0.9)] * 2) == 1
+    store.add_label("img2", "B", rating=2, source="corrected")
+    store.flush()
+
+    reopened = EmbeddingStore(directory, dim=8, grow_rows=4)
+    rows = reopened.rows("trunk")
+    assert len(rows) == 7
+    assert [r["label"] for r in rows if r["label"]] == ["B"]
+    assert torch.allclose(reopened.vectors([0, 5]), vectors[[0, 5]], atol=1e-2)
+    assert reopened.predicted_class("img6") == "A"
+
+def test_refit_learns_corrections():
+    """The refit head follows corrected labels and keeps its other predictions"""
+    torch.manual_seed(0)
+    head = torch.nn.Linear(16, 3)
+    features = torch.randn(200, 16)
+    original = head(features).argmax(dim=1).detach()
+    corrected = features[original == 0][:30]
+    targets = torch.full((corrected.shape[0],), 1)
+    replay = features[original != 0]
+    new_head = refit_head(head, corrected, targets, replay, epochs=50, lr=1e-2)
+    with torch.no_grad():
+        assert (new_head(corrected).argmax(dim=1) == 1).float().mean() > 0.9
+        assert (new_head(replay).argmax(dim=1) == original[original != 0]).float().mean() > 0.9
+
+def main():
+    print("🧪 Testing embedding store and head retraining...")
+    test_split_forward_matches_model()
+    print("✅ Split forward pass matches the model")
+    test_trunk_ignores_head()
+    print("✅ Trunk fingerprint ignores the final layer")
+    test_quantized_models_store_nothing()
+    print("✅ Quantized models store no embeddings")
+    test_store_round_trip()
+    print("✅ Store rows survive growth and reopening")
+    test_refit_learns_corrections()
+    print("✅ Refit head learns corrections without forgetting")
+
+if __name__ == "__main__":
+    main()
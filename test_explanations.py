@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Test script to verify batched Grad-CAM explanations
+"""
+
+import base64
+import os
+import sys
+import tempfile
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'farmercrophealthbackend'))
+
+from crop_cnn import CNN
+from explanations import encode, forward_with_cam, supports_explanations
+from quantization import calibrate, load_static, quantize_dynamic, save_static
+
+def build_model():
+    torch.manual_seed(0)
+    return CNN(num_classes=38).eval()
+
+def test_logits_match_model():
+    """The explained pass returns the same logits as a plain forward pass"""
+    model = build_model()
+    inputs = torch.randn(3, 3, 224, 224)
+    with torch.no_grad():
+        expected = model(inputs)
+        features, logits, cams = forward_with_cam(model, inputs)
+    assert features.shape == (3, 1024)
+    assert torch.allclose(logits, expected, atol=1e-5)
+    assert cams.shape == (3, 14, 14)
+
+def test_batched_matches_single():
+    """Each image's heatmap in a batch equals the heatmap computed on its own"""
+    model = build_model()
+    inputs = torch.randn(4, 3, 224, 224)
+    _, _, batched = forward_with_cam(model, inputs)
+    for i in range(4):
+        _, _, single = forward_with_cam(model, inputs[i:i + 1])
+        assert torch.allclose(batched[i], single[0], atol=1e-4)
+    assert batched.min() >= 0 and batched.amax(dim=(1, 2)).allclose(torch.ones(4))
+
+def test_encoding():
+    """A heatmap encodes to a rounded array and a PNG data URI"""
+    _, _, cams = forward_with_cam(build_model(), torch.randn(1, 3, 224, 224))
+    explanation = encode(cams[0], "Tomato___Early_blight")
+    assert len(explanation["heatmap"]) == 14 and len(explanation["heatmap"][0]) == 14
+    assert explanation["png"].startswith("data:image/png;base64,")
+    png = base64.b64decode(explanation["png"].split(",", 1)[1])
+    assert png[:8] == b"\x89PNG\r\n\x1a\n"
+
+def test_quantized_models_not_explained():
+    """Dynamic and static int8 CNNs have no backward, so they take the plain cached path"""
+    model = build_model()
+    assert supports_explanations(model)
+    assert not supports_explanations(quantize_dynamic(model))
+    path = os.path.join(tempfile.mkdtemp(), "weights_int8.ts")
+    save_static(calibrate(model, [torch.randn(2, 3, 224, 224)]), path)
+    assert not supports_explanations(load_static(path))
+
+def main():
+    print("🧪 Testing Grad-CAM explanations...")
+    test_logits_match_model()
+    print("✅ Explained pass reproduces the model's logits")
+    test_batched_matches_single()
+    print("✅ Batched heatmaps match per-image heatmaps")
+    test_encoding()
+    print("✅ Heatmaps encode to an array and a PNG")
+    test_quantized_models_not_explained()
+    print("✅ Quantized models are not explained")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the BatchNorm-folded, channels_last CNN matches the original
+"""
+
+import os
+import sys
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'farmercrophealthbackend'))
+
+from crop_cnn import CNN
+from graph_optimization import benchmark, check_parity, fold_batchnorms, freeze
+
+def build_model(negative_scales=False):
+    """Build a CNN whose BatchNorms have non-trivial running statistics"""
+    torch.manual_seed(0)
+    model = CNN(num_classes=38)
+    for module in model.modules():
+        if isinstance(module, torch.nn.BatchNorm2d):
+            channels = module.num_features
+            module.running_mean.uniform_(-0.5, 0.5)
+            module.running_var.uniform_(0.5, 2.0)
+            module.weight.data.uniform_(0.5, 1.5)
+            module.bias.data.uniform_(-0.5, 0.5)
+            if negative_scales:
+                module.weight.data[:channels // 4] *= -1
+    return model.eval()
+
+def test_folded_model_parity():
+    """Every BatchNorm is folded and the logits are unchanged"""
+    model = build_model()
+    folded, stats = fold_batchnorms(model)
+    assert stats == {"folded_into_conv": 9, "folded_into_dense": 1, "kept": 0}, stats
+    for batch_size, result in check_parity(model, folded).items():
+        assert result["allclose"] and result["top1_match"], (batch_size, result)
+
+def test_negative_scales_are_kept_before_maxpool():
+    """A BatchNorm with negative scales cannot move through MaxPool and stays in place"""
+    model = build_model(negative_scales=True)
+    folded, stats = fold_batchnorms(model)
+    assert stats["kept"] == 4, stats
+    for batch_size, result in check_parity(model, folded).items():
+        assert result["allclose"] and result["top1_match"], (batch_size, result)
+
+def test_frozen_model_parity():
+    """The frozen TorchScript module matches the original model"""
+    model = build_model()
+    frozen = freeze(fold_batchnorms(model)[0])
+    for batch_size, result in check_parity(model, frozen).items():
+        assert result["allclose"] and result["top1_match"], (batch_size, result)
+
+def main():
+    print("🧪 Testing BatchNorm folding and channels_last optimization...")
+    test_folded_model_parity()
+    print("✅ Folded model matches the original")
+    test_negative_scales_are_kept_before_maxpool()
+    print("✅ Negative-scale BatchNorms are kept before MaxPool")
+    test_frozen_model_parity()
+    print("✅ Frozen TorchScript model matches the original")
+
+    model = build_model()
+    frozen = freeze(fold_batchnorms(model)[0])
+    for batch_size in (1, 8):
+        base = benchmark(model, batch_size)
+        fast = benchmark(frozen, batch_size)
+        print(f"⏱️  batch={batch_size}: {base:.1f} ms -> {fast:.1f} ms ({base / fast:.2f}x)")
+
+if __name__ == "__main__":
+    main()
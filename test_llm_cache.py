@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the Gemini response cache
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'farmercrophealthbackend'))
+
+from agents.llm_cache import LLMResponseCache
+from prediction_cache import TieredCache
+
+ANSWER = {"title": "Treatment for Early blight on Tomato", "steps": ["Remove infected leaves."]}
+
+def build_cache(**kwargs):
+    kwargs.setdefault("db_path", None)
+    return LLMResponseCache(enabled=True, **kwargs)
+
+def test_prompt_fingerprint_ignores_whitespace():
+    """Reformatted prompts share a key; other agents, prompts and models do not"""
+    cache = build_cache()
+    key = cache.key_for("Crop: Tomato\n    Disease: Early blight", "AdvisorAgent")
+    assert cache.key_for("  Crop: Tomato Disease:   Early blight ", "AdvisorAgent") == key
+    assert cache.key_for("Crop: Tomato Disease: Early blight", "GreenAgent") != key
+    assert cache.key_for("Crop: Potato Disease: Early blight", "AdvisorAgent") != key
+    other_model = build_cache(model_signature="gemini-2.0-flash")
+    assert other_model.key_for("Crop: Tomato Disease: Early blight", "AdvisorAgent") != key
+
+def test_semantic_keys_ignore_prompt_noise():
+    """With explicit keys, prompts that differ only in per-request details share an entry"""
+    cache = build_cache()
+    keys = {"crop": "Tomato", "disease": "Early blight", "location": "Telangana"}
+    key = cache.key_for("Confidence Level: 91.20%", "AgenticAdvisorAgent", keys)
+    assert cache.key_for("Confidence Level: 77.05%", "AgenticAdvisorAgent", keys) == key
+    assert cache.key_for("Confidence Level: 91.20%", "AgenticAdvisorAgent", {**keys, "location": "Punjab"}) != key
+
+def test_per_agent_ttls():
+    """Agents match TTL rules by pattern; a zero TTL disables caching"""
+    cache = build_cache(agent_ttls="CommunityAgent=600,*_planner=0", default_ttl=60)
+    assert cache.ttl_for("CommunityAgent") == 600
+    assert cache.ttl_for("AdvisorAgent") == 60
+    assert cache.key_for("plan", "advisor_agent_planner") is None
+
+def test_hits_copies_and_errors():
+    """Hits are copies, and error responses are never cached"""
+    cache = build_cache()
+    key = cache.key_for("prompt", "AdvisorAgent")
+    cache.put(key, "AdvisorAgent", ANSWER)
+    response, fresh = cache.lookup(key)
+    assert fresh and response == ANSWER
+    response["steps"].append("mutated")
+    assert cache.lookup(key)[0] == ANSWER
+    error_key = cache.key_for("other prompt", "AdvisorAgent")
+    cache.put(error_key, "AdvisorAgent", {"error": "quota exceeded"})
+    assert cache.lookup(error_key) == (None, False)
+
+def test_stale_while_revalidate():
+    """Expired entries are served as stale within the grace period, and only one refresh is claimed"""
+    cache = build_cache(agent_ttls="AdvisorAgent=0.05", stale_seconds=60)
+    key = cache.key_for("prompt", "AdvisorAgent")
+    cache.put(key, "AdvisorAgent", ANSWER)
+    time.sleep(0.1)
+    response, fresh = cache.lookup(key)
+    assert response == ANSWER and not fresh
+    assert cache.begin_refresh(key) and not cache.begin_refresh(key)
+    cache.end_refresh(key)
+    # Plain get() never returns stale entries
+    assert cache.cache.get(key) is None
+
+def test_disk_tier_survives_restart():
+    """Entries written to the sqlite tier are found by a new cache instance"""
+    db_path = os.path.join(tempfile.mkdtemp(), "llm_cache.db")
+    first = build_cache(db_path=db_path)
+    key = first.key_for("prompt", "CommunityAgent")
+    first.put(key, "CommunityAgent", ANSWER)
+    second = build_cache(db_path=db_path)
+    assert second.lookup(key) == (ANSWER, True)
+    assert second.stats()["disk_hits"] == 1
+
+def test_tiered_cache_without_grace_expires():
+    """Without stale_seconds, TieredCache keeps its old expiry behaviour"""
+    cache = TieredCache("test", ttl_seconds=0.05, db_path=None)
+    cache.put("k", 1)
+    time.sleep(0.1)
+    assert cache.lookup("k") == (None, False)
+    assert cache.stats()["expirations"] == 1
+
+def main():
+    print("🧪 Testing the LLM response cache...")
+    test_prompt_fingerprint_ignores_whitespace()
+    print("✅ Prompt fingerprints ignore whitespace and include agent and model")
+    test_semantic_keys_ignore_prompt_noise()
+    print("✅ Semantic keys ignore per-request prompt details")
+    test_per_agent_ttls()
+    print("✅ Per-agent TTL rules apply")
+    test_hits_copies_and_errors()
+    print("✅ Hits are copies and errors are not cached")
+    test_stale_while_revalidate()
+    print("✅ Stale entries are served while one refresh runs")
+    test_disk_tier_survives_restart()
+    print("✅ The sqlite tier survives a restart")
+    test_tiered_cache_without_grace_expires()
+    print("✅ Caches without a grace period still expire")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the Gemini call scheduler
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'farmercrophealthbackend'))
+
+from agents.llm_scheduler import CircuitBreaker, DeadlineExceeded, LLMScheduler, backoff_delay
+
+def test_priority_order():
+    """With one slot, queued calls are admitted by priority class, FIFO within a class"""
+    async def run():
+        scheduler = LLMScheduler(rate=1000, burst=1000, max_concurrency=1)
+        order = []
+
+        async def call(name):
+            await scheduler.acquire(scheduler.priority_for(name), time.monotonic() + 5)
+            order.append(name)
+            await asyncio.sleep(0.01)
+            scheduler.release()
+
+        await scheduler.acquire(0, time.monotonic() + 5) # Hold the only slot while the others queue
+        tasks = [asyncio.create_task(call(name)) for name in
+                 ("CommunityAgent", "GreenAgent", "AdvisorAgent", "agentic_advisor_planner")]
+        await asyncio.sleep(0.01)
+        scheduler.release()
+        await asyncio.gather(*tasks)
+        return order
+    assert asyncio.run(run()) == ["AdvisorAgent", "agentic_advisor_planner", "GreenAgent", "CommunityAgent"]
+
+def test_token_bucket_spacing():
+    """Once the burst is spent, call starts are spaced 1 / rate apart"""
+    async def run():
+        scheduler = LLMScheduler(rate=20, burst=2, max_concurrency=10)
+        started = time.monotonic()
+        for _ in range(6):
+            await scheduler.acquire(2, started + 5)
+            scheduler.release()
+        return time.monotonic() - started
+    elapsed = asyncio.run(run())
+    assert 0.15 <= elapsed < 0.5, elapsed
+
+def test_deadline_while_queued():
+    """A call still queued at its deadline gives up and does not take a slot later"""
+    async def run():
+        scheduler = LLMScheduler(rate=1000, burst=1000, max_concurrency=1)
+        await scheduler.acquire(0, time.monotonic() + 5)
+        try:
+            await scheduler.acquire(0, time.monotonic() + 0.05)
+            raise AssertionError("acquire should have timed out")
+        except DeadlineExceeded:
+            pass
+        scheduler.release()
+        return scheduler.stats()
+    stats = asyncio.run(run())
+    assert stats["expired_in_queue"] == 1 and stats["active"] == 0 and stats["queued"] == 0
+
+def test_rate_adapts():
+    """Quota errors halve the rate down to the floor; successes win it back gradually"""
+    scheduler = LLMScheduler(rate=4, min_rate=1)
+    for _ in range(5):
+        scheduler.on_rate_limited()
+    assert scheduler.rate == 1
+    scheduler.on_success()
+    assert scheduler.rate == 1.2
+    for _ in range(50):
+        scheduler.on_success()
+    assert scheduler.rate == 4
+
+def test_circuit_breaker():
+    """The breaker opens after repeated failures, lets one probe through after the reset, then closes"""
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=0.05)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+    time.sleep(0.1)
+    assert breaker.allow() and breaker.state == "half_open"
+    assert not breaker.allow() # Only one probe at a time
+    breaker.record_failure()
+    assert breaker.state == "open"
+    time.sleep(0.1)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+def test_probe_without_verdict():
+    """A half-open probe that times out in the queue lets the next call probe instead of wedging the breaker"""
+    async def run():
+        scheduler = LLMScheduler(rate=1000, burst=1000, max_concurrency=1)
+        scheduler.breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0.01)
+        scheduler.on_failure()
+        await asyncio.sleep(0.02)
+        await scheduler.acquire(0, time.monotonic() + 5) # Hold the only slot so the probe has to queue
+        try:
+            async with scheduler.admit(0, time.monotonic() + 0.05):
+                raise AssertionError("the probe should not have been admitted")
+        except DeadlineExceeded:
+            pass
+        scheduler.release()
+        async with scheduler.admit(0, time.monotonic() + 5):
+            scheduler.on_success()
+        return scheduler.breaker.state
+    assert asyncio.run(run()) == "closed"
+
+def test_backoff_bounds():
+    """Backoff delays are jittered within [0, min(cap, base * 2^attempt)]"""
+    for attempt in range(8):
+        bound = min(8, 0.5 * 2 ** attempt)
+        delays = [backoff_delay(attempt, base=0.5, cap=8) for _ in range(200)]
+        assert all(0 <= d <= bound for d in delays)
+        assert max(delays) > bound / 2
+
+def main():
+    print("🧪 Testing the LLM scheduler...")
+    test_priority_order()
+    print("✅ Calls are admitted by priority class")
+    test_token_bucket_spacing()
+    print("✅ The token bucket spaces call starts")
+    test_deadline_while_queued()
+    print("✅ Queued calls give up at their deadline")
+    test_rate_adapts()
+    print("✅ The rate backs off on quota errors and recovers")
+    test_circuit_breaker()
+    print("✅ The circuit breaker opens, probes and closes")
+    test_probe_without_verdict()
+    print("✅ A probe that times out in the queue does not wedge the breaker")
+    test_backoff_bounds()
+    print("✅ Backoff delays stay within their bounds")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the low-rank dense head stays faithful to the original CNN
+"""
+
+import os
+import sys
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'farmercrophealthbackend'))
+
+from crop_cnn import CNN
+from graph_optimization import check_parity, fold_batchnorms
+from low_rank import compress
+
+def build_model():
+    torch.manual_seed(0)
+    return CNN(num_classes=38).eval()
+
+def test_full_rank_is_exact():
+    """A factorization at full rank reproduces the original logits"""
+    model = build_model()
+    compressed, error = compress(model, 1024)
+    assert error < 1e-6
+    inputs = torch.randn(2, 3, 224, 224)
+    with torch.no_grad():
+        assert torch.allclose(compressed(inputs), model(inputs), atol=1e-4)
+
+def test_error_decreases_with_rank():
+    """Higher ranks keep more of the dense layer"""
+    model = build_model()
+    errors = [compress(model, rank)[1] for rank in (32, 128, 512)]
+    assert errors[0] > errors[1] > errors[2]
+
+def test_batchnorm_folds_into_low_rank_head():
+    """The last BatchNorm folds into the first factor of the low-rank head"""
+    compressed, _ = compress(build_model(), 128)
+    folded, stats = fold_batchnorms(compressed)
+    assert stats["folded_into_dense"] == 1, stats
+    for batch_size, result in check_parity(compressed, folded).items():
+        assert result["allclose"] and result["top1_match"], (batch_size, result)
+
+def main():
+    print("🧪 Testing low-rank dense head...")
+    test_full_rank_is_exact()
+    print("✅ Full-rank factorization reproduces the original logits")
+    test_error_decreases_with_rank()
+    print("✅ Reconstruction error decreases with rank")
+    test_batchnorm_folds_into_low_rank_head()
+    print("✅ BatchNorm folding works on the low-rank head")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the model registry's reload path checks and hot reload
+"""
+
+import json
+import os
+import sys
+import tempfile
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'farmercrophealthbackend'))
+
+from crop_cnn import CNN
+from model_registry import ModelRegistry, check_reload_path
+
+CLASSES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'farmercrophealthbackend', 'classes.json')
+
+def write_weights(path, seed):
+    with open(CLASSES_PATH) as f:
+        num_classes = len(json.load(f))
+    torch.manual_seed(seed)
+    torch.save(CNN(num_classes=num_classes).state_dict(), path)
+    return path
+
+def assert_refused(model_path, current_path, allowed_dir=None):
+    try:
+        check_reload_path(model_path, current_path, allowed_dir)
+        raise AssertionError(f"'{model_path}' should have been refused")
+    except ValueError:
+        pass
+
+def test_reload_paths(tmp):
+    """Only existing files inside the allowed directory are accepted, however the path is spelled"""
+    models = os.path.join(tmp, 'models')
+    outside = os.path.join(tmp, 'outside')
+    os.makedirs(models)
+    os.makedirs(outside)
+    current = os.path.join(models, 'current.pt')
+    for path in (current, os.path.join(models, 'next.pt'), os.path.join(outside, 'evil.pt')):
+        open(path, 'wb').close()
+    os.symlink(os.path.join(outside, 'evil.pt'), os.path.join(models, 'link.pt'))
+
+    assert check_reload_path('next.pt', current, None) == os.path.realpath(os.path.join(models, 'next.pt'))
+    assert check_reload_path(os.path.join(models, 'next.pt'), current, None) == os.path.realpath(os.path.join(models, 'next.pt'))
+    assert_refused('../outside/evil.pt', current)
+    assert_refused('sub/../../outside/evil.pt', current)
+    assert_refused(os.path.join(outside, 'evil.pt'), current)
+    assert_refused('link.pt', current) # The symlink resolves outside the directory
+    assert_refused('missing.pt', current)
+    # MODEL_RELOAD_DIR, when set, replaces the model's own directory
+    assert check_reload_path('evil.pt', current, outside) == os.path.realpath(os.path.join(outside, 'evil.pt'))
+    assert_refused('next.pt', current, outside)
+
+def test_reload_changes_fingerprint(tmp):
+    """A reload swaps the model and its fingerprint; a broken file keeps the current model serving"""
+    first = write_weights(os.path.join(tmp, 'first.pt'), seed=0)
+    second = write_weights(os.path.join(tmp, 'second.pt'), seed=1)
+    registry = ModelRegistry(first, CLASSES_PATH, quantization="off", backend="torch")
+    assert registry.fingerprint() == "unloaded" and not registry.readiness()["ready"]
+    assert registry.load()
+    before = registry.fingerprint()
+    assert registry.readiness()["version"] == 1
+
+    result = registry.reload(second)
+    assert result["reloaded"] and result["version"] == 2 and result["model_path"] == second
+    assert registry.fingerprint() != before and registry.fingerprint().startswith("second.pt@")
+
+    broken = os.path.join(tmp, 'broken.pt')
+    with open(broken, 'wb') as f:
+        f.write(b'not a checkpoint')
+    result = registry.reload(broken)
+    assert not result["reloaded"] and result["error"]
+    assert registry.readiness()["model_path"] == second and registry.readiness()["version"] == 2
+    model, class_names = registry.get()
+    with torch.no_grad():
+        assert model(torch.zeros(1, 3, 224, 224)).shape == (1, len(class_names))
+
+def main():
+    print("🧪 Testing the model registry...")
+    with tempfile.TemporaryDirectory() as tmp:
+        test_reload_paths(tmp)
+        print("✅ Reload paths outside the allowed directory are refused")
+        test_reload_changes_fingerprint(tmp)
+        print("✅ Reloads swap the model and its fingerprint, and failed reloads keep serving")
+
+if __name__ == "__main__":
+    main()
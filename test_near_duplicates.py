@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Test script to verify perceptual hashing and near-duplicate upload detection
+"""
+
+import io
+import os
+import random
+import sys
+import time
+
+from PIL import Image, ImageDraw, ImageEnhance, ImageFilter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'farmercrophealthbackend'))
+
+from image_hashing import BKTree, dhash, hamming, phash
+from near_duplicates import NearDuplicateIndex, Upload, fingerprints
+
+def make_leaf(seed, size=224):
+    """A green leaf with brown lesions on a soil background"""
+    rng = random.Random(seed)
+    image = Image.new("RGB", (size, size), (rng.randint(90, 130), rng.randint(70, 100), 50))
+    draw = ImageDraw.Draw(image)
+    cx, cy = size // 2 + rng.randint(-30, 30), size // 2 + rng.randint(-30, 30)
+    draw.ellipse((cx - 70, cy - 45, cx + 70, cy + 45), fill=(60, rng.randint(120, 190), 50))
+    for _ in range(rng.randint(3, 12)):
+        x, y, r = cx + rng.randint(-50, 50), cy + rng.randint(-30, 30), rng.randint(3, 10)
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=(130, 80, 30))
+    return image.filter(ImageFilter.GaussianBlur(1))
+
+def burst_frame(image):
+    """The next frame of a burst: re-encoded, shifted by a few pixels and slightly brighter"""
+    shifted = image.crop((3, 2, image.width, image.height)).resize(image.size)
+    shifted = ImageEnhance.Brightness(shifted).enhance(1.05)
+    buffer = io.BytesIO()
+    shifted.save(buffer, format="JPEG", quality=70)
+    return Image.open(io.BytesIO(buffer.getvalue())).convert("RGB")
+
+def test_hashes_match_burst_frames():
+    """Burst frames stay within a few bits; different leaves do not"""
+    leaf = make_leaf(1)
+    frame = burst_frame(leaf)
+    burst_distance = hamming(phash(leaf), phash(frame))
+    assert burst_distance <= 6
+    assert hamming(dhash(leaf), dhash(frame)) <= 6
+    others = [hamming(phash(leaf), phash(make_leaf(seed))) for seed in range(2, 12)]
+    assert min(others) > burst_distance, (burst_distance, others)
+
+def test_bk_tree_matches_brute_force():
+    """BK-tree radius search returns exactly the brute-force matches"""
+    rng = random.Random(0)
+    values = [rng.getrandbits(64) for _ in range(500)]
+    values += [v ^ (1 << rng.randrange(64)) for v in values[:50]]
+    tree = BKTree()
+    for i, value in enumerate(values):
+        tree.add(value, i)
+    for query in values[:20] + [rng.getrandbits(64) for _ in range(5)]:
+        expected = sorted(i for i, v in enumerate(values) if hamming(query, v) <= 8)
+        assert sorted(i for _, i in tree.search(query, 8)) == expected
+
+def test_index_is_per_user_and_windowed():
+    """Only the same user's recent uploads count as near-duplicates"""
+    index = NearDuplicateIndex(window_seconds=60)
+    leaf = make_leaf(1)
+    hashes = fingerprints(leaf)
+    index.remember("farmer-a", Upload("u1", *hashes, 0.0, "Tomato___Early_blight", "91.00%"))
+    frame_hashes = fingerprints(burst_frame(leaf))
+    # Uploaded at t=0, so it is outside a 60 s window now
+    assert index.find("farmer-a", *frame_hashes) is None
+
+    index.remember("farmer-a", Upload("u2", *hashes, time.time(), "Tomato___Early_blight", "91.00%"))
+    assert index.find("farmer-a", *frame_hashes).upload_id == "u2"
+    assert index.find("farmer-b", *frame_hashes) is None
+    assert index.find("farmer-a", *fingerprints(make_leaf(7))) is None
+
+def test_responses_are_reused_by_scope():
+    """A stored response is handed out per scope, as a copy"""
+    index = NearDuplicateIndex()
+    index.remember("farmer-a", Upload("u1", *fingerprints(make_leaf(1)), time.time(), "Tomato___healthy", "99.00%"))
+    scope = {"endpoint": "predict", "language": "en-US"}
+    index.remember_response("farmer-a", "u1", scope, {"request_info": {"user_id": "farmer-a"}})
+    reused = index.response_for("farmer-a", "u1", scope)
+    reused["request_info"]["changed"] = True
+    assert index.response_for("farmer-a", "u1", scope) == {"request_info": {"user_id": "farmer-a"}}
+    assert index.response_for("farmer-a", "u1", {"endpoint": "predict", "language": "hi-IN"}) is None
+
+def main():
+    print("🧪 Testing near-duplicate detection...")
+    test_hashes_match_burst_frames()
+    print("✅ Burst frames hash alike, different leaves do not")
+    test_bk_tree_matches_brute_force()
+    print("✅ BK-tree search matches brute force")
+    test_index_is_per_user_and_windowed()
+    print("✅ Near-duplicates are per user and time-windowed")
+    test_responses_are_reused_by_scope()
+    print("✅ Earlier responses are reused per scope")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the tiered prediction and response caches
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'farmercrophealthbackend'))
+
+import prediction_cache
+from prediction_cache import TieredCache
+
+RESPONSE = {
+    "request_info": {"user_id": "farmer_1", "session_id": "session_1", "image_id": "img_1"},
+    "prediction": {"crop": "Tomato", "disease": "Early blight"},
+    "similar_cases": [{"image_id": "img_0"}],
+}
+
+def test_lru_eviction():
+    """The least recently used entry is evicted once the cache is full"""
+    cache = TieredCache("test", max_entries=2, db_path=None)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1 # "b" is now least recently used
+    cache.put("c", 3)
+    assert cache.get("b") is None and cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+def test_ttl_expiry():
+    """Entries expire after the cache-wide TTL or their own"""
+    cache = TieredCache("test", ttl_seconds=60, db_path=None)
+    cache.put("short", 1, ttl_seconds=0.05)
+    cache.put("long", 2)
+    time.sleep(0.1)
+    assert cache.get("short") is None and cache.get("long") == 2
+    assert cache.stats()["expirations"] == 1
+
+def test_disk_tier():
+    """The sqlite tier serves entries to a new cache, and namespaces do not mix"""
+    db_path = os.path.join(tempfile.mkdtemp(), "cache.db")
+    TieredCache("prediction", db_path=db_path).put("k", ["Tomato___Early_blight", "91.20%"])
+    restarted = TieredCache("prediction", db_path=db_path)
+    assert restarted.get("k") == ["Tomato___Early_blight", "91.20%"]
+    assert restarted.stats()["disk_hits"] == 1
+    assert TieredCache("response", db_path=db_path).get("k") is None
+
+def test_prediction_round_trip():
+    """Predictions come back as (class_name, confidence); a None key disables caching"""
+    prediction_cache.put_prediction("px:1", "Tomato___Early_blight", "91.20%")
+    assert prediction_cache.get_prediction("px:1") == ("Tomato___Early_blight", "91.20%")
+    prediction_cache.put_prediction(None, "Tomato___Early_blight", "91.20%")
+    assert prediction_cache.get_prediction(None) is None
+
+def test_response_scope_and_copies():
+    """Responses are keyed by scope, and callers get copies they may personalize"""
+    previous, prediction_cache.CACHE_RESPONSES = prediction_cache.CACHE_RESPONSES, True
+    try:
+        scope = {"endpoint": "predict", "language": "en-US"}
+        prediction_cache.put_response("px:1", scope, RESPONSE)
+        assert prediction_cache.get_response("px:1", {**scope, "language": "hi-IN"}) is None
+        response = prediction_cache.get_response("px:1", scope)
+        response["request_info"]["user_id"] = "farmer_2"
+        assert prediction_cache.get_response("px:1", scope) == RESPONSE
+    finally:
+        prediction_cache.CACHE_RESPONSES = previous
+
+def test_stored_response_is_a_snapshot():
+    """Annotating a response after caching it does not change the cached entry"""
+    previous, prediction_cache.CACHE_RESPONSES = prediction_cache.CACHE_RESPONSES, True
+    try:
+        scope = {"endpoint": "agentic_predict", "language": "en-US"}
+        response = {"request_info": {"user_id": "farmer_1"}, "prediction": {"crop": "Tomato"}}
+        prediction_cache.put_response("px:2", scope, response)
+        response["request_info"]["image_id"] = "img_2"
+        response["explanation"] = {"heatmap": "data:image/png;base64,..."}
+        assert prediction_cache.get_response("px:2", scope) == {"request_info": {"user_id": "farmer_1"},
+                                                                 "prediction": {"crop": "Tomato"}}
+    finally:
+        prediction_cache.CACHE_RESPONSES = previous
+
+def test_replay_strips_per_request_fields():
+    """A replayed response carries only the new request's info, never the original session"""
+    response = prediction_cache.replay_response(
+        {**RESPONSE, "request_info": dict(RESPONSE["request_info"])},
+        {"user_id": "farmer_2", "session_id": "session_2"})
+    assert response["request_info"] == {"user_id": "farmer_2", "session_id": "session_2", "cached": True}
+    assert "similar_cases" not in response and response["prediction"] == RESPONSE["prediction"]
+
+def main():
+    print("🧪 Testing the prediction cache...")
+    test_lru_eviction()
+    print("✅ Least recently used entries are evicted")
+    test_ttl_expiry()
+    print("✅ Entries expire after their TTL")
+    test_disk_tier()
+    print("✅ The sqlite tier survives a restart")
+    test_prediction_round_trip()
+    print("✅ Predictions round-trip")
+    test_response_scope_and_copies()
+    print("✅ Responses are scoped and handed out as copies")
+    test_stored_response_is_a_snapshot()
+    print("✅ Cached responses are snapshots taken before annotation")
+    test_replay_strips_per_request_fields()
+    print("✅ Replayed responses do not leak the original session")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the shared preprocessing pipeline matches the torchvision recipe
+"""
+
+import io
+import os
+import sys
+
+import torch
+from PIL import Image, ImageFilter
+from torchvision import transforms
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'farmercrophealthbackend'))
+
+from preprocessing import Preprocessor
+
+# The recipe inference.transform_image used before the shared pipeline
+REFERENCE = transforms.Compose([
+    transforms.Resize((256, 256)),
+    transforms.CenterCrop(224),
+    transforms.ToTensor(),
+    transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+])
+
+def make_leaf_image(width, height, image_format):
+    """Create a synthetic, smoothly varying photo encoded in the given format"""
+    red = Image.linear_gradient('L').resize((width, height))
+    green = Image.effect_noise((width, height), 40).filter(ImageFilter.GaussianBlur(3))
+    blue = Image.radial_gradient('L').resize((width, height))
+    image = Image.merge('RGB', (red, green, blue))
+    buffer = io.BytesIO()
+    options = {'quality': 95} if image_format == 'JPEG' else {}
+    image.save(buffer, format=image_format, **options)
+    buffer.seek(0)
+    return buffer
+
+def reference_tensor(buffer):
+    buffer.seek(0)
+    return REFERENCE(Image.open(buffer).convert('RGB'))
+
+def test_parity_without_draft():
+    """Full decode: the single-resample pipeline matches torchvision closely"""
+    preprocessor = Preprocessor(draft=False)
+    for width, height, image_format in [(640, 480, 'PNG'), (1600, 1200, 'JPEG'), (300, 900, 'JPEG')]:
+        buffer = make_leaf_image(width, height, image_format)
+        expected = reference_tensor(buffer)
+        buffer.seek(0)
+        actual = preprocessor(buffer)
+        assert actual.shape == expected.shape == (3, 224, 224)
+        assert (actual - expected).abs().mean() < 0.02, (width, height, image_format)
+
+def test_parity_with_draft():
+    """Reduced-scale JPEG decode stays close to the full-resolution result"""
+    preprocessor = Preprocessor(draft=True)
+    buffer = make_leaf_image(4000, 3000, 'JPEG')
+    expected = reference_tensor(buffer)
+    buffer.seek(0)
+    actual = preprocessor(buffer)
+    assert (actual - expected).abs().mean() < 0.05
+
+def test_batch_uses_preallocated_tensor():
+    """Batch preprocessing fills one (N, 3, 224, 224) tensor with the per-image results"""
+    preprocessor = Preprocessor(draft=False)
+    buffers = [make_leaf_image(500, 400, 'PNG'), make_leaf_image(800, 800, 'JPEG')]
+    batch = preprocessor.batch(buffers)
+    assert batch.shape == (2, 3, 224, 224)
+    for i, buffer in enumerate(buffers):
+        buffer.seek(0)
+        assert torch.equal(batch[i], preprocessor(buffer))
+
+def main():
+    print("🧪 Testing shared preprocessing pipeline...")
+    test_parity_without_draft()
+    print("✅ Matches torchvision Resize(256) + CenterCrop(224) + Normalize")
+    test_parity_with_draft()
+    print("✅ Draft-mode JPEG decode stays within tolerance")
+    test_batch_uses_preallocated_tensor()
+    print("✅ Batch preprocessing fills a preallocated tensor")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Test script to verify structured channel pruning rebuilds a smaller, equivalent CNN
+"""
+
+import os
+import sys
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'farmercrophealthbackend'))
+
+from crop_cnn import CNN, conv_widths
+from pruning import parse_ratios, prune
+
+def build_model(dead_fraction=0.0):
+    """CNN with realistic BatchNorm statistics; `dead_fraction` of each layer's channels output exactly zero"""
+    torch.manual_seed(0)
+    model = CNN(num_classes=38)
+    for module in model.modules():
+        if isinstance(module, torch.nn.BatchNorm2d):
+            module.running_mean.uniform_(0.0, 0.5)
+            module.running_var.uniform_(0.5, 2.0)
+            module.weight.data.uniform_(0.5, 1.5)
+            module.bias.data.uniform_(-0.5, 0.5)
+            dead = int(module.num_features * dead_fraction)
+            module.weight.data[:dead] = 0
+            module.bias.data[:dead] = 0
+    return model.eval()
+
+def test_no_pruning_is_identity():
+    """A zero ratio keeps every channel and the logits"""
+    model = build_model()
+    pruned = prune(model, parse_ratios("0"))
+    assert conv_widths(pruned) == conv_widths(model)
+    inputs = torch.randn(2, 3, 224, 224)
+    with torch.no_grad():
+        assert torch.allclose(pruned(inputs), model(inputs), atol=1e-5)
+
+def test_dead_channels_are_removed_exactly():
+    """Channels whose BatchNorm scale and shift are zero are pruned first, without changing the output"""
+    model = build_model(dead_fraction=0.25)
+    pruned = prune(model, parse_ratios("0.25"))
+    assert conv_widths(pruned) == tuple(w * 3 // 4 for w in conv_widths(model))
+    inputs = torch.randn(2, 3, 224, 224)
+    with torch.no_grad():
+        assert torch.allclose(pruned(inputs), model(inputs), atol=1e-4)
+
+def test_per_stage_ratios_and_rounding():
+    """Per-stage ratios apply to every conv of the stage, rounded up to the SIMD multiple"""
+    pruned = prune(build_model(), parse_ratios("0,0.25,0.5,0.5,0.9"), round_to=8)
+    assert conv_widths(pruned) == (32, 32, 48, 48, 64, 64, 128, 128, 32)
+    assert pruned.dense_layers[1].in_features == 32 * 7 * 7
+
+def main():
+    print("🧪 Testing structured channel pruning...")
+    test_no_pruning_is_identity()
+    print("✅ Zero ratio keeps the model unchanged")
+    test_dead_channels_are_removed_exactly()
+    print("✅ Dead channels are removed without changing the logits")
+    test_per_stage_ratios_and_rounding()
+    print("✅ Per-stage ratios and channel rounding")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Test script to verify int8 quantization and its calibration gate
+"""
+
+import os
+import sys
+import tempfile
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'farmercrophealthbackend'))
+
+from crop_cnn import CNN
+from quantization import apply_quantization, calibrate, is_quantized, save_static, split_calibration
+
+def build_model():
+    torch.manual_seed(0)
+    return CNN(num_classes=38).eval()
+
+def with_int8_path(path, run):
+    """Run with CROP_HEALTH_INT8_MODEL_PATH pointing at path, restoring the environment afterwards"""
+    previous = os.environ.get("CROP_HEALTH_INT8_MODEL_PATH")
+    os.environ["CROP_HEALTH_INT8_MODEL_PATH"] = path
+    try:
+        return run()
+    finally:
+        if previous is None:
+            del os.environ["CROP_HEALTH_INT8_MODEL_PATH"]
+        else:
+            os.environ["CROP_HEALTH_INT8_MODEL_PATH"] = previous
+
+def test_serving_modes():
+    """off serves the model as is, dynamic and a missing static artifact serve dynamic int8, unknown modes fail"""
+    model = build_model()
+    assert apply_quantization(model, "off") is model
+    dynamic = apply_quantization(model, "dynamic")
+    assert is_quantized(dynamic) and not is_quantized(model)
+
+    missing = os.path.join(tempfile.mkdtemp(), "missing_int8.ts")
+    fallback = with_int8_path(missing, lambda: apply_quantization(model, "static", "weights.pt"))
+    assert is_quantized(fallback) and not isinstance(fallback, torch.jit.ScriptModule)
+
+    artifact = os.path.join(tempfile.mkdtemp(), "weights_int8.ts")
+    save_static(calibrate(model, [torch.randn(2, 3, 224, 224)]), artifact)
+    static = with_int8_path(artifact, lambda: apply_quantization(model, "static", "weights.pt"))
+    assert isinstance(static, torch.jit.ScriptModule)
+
+    try:
+        apply_quantization(model, "int4")
+        raise AssertionError("an unknown mode should be rejected")
+    except ValueError:
+        pass
+
+def test_calibration_split_is_disjoint():
+    """Calibration and held-out images never overlap, cover every image, and depend only on the seed"""
+    paths = [f"leaf_{i}.jpg" for i in range(50)]
+    calibration, held_out = split_calibration(paths, val_fraction=0.2, seed=3)
+    assert not set(calibration) & set(held_out)
+    assert sorted(calibration + held_out) == sorted(paths) and len(held_out) == 10
+    assert split_calibration(paths, val_fraction=0.2, seed=3) == (calibration, held_out)
+    assert len(split_calibration(paths[:3], val_fraction=0.1)[1]) == 1 # At least one held-out image
+
+def test_calibrated_model_agrees():
+    """The calibrated int8 model picks the same top-1 class as fp32 on most inputs"""
+    model = build_model()
+    torch.manual_seed(1)
+    int8_model = calibrate(model, [torch.randn(4, 3, 224, 224) for _ in range(4)])
+    inputs = torch.randn(16, 3, 224, 224)
+    with torch.no_grad():
+        agreement = (model(inputs).argmax(dim=1) == int8_model(inputs).argmax(dim=1)).float().mean().item()
+    assert agreement >= 0.75, agreement
+
+def main():
+    print("🧪 Testing int8 quantization...")
+    test_serving_modes()
+    print("✅ Quantization modes serve the expected model")
+    test_calibration_split_is_disjoint()
+    print("✅ Calibration and held-out images are disjoint")
+    test_calibrated_model_agrees()
+    print("✅ The calibrated int8 model agrees with fp32")
+
+if __name__ == "__main__":
+    main()
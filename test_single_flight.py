@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Test script to verify that identical concurrent Gemini calls are coalesced
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'farmercrophealthbackend'))
+os.environ.setdefault("GEMINI_API_KEY", "test-stub") # The provider is never called: calls are stub coroutines
+
+from agents.llm_client import SingleFlight
+
+ANSWER = {"title": "Treatment for Early blight on Tomato", "steps": ["Remove infected leaves."]}
+
+def stub_call(calls, delay=0.05):
+    """A coroutine factory standing in for one provider call; counts how often it is started"""
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return ANSWER
+    return call
+
+def test_one_call_for_concurrent_callers():
+    """N concurrent identical calls start one provider call, and every caller gets its own copy"""
+    async def run():
+        flight, calls = SingleFlight(), []
+        results = await asyncio.gather(*[flight.run("key", stub_call(calls)) for _ in range(5)])
+        return flight, calls, results
+    flight, calls, results = asyncio.run(run())
+    assert len(calls) == 1
+    assert flight.stats()["issued"] == 1 and flight.stats()["coalesced"] == 4
+    assert all(result == ANSWER for result in results)
+    results[0]["steps"].append("mutated")
+    assert all(result == ANSWER for result in results[1:]) and ANSWER["steps"] == ["Remove infected leaves."]
+
+def test_cancelled_waiter_does_not_cancel_others():
+    """A caller that gives up leaves the shared call running for the rest"""
+    async def run():
+        flight, calls = SingleFlight(), []
+        tasks = [asyncio.create_task(flight.run("key", stub_call(calls, delay=0.1))) for _ in range(3)]
+        await asyncio.sleep(0.02)
+        tasks[0].cancel()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        return calls, results
+    calls, results = asyncio.run(run())
+    assert len(calls) == 1
+    assert isinstance(results[0], asyncio.CancelledError)
+    assert results[1:] == [ANSWER, ANSWER]
+
+def test_key_forgotten_after_completion():
+    """Once a call finishes its key is released, so the next caller starts a new call"""
+    async def run():
+        flight, calls = SingleFlight(), []
+        await flight.run("key", stub_call(calls))
+        in_flight = flight.stats()["in_flight"]
+        await flight.run("key", stub_call(calls))
+        return flight, calls, in_flight
+    flight, calls, in_flight = asyncio.run(run())
+    assert in_flight == 0 and flight.stats()["in_flight"] == 0
+    assert len(calls) == 2 and flight.stats()["coalesced"] == 0
+
+def main():
+    print("🧪 Testing single-flight coalescing of Gemini calls...")
+    test_one_call_for_concurrent_callers()
+    print("✅ Concurrent identical calls share one provider call and get independent copies")
+    test_cancelled_waiter_does_not_cancel_others()
+    print("✅ Cancelling one waiter does not cancel the others")
+    test_key_forgotten_after_completion()
+    print("✅ Keys are forgotten after completion")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Test script to verify tiled inference for high-resolution photos
+"""
+
+import os
+import sys
+
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'farmercrophealthbackend'))
+
+import tiling
+from tiling import TiledPredictor, tile_positions
+
+HEALTHY = "Tomato___healthy"
+BLIGHT = "Tomato___Early_blight"
+
+def test_tiles_cover_every_pixel():
+    """Tiles start at 0, end flush with the edge and overlap by at least tile - stride"""
+    for length in (100, 224, 225, 500, 1000, 2048):
+        positions = tile_positions(length, 224, 168)
+        assert positions[0] == 0
+        assert positions[-1] == max(0, length - 224)
+        assert all(0 < b - a <= 168 for a, b in zip(positions, positions[1:]))
+        covered = set()
+        for start in positions:
+            covered.update(range(start, min(length, start + 224)))
+        assert covered == set(range(length))
+
+def test_grid_in_bounded_batches():
+    """Every grid cell is classified once, never more than batch_size tiles at a time"""
+    batches = []
+    def classify_batch(image_tensors):
+        batches.append(len(image_tensors))
+        return [(HEALTHY, 0.95)] * len(image_tensors)
+    predictor = TiledPredictor(tile_size=224, overlap=0.25, batch_size=4)
+    original, tiling.inference.classify_batch = tiling.inference.classify_batch, classify_batch
+    try:
+        tiles = predictor.classify_tiles(Image.new("RGB", (600, 300)))
+    finally:
+        tiling.inference.classify_batch = original
+    rows, cols = len(tile_positions(300, 224, predictor.stride)), len(tile_positions(600, 224, predictor.stride))
+    assert set(tiles) == {(row, col) for row in range(rows) for col in range(cols)}
+    assert sum(batches) == rows * cols and max(batches) <= 4
+
+def test_overlapping_tiles_merge():
+    """A lesion seen on enough confident tiles outvotes healthy ones; unsure tiles are ignored"""
+    predictor = TiledPredictor(min_confidence=0.6, min_disease_tiles=2)
+    tiles = {(0, col): (HEALTHY, 0.95) for col in range(6)}
+    tiles.update({(1, 0): (BLIGHT, 0.8), (1, 1): (BLIGHT, 0.9), (1, 2): (BLIGHT, 0.3)})
+    diagnosis = predictor.aggregate(tiles)
+    assert diagnosis["class_name"] == BLIGHT and diagnosis["confidence"] == "90.00%"
+    assert diagnosis["confident_tiles"] == 8 and diagnosis["affected_share"] == 0.25
+
+    del tiles[(1, 1)] # One confident lesion tile is not enough
+    diagnosis = predictor.aggregate(tiles)
+    assert diagnosis["class_name"] == HEALTHY and diagnosis["is_healthy"]
+
+    diagnosis = predictor.aggregate({(0, 0): (BLIGHT, 0.4), (0, 1): (HEALTHY, 0.5)})
+    assert diagnosis["class_name"] == HEALTHY and diagnosis["confident_tiles"] == 0
+
+def main():
+    print("🧪 Testing tiled inference...")
+    test_tiles_cover_every_pixel()
+    print("✅ Overlapping tiles cover every pixel")
+    test_grid_in_bounded_batches()
+    print("✅ The tile grid is classified in bounded batches")
+    test_overlapping_tiles_merge()
+    print("✅ Tile answers merge into one diagnosis")
+
+if __name__ == "__main__":
+    main()
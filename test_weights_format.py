@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the memory-mapped weights format round-trips the CNN exactly
+"""
+
+import os
+import sys
+import tempfile
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'farmercrophealthbackend'))
+
+from crop_cnn import CNN
+from model_registry import load_model_file
+from weights_format import load_state_dict, read_header, save_state_dict
+
+def build_model():
+    torch.manual_seed(0)
+    model = CNN(num_classes=38)
+    for module in model.modules():
+        if isinstance(module, torch.nn.BatchNorm2d):
+            module.running_mean.uniform_(-0.5, 0.5)
+            module.running_var.uniform_(0.5, 2.0)
+    return model.eval()
+
+def test_round_trip():
+    """Every tensor, including the int64 BatchNorm counters, comes back bit-for-bit"""
+    model = build_model()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'weights.safetensors')
+        save_state_dict(model.state_dict(), path, metadata={"num_classes": 38})
+        header, data_start = read_header(path)
+        assert data_start % 8 == 0
+        assert header["__metadata__"] == {"num_classes": "38"}
+        state_dict, _ = load_state_dict(path)
+        assert state_dict.keys() == model.state_dict().keys()
+        for name, tensor in model.state_dict().items():
+            assert state_dict[name].dtype == tensor.dtype and torch.equal(state_dict[name], tensor), name
+
+def test_registry_loads_mapped_model():
+    """load_model_file serves .safetensors weights with the same logits as the original model"""
+    model = build_model()
+    inputs = torch.randn(2, 3, 224, 224)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'weights.safetensors')
+        save_state_dict(model.state_dict(), path, metadata={"num_classes": 38})
+        mapped = load_model_file(path, 38)
+        with torch.no_grad():
+            assert torch.equal(mapped(inputs), model(inputs))
+
+def main():
+    print("🧪 Testing memory-mapped weights format...")
+    test_round_trip()
+    print("✅ State dict round-trips bit-for-bit")
+    test_registry_loads_mapped_model()
+    print("✅ Registry loads mapped weights with identical logits")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the multi-process inference workers
+"""
+
+import json
+import os
+import signal
+import sys
+import tempfile
+import time
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'farmercrophealthbackend'))
+
+from crop_cnn import CNN
+from worker_pool import WorkerPool
+
+CLASSES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'farmercrophealthbackend', 'classes.json')
+
+def build_pool(tmp):
+    with open(CLASSES_PATH) as f:
+        num_classes = len(json.load(f))
+    torch.manual_seed(0)
+    model = CNN(num_classes=num_classes).eval()
+    path = os.path.join(tmp, 'weights.pt')
+    torch.save(model.state_dict(), path)
+    return WorkerPool(path, CLASSES_PATH, num_workers=2, pin_cores=False, max_batch_size=4, max_wait_ms=5), model
+
+def test_results_in_order(pool, model):
+    """Every future gets the prediction of its own image, whatever batch it ran in"""
+    images = [torch.randn(1, 3, 224, 224) for _ in range(10)]
+    futures = [pool.submit(image) for image in images]
+    with torch.no_grad():
+        expected = [int(model(image).argmax(dim=1)) for image in images]
+    assert [future.result(timeout=60)[0] for future in futures] == expected
+
+def test_dead_worker(pool):
+    """A killed worker fails or re-queues its requests instead of leaving them hanging, and is replaced"""
+    futures = [pool.submit(torch.randn(1, 3, 224, 224)) for _ in range(8)]
+    os.kill(next(iter(pool.stats()["worker_pids"].values())), signal.SIGKILL)
+    for future in futures:
+        try:
+            future.result(timeout=60)
+        except RuntimeError:
+            pass # Failed because its worker died: an answer, not a hang
+    deadline = time.monotonic() + 60
+    while pool.stats()["replacements"] < 1 and time.monotonic() < deadline:
+        time.sleep(0.2)
+    assert pool.stats()["replacements"] == 1
+    assert pool.stats()["alive"] == 2
+    pool.run(torch.randn(1, 3, 224, 224), timeout=60)
+
+def test_bad_restart_keeps_serving(pool, tmp):
+    """A reload with a broken weights file raises and leaves the current workers serving"""
+    broken = os.path.join(tmp, 'broken.pt')
+    with open(broken, 'wb') as f:
+        f.write(b'not a checkpoint')
+    serving = pool.model_path
+    try:
+        pool.restart(broken)
+        raise AssertionError("restart should have failed")
+    except Exception as e:
+        assert not isinstance(e, AssertionError)
+    assert pool.model_path == serving
+    pool.run(torch.randn(1, 3, 224, 224), timeout=60)
+
+def main():
+    print("🧪 Testing the inference worker pool...")
+    with tempfile.TemporaryDirectory() as tmp:
+        pool, model = build_pool(tmp)
+        pool.start()
+        try:
+            test_results_in_order(pool, model)
+            print("✅ Results come back to the right callers")
+            test_dead_worker(pool)
+            print("✅ A dead worker's requests resolve and the workers are replaced")
+            test_bad_restart_keeps_serving(pool, tmp)
+            print("✅ A failed reload keeps the current workers serving")
+        finally:
+            pool.shutdown()
+
+if __name__ == "__main__":
+    main()